@@ -1,25 +1,191 @@
 import os
-from backend.models import pdf_model
+import fitz
+from backend.models import analisis_model, imagen_model, pdf_model
+from backend.utils import cache_resultados
 
-def comprimir(tipo: str, ruta: str, nivel: str = 'media') -> str:
+NIVELES_PDF = ['baja', 'media', 'alta', 'maxima', 'velocidad']
+NIVELES_IMAGEN = list(imagen_model.CONFIGURACIONES_JPEG)
+TIPOS_JPEG = ('jpeg', 'jpg')
+TIPOS_PNG = ('png',)
+
+def comprimir(tipo: str, ruta: str, nivel: str = 'media', workers: int = 1, objetivo_bytes: int = None,
+              ventana: int = None, usar_cache: bool = True) -> str:
+    resultado = comprimir_detallado(tipo, ruta, nivel, workers, objetivo_bytes, ventana, usar_cache=usar_cache)
+    return resultado["mensaje"]
+
+def comprimir_detallado(tipo: str, ruta: str, nivel: str = 'media', workers: int = 1, objetivo_bytes: int = None,
+                        ventana: int = None, progreso=None, usar_cache: bool = True,
+                        salida_unica: bool = False, revisar_cancelacion=None) -> dict:
+    """
+    Igual que comprimir, pero devuelve un dict con 'ok', 'mensaje',
+    'salida' (ruta del archivo comprimido o None) y 'cache' (True si el
+    resultado salió de la caché de resultados sin recomprimir).
+    Con objetivo_bytes se agrega 'objetivo_cumplido'; si es False, 'ok' es
+    False pero 'salida' lleva lo más chico que se logró.
+    progreso: función opcional que recibe los eventos de avance del modelo.
+    salida_unica: cada llamada escribe en su propio archivo temporal en vez
+    de <nombre>_comprimido (para trabajos concurrentes, ver servidor_controller).
+    revisar_cancelacion: función opcional sin argumentos que lanza
+    CompresionCancelada si hay que detenerse; los motores de imágenes la
+    llaman entre pruebas y tiras (los de PDF se detienen desde progreso).
+    """
     print(f"Ruta recibida: {ruta}")
     if not os.path.exists(ruta):
-        return f"El archivo no existe: {ruta}"
+        return {"ok": False, "mensaje": f"El archivo no existe: {ruta}", "salida": None}
 
     tipo = tipo.lower()
     nivel = nivel.lower()
 
+    if tipo in TIPOS_JPEG + TIPOS_PNG:
+        return comprimir_imagen(ruta, tipo, nivel, progreso, usar_cache, salida_unica, revisar_cancelacion)
+    if tipo != 'pdf':
+        return {"ok": False, "mensaje": f"Tipo de archivo no soportado: {tipo}", "salida": None}
+    if objetivo_bytes is not None and objetivo_bytes <= 0:
+        return {"ok": False, "mensaje": f"Tamaño objetivo inválido: {objetivo_bytes}", "salida": None}
+    # Con tamaño objetivo el nivel se elige solo, página por página
+    if objetivo_bytes is None and nivel not in NIVELES_PDF:
+        return {"ok": False, "salida": None,
+                "mensaje": f"Nivel de compresión no soportado: {nivel}. Use: {', '.join(NIVELES_PDF)}"}
+
+    salida = None
     try:
-        if tipo == 'pdf':
-            # Validar niveles disponibles
-            if nivel not in ['baja', 'media', 'alta', 'maxima']:
-                return f"Nivel de compresión no soportado: {nivel}. Use: baja, media, alta, maxima"
+        clave = None
+        salida = pdf_model.ruta_salida_pdf(ruta, salida_unica)
+        if usar_cache:
+            clave = clave_cache(ruta, tipo, nivel, objetivo_bytes)
+            if cache_resultados.recuperar(clave, salida):
+                return resultado_pdf(salida, objetivo_bytes, cache=True)
+
+        if objetivo_bytes is not None:
+            salida = pdf_model.comprimir_pdf_objetivo(ruta, objetivo_bytes, progreso=progreso, ruta_salida=salida)
+        else:
+            salida = pdf_model.comprimir_pdf(ruta, nivel, workers=workers, ventana=ventana, progreso=progreso,
+                                             ruta_salida=salida)
 
-            salida = pdf_model.comprimir_pdf(ruta, nivel)
-            return f"PDF comprimido correctamente: {salida}"
+        if clave and os.path.exists(salida):
+            cache_resultados.guardar(clave, salida)
+        return resultado_pdf(salida, objetivo_bytes, cache=False)
 
+    except pdf_model.CompresionCancelada:
+        descartar_salida(salida, salida_unica)
+        raise
+    except Exception as e:
+        descartar_salida(salida, salida_unica)
+        return {"ok": False, "mensaje": f"Error al comprimir archivo: {str(e)}", "salida": None}
+
+def resultado_pdf(salida: str, objetivo_bytes: int, cache: bool) -> dict:
+    """
+    Resultado de comprimir_detallado para un PDF ya comprimido. Con tamaño
+    objetivo compara la salida con objetivo_bytes: no alcanzarlo no es un
+    error del motor, pero tampoco se informa como éxito.
+    """
+    origen = " (caché)" if cache else ""
+    resultado = {"ok": True, "mensaje": f"PDF comprimido correctamente{origen}: {salida}",
+                 "salida": salida, "cache": cache}
+    if objetivo_bytes is not None:
+        tamaño = os.path.getsize(salida)
+        resultado["objetivo_cumplido"] = tamaño <= objetivo_bytes
+        if not resultado["objetivo_cumplido"]:
+            resultado["ok"] = False
+            resultado["mensaje"] = (f"No se alcanzó el tamaño objetivo{origen}: {tamaño} bytes "
+                                    f"(objetivo {objetivo_bytes}): {salida}")
+    return resultado
+
+def comprimir_imagen(ruta: str, tipo: str, nivel: str, progreso=None, usar_cache: bool = True,
+                     salida_unica: bool = False, revisar_cancelacion=None) -> dict:
+    """
+    Compresión de imágenes sueltas; mismo formato de resultado que
+    comprimir_detallado.
+    """
+    if nivel not in NIVELES_IMAGEN:
+        return {"ok": False, "salida": None,
+                "mensaje": f"Nivel de compresión no soportado: {nivel}. Use: {', '.join(NIVELES_IMAGEN)}"}
+    
+    salida = None
+    try:
+        clave = None
+        salida = imagen_model.ruta_salida_imagen(ruta, salida_unica)
+        if usar_cache:
+            clave = clave_cache(ruta, tipo, nivel)
+            if cache_resultados.recuperar(clave, salida):
+                return {"ok": True, "mensaje": f"Imagen comprimida correctamente (caché): {salida}",
+                        "salida": salida, "cache": True}
+        
+        if tipo in TIPOS_PNG:
+            salida = imagen_model.comprimir_png(ruta, nivel, progreso=progreso, ruta_salida=salida,
+                                                revisar_cancelacion=revisar_cancelacion)
         else:
-            return f"Tipo de archivo no soportado: {tipo}"
+            salida = imagen_model.comprimir_jpeg(ruta, nivel, progreso=progreso, ruta_salida=salida,
+                                                 revisar_cancelacion=revisar_cancelacion)
+        
+        if clave and os.path.exists(salida):
+            cache_resultados.guardar(clave, salida)
+        return {"ok": True, "mensaje": f"Imagen comprimida correctamente: {salida}", "salida": salida, "cache": False}
+    
+    except pdf_model.CompresionCancelada:
+        descartar_salida(salida, salida_unica)
+        raise
+    except Exception as e:
+        descartar_salida(salida, salida_unica)
+        return {"ok": False, "mensaje": f"Error al comprimir archivo: {str(e)}", "salida": None}
 
+def descartar_salida(salida: str, salida_unica: bool):
+    """
+    Borra la salida propia (salida_unica) de un trabajo que falló o se
+    canceló, para no dejar temporales huérfanos.
+    """
+    if salida_unica and salida and os.path.exists(salida):
+        os.remove(salida)
+
+def estimar(ruta: str, tipo: str = 'pdf') -> dict:
+    """
+    Estimación rápida, sin comprimir el archivo entero, del tamaño y el
+    tiempo de cada nivel (ver pdf_model.estimar_pdf).
+    Devuelve un dict con 'ok', 'mensaje', 'tamaño_original' y 'niveles'.
+    """
+    if not os.path.exists(ruta):
+        return {"ok": False, "mensaje": f"El archivo no existe: {ruta}", "niveles": None}
+    
+    tipo = tipo.lower()
+    if tipo != 'pdf':
+        return {"ok": False, "mensaje": f"Tipo de archivo no soportado: {tipo}", "niveles": None}
+    
+    try:
+        niveles = pdf_model.estimar_pdf(ruta, NIVELES_PDF)
+    except Exception as e:
+        return {"ok": False, "mensaje": f"Error al estimar: {str(e)}", "niveles": None}
+    return {"ok": True, "mensaje": "Estimación completada", "tamaño_original": os.path.getsize(ruta),
+            "niveles": niveles}
+
+def analizar(ruta: str, tipo: str = 'pdf') -> dict:
+    """
+    Anatomía del archivo: a qué se van sus bytes (ver
+    analisis_model.analizar_pdf). No descomprime nada: sirve para decidir
+    la estrategia antes de comprimir.
+    Devuelve un dict con 'ok', 'mensaje' y 'analisis'.
+    """
+    if not os.path.exists(ruta):
+        return {"ok": False, "mensaje": f"El archivo no existe: {ruta}", "analisis": None}
+    
+    tipo = tipo.lower()
+    if tipo != 'pdf':
+        return {"ok": False, "mensaje": f"Tipo de archivo no soportado: {tipo}", "analisis": None}
+    
+    try:
+        analisis = analisis_model.analizar_pdf(ruta)
     except Exception as e:
-        return f"Error al comprimir archivo: {str(e)}"
\ No newline at end of file
+        return {"ok": False, "mensaje": f"Error al analizar: {str(e)}", "analisis": None}
+    return {"ok": True, "mensaje": "Análisis completado", "analisis": analisis}
+
+def clave_cache(ruta: str, tipo: str, nivel: str, objetivo_bytes: int = None) -> str:
+    """
+    Clave de la caché de resultados. workers y ventana no entran: solo
+    cambian cómo se reparte el trabajo, no el PDF que sale.
+    """
+    return cache_resultados.calcular_clave(ruta, {
+        'tipo': tipo,
+        'nivel': nivel if objetivo_bytes is None else None,
+        'objetivo_bytes': objetivo_bytes,
+        'motor': imagen_model.VERSION_MOTOR if tipo in TIPOS_JPEG + TIPOS_PNG else pdf_model.VERSION_MOTOR,
+        'pymupdf': fitz.VersionBind
+    })
@@ -0,0 +1,174 @@
+import json
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Manager
+from backend.controllers import compress_controller
+from backend.models import pdf_model
+
+def servir(entrada, salida, max_trabajos: int = 2):
+    """
+    Modo servidor: lee solicitudes JSON (una por línea) de entrada y
+    responde con eventos JSON (uno por línea) en salida.
+
+    Solicitudes:
+    - {"id": "1", "accion": "comprimir", "tipo": "pdf", "ruta": "...", "nivel": "media", ...}
+    - {"id": "2", "accion": "cancelar", "trabajo": "1"}
+    - {"id": "3", "accion": "ping"}
+    - {"id": "4", "accion": "salir"}
+
+    Cada respuesta lleva el "id" de la solicitud que la originó. Los trabajos
+    corren en un pool de procesos que se mantiene vivo entre solicitudes.
+    Un trabajo en curso se detiene al cancelarlo en el siguiente punto de
+    control: cada página de un PDF en un proceso, cada bloque de páginas de
+    un PDF con workers > 1 (el bloque en curso termina) y cada prueba de
+    codificación o tira de una imagen.
+    Cada trabajo deja su resultado en su propio archivo temporal (la
+    "salida" del evento resultado), aunque varios compriman el mismo archivo.
+    """
+    servidor = ServidorCompresion(salida, max_trabajos)
+    try:
+        for linea in entrada:
+            if not linea.strip():
+                continue
+            try:
+                solicitud = json.loads(linea)
+            except ValueError as e:
+                servidor.emitir({'id': None, 'evento': 'error', 'mensaje': f"JSON inválido: {e}"})
+                continue
+            if not servidor.atender(solicitud):
+                break
+    finally:
+        servidor.cerrar()
+
+class ServidorCompresion:
+    """
+    Estado del modo servidor: pool de procesos, trabajos en curso y canal
+    compartido para eventos de avance y cancelaciones.
+    """
+
+    def __init__(self, salida, max_trabajos: int):
+        self.salida = salida
+        self.lock_salida = threading.Lock()
+        self.manager = Manager()
+        self.eventos = self.manager.Queue()
+        self.cancelados = self.manager.dict()
+        self.executor = ProcessPoolExecutor(max_workers=max_trabajos)
+        self.trabajos = {}
+        self.lock_trabajos = threading.Lock()
+        self.hilo_eventos = threading.Thread(target=self.reenviar_eventos, daemon=True)
+        self.hilo_eventos.start()
+
+    def emitir(self, evento: dict):
+        with self.lock_salida:
+            self.salida.write(json.dumps(evento) + "\n")
+            self.salida.flush()
+
+    def atender(self, solicitud: dict) -> bool:
+        """
+        Atiende una solicitud. Devuelve False si el servidor debe terminar.
+        """
+        id_solicitud = solicitud.get('id')
+        accion = solicitud.get('accion')
+
+        if accion == 'ping':
+            with self.lock_trabajos:
+                activos = len(self.trabajos)
+            self.emitir({'id': id_solicitud, 'evento': 'pong', 'activos': activos, 'pid': os.getpid()})
+        elif accion == 'comprimir':
+            self.comprimir(id_solicitud, solicitud)
+        elif accion == 'cancelar':
+            self.cancelar(id_solicitud, solicitud.get('trabajo'))
+        elif accion == 'salir':
+            return False
+        else:
+            self.emitir({'id': id_solicitud, 'evento': 'error', 'mensaje': f"Acción no soportada: {accion}"})
+        return True
+
+    def comprimir(self, id_trabajo, solicitud: dict):
+        with self.lock_trabajos:
+            if id_trabajo is None or id_trabajo in self.trabajos:
+                self.emitir({'id': id_trabajo, 'evento': 'error', 'mensaje': "Id de trabajo vacío o repetido"})
+                return
+            futuro = self.executor.submit(ejecutar_trabajo, id_trabajo, solicitud, self.cancelados, self.eventos)
+            self.trabajos[id_trabajo] = futuro
+        self.emitir({'id': id_trabajo, 'evento': 'aceptado'})
+        futuro.add_done_callback(lambda f: self.terminar(id_trabajo, f))
+
+    def terminar(self, id_trabajo, futuro):
+        with self.lock_trabajos:
+            self.trabajos.pop(id_trabajo, None)
+        self.cancelados.pop(id_trabajo, None)
+
+        if futuro.cancelled():
+            self.emitir({'id': id_trabajo, 'evento': 'cancelado'})
+            return
+        try:
+            resultado = futuro.result()
+        except Exception as e:
+            resultado = {'evento': 'resultado', 'ok': False, 'mensaje': f"Error en el proceso de trabajo: {e}", 'salida': None}
+        resultado['id'] = id_trabajo
+        self.emitir(resultado)
+
+    def cancelar(self, id_solicitud, id_trabajo):
+        with self.lock_trabajos:
+            futuro = self.trabajos.get(id_trabajo)
+        if futuro is None:
+            self.emitir({'id': id_solicitud, 'evento': 'error', 'mensaje': f"Trabajo no encontrado: {id_trabajo}"})
+            return
+        # Si aún no empezó se descarta; si está en curso se detiene en el
+        # próximo punto de control (ver servir)
+        if not futuro.cancel():
+            self.cancelados[id_trabajo] = True
+        self.emitir({'id': id_solicitud, 'evento': 'cancelacion_solicitada', 'trabajo': id_trabajo})
+
+    def reenviar_eventos(self):
+        while True:
+            evento = self.eventos.get()
+            if evento is None:
+                break
+            self.emitir(evento)
+
+    def cerrar(self):
+        """
+        Espera los trabajos en curso y libera el pool y el manager.
+        """
+        self.executor.shutdown(wait=True)
+        self.eventos.put(None)
+        self.hilo_eventos.join()
+        self.manager.shutdown()
+
+def ejecutar_trabajo(id_trabajo, solicitud: dict, cancelados, eventos) -> dict:
+    """
+    Corre dentro de un proceso del pool. Reenvía el avance por la cola de
+    eventos y se detiene si el trabajo fue marcado como cancelado: antes de
+    empezar, en cada evento de avance y en los puntos de control de los
+    motores de imágenes (revisar_cancelacion).
+    """
+    def revisar_cancelacion():
+        if id_trabajo in cancelados:
+            raise pdf_model.CompresionCancelada(id_trabajo)
+
+    def progreso(evento: dict):
+        revisar_cancelacion()
+        evento['id'] = id_trabajo
+        eventos.put(evento)
+
+    try:
+        revisar_cancelacion()
+        resultado = compress_controller.comprimir_detallado(
+            tipo=solicitud.get('tipo', 'pdf'),
+            ruta=solicitud.get('ruta', ''),
+            nivel=solicitud.get('nivel', 'media'),
+            workers=solicitud.get('workers', 1),
+            objetivo_bytes=solicitud.get('objetivo_bytes'),
+            ventana=solicitud.get('ventana'),
+            progreso=progreso,
+            usar_cache=solicitud.get('usar_cache', True),
+            salida_unica=True,
+            revisar_cancelacion=revisar_cancelacion
+        )
+    except pdf_model.CompresionCancelada:
+        return {'evento': 'cancelado'}
+
+    return {'evento': 'resultado', **resultado}
@@ -0,0 +1,176 @@
+import os
+import re
+import time
+import fitz  # PyMuPDF
+
+# Anatomía de un PDF: a qué se van los bytes del archivo. Solo lee la tabla
+# xref y los diccionarios de los objetos (y /Length de los streams): nunca
+# descomprime ni decodifica un stream, así que el costo depende de la
+# cantidad de objetos y no del tamaño del archivo.
+REFERENCIA = re.compile(r"(\d+) \d+ R")
+CLAVES_FUENTE = ("FontFile", "FontFile2", "FontFile3", "ToUnicode", "Widths", "DescendantFonts")
+
+CATEGORIAS = ('imagenes', 'fuentes', 'contenido', 'adjuntos', 'miniaturas', 'metadatos', 'sin_uso', 'estructura')
+
+def analizar_pdf(ruta: str) -> dict:
+    """
+    Reparte los bytes del archivo entre categorías:
+    - imagenes (además por filtro en 'imagenes_por_filtro'),
+    - fuentes (diccionarios, descriptores y programas de fuente),
+    - contenido (streams de páginas y formularios),
+    - adjuntos, miniaturas, metadatos (XMP e /Info),
+    - sin_uso (objetos que nada referencia),
+    - estructura (árbol de páginas, anotaciones, tabla xref y el resto).
+    Los objetos dentro de object streams cuentan por su diccionario sin
+    comprimir, así que las categorías chicas son aproximadas.
+    """
+    inicio = time.perf_counter()
+    tamaño = os.path.getsize(ruta)
+    doc = fitz.open(ruta)
+
+    try:
+        total_xrefs = doc.xref_length()
+        objetos = {}
+        for xref in range(1, total_xrefs):
+            try:
+                objetos[xref] = doc.xref_object(xref, compressed=True)
+            except Exception:
+                continue
+
+        usados = alcanzables(doc, objetos)
+        roles = roles_por_referencia(doc, objetos)
+
+        categorias = dict.fromkeys(CATEGORIAS, 0)
+        por_filtro = {}
+        for xref, texto in objetos.items():
+            categoria = clasificar(doc, xref, roles.get(xref))
+            if categoria == 'interno':
+                # Nadie los referencia y sus bytes quedan en 'estructura'
+                continue
+            bytes_objeto = len(texto) + largo_stream(doc, xref, objetos)
+            if xref not in usados:
+                categorias['sin_uso'] += bytes_objeto
+                continue
+            categorias[categoria] += bytes_objeto
+            if categoria == 'imagenes' and doc.xref_is_stream(xref):
+                filtro = nombre_filtro(doc, xref)
+                datos = por_filtro.setdefault(filtro, {'bytes': 0, 'cantidad': 0})
+                datos['bytes'] += bytes_objeto
+                datos['cantidad'] += 1
+
+        atribuidos = sum(categorias.values())
+        categorias['estructura'] += max(tamaño - atribuidos, 0)
+        paginas = doc.page_count
+    finally:
+        doc.close()
+
+    return {
+        'tamaño': tamaño,
+        'paginas': paginas,
+        'objetos': len(objetos),
+        'categorias': categorias,
+        'fracciones': {k: round(v / tamaño, 4) if tamaño else 0 for k, v in categorias.items()},
+        'imagenes_por_filtro': por_filtro,
+        'segundos': round(time.perf_counter() - inicio, 4)
+    }
+
+def alcanzables(doc, objetos: dict) -> set:
+    """
+    xrefs alcanzables desde el trailer siguiendo las referencias de los
+    diccionarios.
+    """
+    pendientes = [int(n) for n in REFERENCIA.findall(doc.pdf_trailer(compressed=True))]
+    usados = set()
+    while pendientes:
+        xref = pendientes.pop()
+        if xref in usados or xref not in objetos:
+            continue
+        usados.add(xref)
+        pendientes.extend(int(n) for n in REFERENCIA.findall(objetos[xref]))
+    return usados
+
+def roles_por_referencia(doc, objetos: dict) -> dict:
+    """
+    Roles que solo se conocen por quién referencia al objeto: streams de
+    contenido de páginas, miniaturas, programas de fuente y adjuntos.
+    """
+    roles = {}
+    for xref in objetos:
+        tipo = doc.xref_get_key(xref, "Type")[1]
+        if tipo == "/Page":
+            for n in referencias_clave(doc, xref, "Contents"):
+                roles[n] = 'contenido'
+            for n in referencias_clave(doc, xref, "Thumb"):
+                roles[n] = 'miniaturas'
+        elif tipo in ("/Font", "/FontDescriptor"):
+            for clave in CLAVES_FUENTE:
+                for n in referencias_clave(doc, xref, clave):
+                    roles[n] = 'fuentes'
+        elif tipo == "/Filespec":
+            # /EF: diccionario (directo o referenciado) con los streams /F y /UF
+            for n in referencias_clave(doc, xref, "EF"):
+                roles[n] = 'adjuntos'
+                for m in REFERENCIA.findall(objetos.get(n, "")):
+                    roles[int(m)] = 'adjuntos'
+
+    tipo_info, valor_info = doc.xref_get_key(-1, "Info")
+    if tipo_info == "xref":
+        roles[int(valor_info.split()[0])] = 'metadatos'
+    return roles
+
+def referencias_clave(doc, xref: int, clave: str) -> list:
+    """
+    xrefs a los que apunta la clave del objeto (referencia o array).
+    """
+    tipo, valor = doc.xref_get_key(xref, clave)
+    if tipo in ("xref", "array", "dict"):
+        return [int(n) for n in REFERENCIA.findall(valor)]
+    return []
+
+def largo_stream(doc, xref: int, objetos: dict) -> int:
+    """
+    Bytes del stream según /Length (resuelto si es indirecto), sin leerlo.
+    """
+    if not doc.xref_is_stream(xref):
+        return 0
+    tipo, valor = doc.xref_get_key(xref, "Length")
+    try:
+        if tipo == "xref":
+            return int(objetos.get(int(valor.split()[0]), "0"))
+        return int(valor)
+    except ValueError:
+        return 0
+
+def clasificar(doc, xref: int, rol=None) -> str:
+    """
+    Categoría de un objeto alcanzable.
+    """
+    if rol:
+        return rol
+    tipo = doc.xref_get_key(xref, "Type")[1]
+    subtipo = doc.xref_get_key(xref, "Subtype")[1]
+    # Object streams (su contenido son diccionarios ya contados), streams
+    # xref y el diccionario de linealización
+    if tipo in ("/ObjStm", "/XRef") or doc.xref_get_key(xref, "Linearized")[0] != "null":
+        return 'interno'
+    if subtipo == "/Image":
+        return 'imagenes'
+    if subtipo == "/Form":
+        return 'contenido'
+    if tipo in ("/Font", "/FontDescriptor") or doc.xref_get_key(xref, "Length1")[0] != "null":
+        return 'fuentes'
+    if tipo == "/Metadata":
+        return 'metadatos'
+    if tipo == "/EmbeddedFile":
+        return 'adjuntos'
+    return 'estructura'
+
+def nombre_filtro(doc, xref: int) -> str:
+    """
+    Filtro de la imagen ('DCTDecode', 'FlateDecode'...; 'ninguno' si no
+    tiene; los filtros encadenados se unen con '+').
+    """
+    tipo, valor = doc.xref_get_key(xref, "Filter")
+    if tipo == "null":
+        return 'ninguno'
+    return '+'.join(re.findall(r"/(\w+)", valor)) or valor
@@ -0,0 +1,922 @@
+import io
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from multiprocessing import shared_memory
+from PIL import Image, ImageChops, ImageCms, ImageOps, JpegImagePlugin, PngImagePlugin
+
+# Image.open rechaza las imágenes que pasan Image.MAX_IMAGE_PIXELS (bombas
+# de descompresión). Los PNG y JPEG de este motor se abren con abrir_imagen,
+# que no lo comprueba: el límite se aplica recién al cargar una imagen
+# entera (cargar_entera), porque los PNG por tiras y los JPEG con draft
+# nunca tienen la imagen completa en memoria
+FIRMAS_IMAGEN = ((b'\x89PNG\r\n\x1a\n', PngImagePlugin.PngImageFile),
+                 (b'\xff\xd8\xff', JpegImagePlugin.JpegImageFile))
+
+# Entra en la clave de la caché de resultados: cambiarla cuando cambie la
+# imagen que produce el motor
+VERSION_MOTOR = 5
+
+# Niveles para imágenes JPEG: calidad y lado mayor máximo del resultado
+# rapido: sin pasada de optimización de Huffman y reducción BILINEAR
+CONFIGURACIONES_JPEG = {
+    'baja': {'calidad': 85, 'max_dimension': 4000},
+    'media': {'calidad': 75, 'max_dimension': 2500},
+    'alta': {'calidad': 60, 'max_dimension': 1800},
+    'maxima': {'calidad': 45, 'max_dimension': 1200},
+    'velocidad': {'calidad': 70, 'max_dimension': 2000, 'rapido': True}
+}
+
+# Niveles para PNG. Todos sin pérdida salvo 'maxima': con 'colores', las
+# imágenes de hasta 256 colores (capturas, maquetas) se cuantizan a esa
+# paleta aunque cambien algunos píxeles; las fotos y los degradados tienen
+# más colores y nunca se cuantizan (ver a_paleta). Se prueban todas las combinaciones de filtro de fila uniforme
+# ('filtros', además del adaptativo de PIL; 5 es el adaptativo propio),
+# estrategia y nivel de zlib, y queda la más chica.
+CONFIGURACIONES_PNG = {
+    'baja': {'colores': None, 'filtros': (0,), 'estrategias': (zlib.Z_DEFAULT_STRATEGY,),
+             'niveles_zlib': (9,)},
+    'media': {'colores': None, 'filtros': (0, 1, 2, 5), 'estrategias': (zlib.Z_DEFAULT_STRATEGY, zlib.Z_FILTERED),
+              'niveles_zlib': (9,)},
+    'alta': {'colores': None, 'filtros': (0, 1, 2, 3, 5),
+             'estrategias': (zlib.Z_DEFAULT_STRATEGY, zlib.Z_FILTERED, zlib.Z_RLE), 'niveles_zlib': (9,)},
+    'maxima': {'colores': 128, 'filtros': (0, 1, 2, 3, 5),
+               'estrategias': (zlib.Z_DEFAULT_STRATEGY, zlib.Z_FILTERED, zlib.Z_RLE), 'niveles_zlib': (6, 9)},
+    'velocidad': {'colores': None, 'filtros': (), 'estrategias': (zlib.Z_DEFAULT_STRATEGY,),
+                  'niveles_zlib': (6,)}
+}
+
+# Hilos para las pruebas de codificación: zlib y el codificador de PIL
+# sueltan el GIL mientras comprimen
+HILOS_PNG = os.cpu_count() or 1
+
+# Imágenes grandes (bytes sin comprimir): las pruebas van de a una, cada
+# una con deflate por bloques en paralelo, para no tener varias copias
+# filtradas en memoria a la vez
+UMBRAL_PNG_GRANDE = 16 << 20
+
+# PNG enormes (bytes sin comprimir): se decodifican y codifican por tiras
+# de BYTES_TIRA, así que la memoria depende de la tira y no de la imagen
+UMBRAL_PNG_TIRAS = 256 << 20
+BYTES_TIRA = 16 << 20
+
+# Deflate por bloques (como pigz): cada bloque se comprime por separado con
+# los últimos 32 KiB del anterior como diccionario y termina en un sync
+# flush, así que los pedazos se concatenan en un único flujo válido
+BLOQUE_DEFLATE = 1 << 20
+VENTANA_DEFLATE = 32 * 1024
+
+# Filtros de fila que se calculan a mano (ninguno, sub, up, promedio; Paeth
+# no) y el código, fuera del estándar, del que elige entre ellos por fila
+FILTROS_ADAPTATIVO = (0, 1, 2, 3)
+FILTRO_ADAPTATIVO = 5
+
+# Lotes: imágenes decodificadas a la vez (en memoria compartida o
+# decodificándose) por proceso del pool, si no se indica max_en_vuelo
+EN_VUELO_POR_PROCESO = 2
+
+# Tipo de color PNG de cada modo de PIL que se escribe a mano
+TIPOS_COLOR_PNG = {'L': 0, 'RGB': 2, 'P': 3, 'LA': 4, 'RGBA': 6}
+
+def ruta_salida_imagen(ruta: str, unica: bool = False) -> str:
+    """
+    Ruta donde se deja la imagen comprimida: <nombre>_comprimido.<ext> en
+    la carpeta temporal. Con unica, un archivo nuevo con sufijo al azar
+    (mkstemp), para trabajos que corren a la vez y pueden repetir nombre.
+    """
+    nombre, extension = os.path.splitext(os.path.basename(ruta))
+    if unica:
+        descriptor, ruta_salida = tempfile.mkstemp(prefix=f"{nombre}_comprimido_", suffix=extension)
+        os.close(descriptor)
+        return ruta_salida
+    return os.path.join(tempfile.gettempdir(), f"{nombre}_comprimido{extension}")
+
+def comprimir_jpeg(ruta: str, nivel: str = 'media', progreso=None, ruta_salida: str = None,
+                   revisar_cancelacion=None) -> str:
+    """
+    Recomprime una foto JPEG: la decodifica ya reducida (draft), corrige la
+    orientación EXIF, la lleva a max_dimension y la codifica con la calidad
+    del nivel sin EXIF, XMP ni comentarios (el perfil ICC se conserva: es
+    color, no metadatos). Nunca devuelve un archivo más grande que el
+    original.
+    progreso: función opcional que recibe un evento al terminar.
+    ruta_salida: dónde dejarlo (por defecto, ruta_salida_imagen).
+    revisar_cancelacion: función opcional sin argumentos que lanza una
+    excepción si hay que detenerse; se llama entre decodificar y codificar.
+    """
+    config = CONFIGURACIONES_JPEG.get(nivel, CONFIGURACIONES_JPEG['media'])
+    ruta_salida = ruta_salida or ruta_salida_imagen(ruta)
+
+    with abrir_imagen(ruta) as img:
+        if img.format != 'JPEG':
+            raise ValueError(f"No es un JPEG: {img.format}")
+        img, icc = decodificar_jpeg(img, config)
+        if revisar_cancelacion:
+            revisar_cancelacion()
+        guardar_jpeg(img, ruta_salida, config, icc)
+
+    no_mayor_que_original(ruta, ruta_salida)
+    if progreso:
+        progreso({'evento': 'pagina', 'pagina': 1, 'total': 1, 'bytes_nuevos': os.path.getsize(ruta_salida)})
+    print(f"Imagen comprimida creada en {ruta_salida} con tamaño: {os.path.getsize(ruta_salida)} bytes")
+    return ruta_salida
+
+def decodificar_jpeg(img, config: dict) -> tuple:
+    """
+    Imagen lista para codificar: decodificada ya reducida, orientada, en L
+    o RGB y con el lado mayor en max_dimension. Devuelve la imagen y el
+    perfil ICC que le corresponde: el original si el modo no cambió; si
+    cambió (CMYK, por ejemplo), el perfil original ya no describe los
+    píxeles, así que se convierte con él a sRGB y no se guarda ninguno.
+    """
+    icc = img.info.get('icc_profile')
+    tamaño = tamaño_final(img.size, config['max_dimension'])
+
+    # Decodificación en el dominio DCT a 1/2, 1/4 o 1/8: la más chica
+    # que no quede por debajo del tamaño final (el límite es sobre el
+    # lado mayor, así que no depende de la orientación EXIF)
+    if tamaño != img.size:
+        img.draft(img.mode if img.mode in ('L', 'RGB') else None, tamaño)
+    cargar_entera(img)
+    img = ImageOps.exif_transpose(img)
+    if img.mode not in ('L', 'RGB'):
+        img = a_srgb(img, icc)
+        icc = None
+
+    tamaño = tamaño_final(img.size, config['max_dimension'])
+    if tamaño != img.size:
+        filtro = Image.Resampling.BILINEAR if config.get('rapido') else Image.Resampling.LANCZOS
+        img = img.resize(tamaño, filtro)
+    return img, icc
+
+def a_srgb(img, icc=None):
+    """
+    La imagen en RGB: con su perfil ICC, convertida a sRGB con ImageCms;
+    sin perfil (o si el perfil no sirve), con la conversión de PIL.
+    """
+    if icc:
+        try:
+            origen = ImageCms.ImageCmsProfile(io.BytesIO(icc))
+            return ImageCms.profileToProfile(img, origen, ImageCms.createProfile('sRGB'), outputMode='RGB')
+        except (ImageCms.PyCMSError, OSError) as e:
+            print(f"No se pudo convertir con el perfil ICC ({e}): se convierte sin él")
+    return img.convert('RGB')
+
+def guardar_jpeg(img, ruta_salida: str, config: dict, icc=None):
+    """
+    Codifica con la calidad del nivel; rapido: sin la pasada de
+    optimización de Huffman.
+    """
+    # PIL vuelve a escribir lo que quede en info (comentarios, XMP)
+    img.info = {}
+    img.save(ruta_salida, format='JPEG', quality=config['calidad'], optimize=not config.get('rapido'),
+             icc_profile=icc)
+
+def no_mayor_que_original(ruta: str, ruta_salida: str) -> str:
+    """
+    Garantía final: si la salida pesa más que el original, se entrega una
+    copia del original.
+    """
+    if os.path.getsize(ruta_salida) > os.path.getsize(ruta):
+        print("La imagen recomprimida pesa más que la original: se conserva la original")
+        shutil.copyfile(ruta, ruta_salida)
+    return ruta_salida
+
+def abrir_imagen(ruta: str):
+    """
+    Abre un PNG o un JPEG (sin cargarlo) con su clase de PIL, sin el
+    control de tamaño de Image.open: el tamaño se controla en cargar_entera
+    o, por tiras, no hace falta. Cualquier otro formato pasa por Image.open.
+    """
+    with open(ruta, 'rb') as archivo:
+        cabecera = archivo.read(8)
+    for firma, clase in FIRMAS_IMAGEN:
+        if cabecera.startswith(firma):
+            return clase(ruta)
+    return Image.open(ruta)
+
+def cargar_entera(img):
+    """
+    Carga la imagen completa, salvo que pase Image.MAX_IMAGE_PIXELS (con
+    draft cuenta el tamaño ya reducido).
+    """
+    if Image.MAX_IMAGE_PIXELS and img.width * img.height > Image.MAX_IMAGE_PIXELS:
+        raise ValueError(f"Imagen demasiado grande para cargarla entera: {img.width}x{img.height}")
+    img.load()
+
+def tamaño_final(tamaño: tuple, max_dimension: int) -> tuple:
+    """
+    Tamaño con el lado mayor limitado a max_dimension (nunca amplía).
+    """
+    ancho, alto = tamaño
+    escala = max_dimension / max(ancho, alto)
+    if escala >= 1:
+        return tamaño
+    return max(1, round(ancho * escala)), max(1, round(alto * escala))
+
+def comprimir_png(ruta: str, nivel: str = 'media', progreso=None, ruta_salida: str = None,
+                  revisar_cancelacion=None) -> str:
+    """
+    Optimiza un PNG: reduce la imagen a lo mínimo que la representa
+    (reducir_png) y la codifica con cada combinación de filtro y zlib del
+    nivel en paralelo, quedándose con la más chica. Los PNG enormes van
+    por tiras (png_por_tiras). Los textos y la fecha del original no se
+    copian; el perfil ICC sí. Nunca devuelve un archivo más grande que el
+    original.
+    progreso: función opcional que recibe un evento al terminar.
+    ruta_salida: dónde dejarlo (por defecto, ruta_salida_imagen).
+    revisar_cancelacion: función opcional sin argumentos que lanza una
+    excepción si hay que detenerse; se llama entre pruebas y entre tiras.
+    """
+    config = CONFIGURACIONES_PNG.get(nivel, CONFIGURACIONES_PNG['media'])
+    ruta_salida = ruta_salida or ruta_salida_imagen(ruta)
+
+    with abrir_imagen(ruta) as img:
+        if img.format != 'PNG':
+            raise ValueError(f"No es un PNG: {img.format}")
+        icc = img.info.get('icc_profile')
+        if por_tiras(img):
+            png_por_tiras(ruta, img, ruta_salida, config, icc, revisar_cancelacion)
+        else:
+            cargar_entera(img)
+            datos = codificar_png(reducir_png(img, config['colores']), config, icc,
+                                  revisar_cancelacion=revisar_cancelacion)
+            with open(ruta_salida, 'wb') as archivo:
+                archivo.write(datos)
+
+    no_mayor_que_original(ruta, ruta_salida)
+    if progreso:
+        progreso({'evento': 'pagina', 'pagina': 1, 'total': 1, 'bytes_nuevos': os.path.getsize(ruta_salida)})
+    print(f"Imagen comprimida creada en {ruta_salida} con tamaño: {os.path.getsize(ruta_salida)} bytes")
+    return ruta_salida
+
+def codificar_png(img, config: dict, icc=None, hilos: int = HILOS_PNG, revisar_cancelacion=None) -> bytes:
+    """
+    La menor de las codificaciones candidatas (pruebas_png), probadas en
+    'hilos' hilos. revisar_cancelacion se llama al terminar cada prueba; si
+    lanza, las pruebas que no empezaron se descartan.
+    """
+    grande = len(img.getbands()) * img.width * img.height > UMBRAL_PNG_GRANDE
+    pruebas = pruebas_png(img, config, icc, grande, hilos, revisar_cancelacion)
+    mejor = None
+    with ThreadPoolExecutor(max_workers=1 if grande else min(hilos, len(pruebas))) as ejecutor:
+        try:
+            for datos in ejecutor.map(lambda prueba: prueba(), pruebas):
+                if revisar_cancelacion:
+                    revisar_cancelacion()
+                if mejor is None or len(datos) < len(mejor):
+                    mejor = datos
+        except BaseException:
+            ejecutor.shutdown(cancel_futures=True)
+            raise
+    print(f"PNG: {len(pruebas)} codificaciones probadas ({img.mode}), la menor pesa {len(mejor)} bytes")
+    return mejor
+
+def reducir_png(img, colores: int = None):
+    """
+    Modo más chico que representa la imagen: sin alfa si es opaca del todo,
+    en grises si no tiene color y con paleta si los colores entran (PIL
+    baja la profundidad a 1, 2 o 4 bits cuando la paleta es chica).
+    Sin colores, solo cambios exactos; con colores, las imágenes de hasta
+    256 colores se cuantizan a lo sumo a esa cantidad (ver a_paleta). Las imágenes de 16 bits y las de 1 bit quedan como están.
+    """
+    if img.mode in ('1', 'I', 'I;16', 'I;16B'):
+        return img
+    # La transparencia por color clave o por paleta pasa a ser un canal alfa
+    if img.mode not in ('L', 'LA', 'RGB', 'RGBA') or 'transparency' in img.info:
+        img = img.convert('RGBA')
+
+    if img.mode in ('LA', 'RGBA') and img.getchannel('A').getextrema() == (255, 255):
+        img = img.convert(img.mode[:-1])
+    if img.mode in ('RGB', 'RGBA') and sin_color(img):
+        img = img.convert('LA' if img.mode == 'RGBA' else 'L')
+    return a_paleta(img, colores) or img
+
+def sin_color(img) -> bool:
+    """
+    True si los tres canales son iguales en cada píxel.
+    """
+    rojo, verde, azul = img.split()[:3]
+    return ImageChops.difference(rojo, verde).getbbox() is None and \
+        ImageChops.difference(verde, azul).getbbox() is None
+
+def a_paleta(img, colores: int = None):
+    """
+    La imagen con paleta, o None si no conviene. Solo las imágenes de hasta
+    256 colores: con más (fotos, degradados) una paleta se nota. Si entran
+    en colores (o no se pide un número), solo si la paleta reproduce la
+    imagen exacta; si tienen más que colores, se cuantizan con pérdida. Los
+    grises sin alfa solo si entran en 16 niveles (con más, la paleta ocupa
+    lo mismo que L).
+    """
+    usados = img.getcolors(256)
+    if usados is None:
+        return None
+    if img.mode == 'L' and len(usados) > 16:
+        return None
+
+    exacta = colores is None or len(usados) <= colores
+    fuente = img.convert('RGBA' if img.mode in ('LA', 'RGBA') else 'RGB')
+    metodo = Image.Quantize.FASTOCTREE if fuente.mode == 'RGBA' else Image.Quantize.MEDIANCUT
+    # Sin tramado: en capturas el tramado ensucia los planos de color y
+    # agranda el archivo
+    paleta = fuente.quantize(colors=len(usados) if exacta else colores, method=metodo,
+                             dither=Image.Dither.NONE)
+    if exacta and ImageChops.difference(fuente, paleta.convert(fuente.mode)).getbbox(alpha_only=False):
+        return None
+    return paleta
+
+def pruebas_png(img, config: dict, icc=None, grande: bool = False, hilos: int = HILOS_PNG,
+                revisar_cancelacion=None) -> list:
+    """
+    Funciones sin argumentos que devuelven cada codificación candidata: la
+    de PIL (filtro adaptativo por fila) con cada estrategia y nivel de
+    zlib, y las de filtro uniforme escritas a mano. Las paletas de hasta
+    16 colores solo van por PIL, que las empaqueta a menos de 8 bits.
+    grande: una prueba por filtro (filtra recién al correr y se queda con
+    la mejor combinación de zlib) con deflate en 'hilos'; en lugar de las
+    de PIL, que comprime en un solo hilo, va el filtro adaptativo propio;
+    cada una llama a revisar_cancelacion entre combinaciones.
+    """
+    combinaciones = [(estrategia, nivel) for estrategia in config['estrategias']
+                     for nivel in config['niveles_zlib']]
+    escritas_a_mano = img.mode in TIPOS_COLOR_PNG and not (img.mode == 'P' and len(img.getpalette()) <= 16 * 3)
+    filtros = config['filtros'] if escritas_a_mano else ()
+    if grande and escritas_a_mano:
+        # El adaptativo propio reemplaza al de PIL
+        filtros = (FILTRO_ADAPTATIVO,) + tuple(f for f in filtros if f != FILTRO_ADAPTATIVO)
+        return [lambda f=filtro: mejor_filtro(img, f, combinaciones, icc, hilos, revisar_cancelacion)
+                for filtro in filtros]
+
+    pruebas = [lambda e=estrategia, n=nivel: guardar_png_pil(img, e, n, icc)
+               for estrategia, nivel in combinaciones]
+    for filtro in filtros:
+        filas = filas_filtradas(img, filtro)
+        pruebas += [lambda f=filas, e=estrategia, n=nivel: armar_png(img, deflate(f, e, n), icc)
+                    for estrategia, nivel in combinaciones]
+    return pruebas
+
+def mejor_filtro(img, filtro: int, combinaciones: list, icc=None, hilos: int = HILOS_PNG,
+                 revisar_cancelacion=None) -> bytes:
+    """
+    El PNG más chico con el filtro dado entre las combinaciones de
+    estrategia y nivel de zlib, cada una con deflate en paralelo.
+    revisar_cancelacion se llama antes de cada combinación.
+    """
+    filas = filas_filtradas(img, filtro)
+    candidatos = []
+    for estrategia, nivel in combinaciones:
+        if revisar_cancelacion:
+            revisar_cancelacion()
+        candidatos.append(armar_png(img, deflate(filas, estrategia, nivel, hilos), icc))
+    return min(candidatos, key=len)
+
+def guardar_png_pil(img, estrategia: int, nivel: int, icc=None) -> bytes:
+    """
+    PNG codificado por PIL con la estrategia y el nivel de zlib dados.
+    """
+    salida = io.BytesIO()
+    img.save(salida, format='PNG', compress_level=nivel, compress_type=estrategia, icc_profile=icc)
+    return salida.getvalue()
+
+def filas_filtradas(img, filtro: int) -> bytes:
+    """
+    Datos de IDAT sin comprimir con el mismo filtro en todas las filas
+    (0 ninguno, 1 sub, 2 up, 3 promedio) o, con FILTRO_ADAPTATIVO, el que
+    mejor le va a cada fila.
+    """
+    if filtro == FILTRO_ADAPTATIVO:
+        return filas_adaptativas(img)
+    datos = plano_filtrado(img, filtro).tobytes()
+    largo_fila = len(datos) // img.height
+    prefijo = bytes([filtro])
+    return b''.join(prefijo + datos[i:i + largo_fila] for i in range(0, len(datos), largo_fila))
+
+def filas_adaptativas(img) -> bytearray:
+    """
+    Filtro por fila con la heurística habitual: el de menor suma de
+    diferencias absolutas (bytes leídos con signo). Las sumas salen de
+    reducir cada plano filtrado a una columna; los planos se calculan de a
+    uno, dos veces, para no tener los cuatro en memoria.
+    """
+    ancho, alto = img.size
+    bandas = len(img.getbands()) if img.mode != 'P' else 1
+    absoluto = [min(v, 256 - v) for v in range(256)] * bandas
+    puntajes = []
+    for filtro in FILTROS_ADAPTATIVO:
+        columna = plano_filtrado(img, filtro).point(absoluto).resize((1, alto), Image.Resampling.BOX)
+        medias = columna.tobytes()
+        puntajes.append([sum(medias[i:i + bandas]) for i in range(0, len(medias), bandas)])
+    elegidos = [min(FILTROS_ADAPTATIVO, key=lambda f: puntajes[f][fila]) for fila in range(alto)]
+
+    largo_fila = ancho * bandas
+    salida = bytearray(alto * (largo_fila + 1))
+    for filtro in set(elegidos):
+        datos = plano_filtrado(img, filtro).tobytes()
+        for fila in range(alto):
+            if elegidos[fila] == filtro:
+                inicio = fila * (largo_fila + 1)
+                salida[inicio] = filtro
+                salida[inicio + 1:inicio + 1 + largo_fila] = datos[fila * largo_fila:(fila + 1) * largo_fila]
+    return salida
+
+def plano_filtrado(img, filtro: int):
+    """
+    La imagen con un filtro PNG uniforme aplicado (sin el byte de filtro de
+    cada fila), calculado con ImageChops: la resta módulo 256 por canal es
+    la del estándar con imágenes de 8 bits. Las paletas se filtran como L.
+    """
+    plano = img if img.mode != 'P' else Image.frombytes('L', img.size, img.tobytes())
+    if not filtro:
+        return plano
+    ancho, alto = plano.size
+    # Vecino izquierdo y de arriba, con ceros fuera de la imagen
+    izquierda = ImageChops.offset(plano, 1, 0)
+    izquierda.paste(0, (0, 0, 1, alto))
+    arriba = ImageChops.offset(plano, 0, 1)
+    arriba.paste(0, (0, 0, ancho, 1))
+    prediccion = {1: izquierda, 2: arriba}.get(filtro) or ImageChops.add(izquierda, arriba, scale=2.0)
+    return ImageChops.subtract_modulo(plano, prediccion)
+
+def deflate(datos: bytes, estrategia: int, nivel: int, hilos: int = 1) -> bytes:
+    """
+    Flujo zlib de los datos con la estrategia y el nivel dados. Con más de
+    un hilo y datos de varios bloques, los bloques se comprimen en
+    paralelo (ver deflate_bloques) bajo una sola cabecera zlib y un solo
+    Adler-32.
+    """
+    if hilos <= 1 or len(datos) <= 2 * BLOQUE_DEFLATE:
+        compresor = zlib.compressobj(nivel, zlib.DEFLATED, zlib.MAX_WBITS, 9, estrategia)
+        return compresor.compress(datos) + compresor.flush()
+    cuerpo = deflate_bloques(datos, estrategia, nivel, hilos)
+    return cabecera_zlib(nivel) + cuerpo + struct.pack('>I', zlib.adler32(datos))
+
+def deflate_bloques(datos: bytes, estrategia: int, nivel: int, hilos: int = 1, previos: bytes = b'',
+                    final: bool = True) -> bytes:
+    """
+    Deflate crudo (sin cabecera ni Adler-32) de los datos, en bloques de
+    BLOQUE_DEFLATE comprimidos en paralelo (zlib suelta el GIL).
+    previos: los datos que van justo antes en el mismo flujo (su final es
+    el diccionario del primer bloque); final: si estos datos cierran el
+    flujo o quedan terminados en un sync flush para seguir después.
+    """
+    vista = memoryview(datos)
+
+    def bloque(inicio: int) -> bytes:
+        fin = min(inicio + BLOQUE_DEFLATE, len(datos))
+        diccionario = vista[max(0, inicio - VENTANA_DEFLATE):inicio] if inicio else previos[-VENTANA_DEFLATE:]
+        extra = {'zdict': diccionario} if len(diccionario) else {}
+        compresor = zlib.compressobj(nivel, zlib.DEFLATED, -zlib.MAX_WBITS, 9, estrategia, **extra)
+        # Solo el último bloque del flujo lo cierra; el sync flush deja a
+        # los demás terminados en un límite de byte
+        cierre = zlib.Z_FINISH if final and fin == len(datos) else zlib.Z_SYNC_FLUSH
+        return compresor.compress(vista[inicio:fin]) + compresor.flush(cierre)
+
+    inicios = range(0, max(len(datos), 1), BLOQUE_DEFLATE)
+    if hilos <= 1 or len(inicios) == 1:
+        return b''.join(map(bloque, inicios))
+    with ThreadPoolExecutor(max_workers=hilos) as ejecutor:
+        return b''.join(ejecutor.map(bloque, inicios))
+
+def cabecera_zlib(nivel: int) -> bytes:
+    """
+    Cabecera zlib (RFC 1950) de un flujo deflate con ventana de 32 KiB y
+    sin diccionario preestablecido.
+    """
+    cmf = 0x78
+    flg = (0 if nivel < 2 else 1 if nivel < 6 else 2 if nivel == 6 else 3) << 6
+    flg += (31 - (cmf * 256 + flg) % 31) % 31
+    return bytes([cmf, flg])
+
+def armar_png(img, idat: bytes, icc=None) -> bytes:
+    """
+    Archivo PNG de 8 bits por muestra con el IDAT dado.
+    """
+    paleta = img.getpalette('RGBA') if img.mode == 'P' else None
+    return cabecera_png(img.mode, img.size, 8, paleta, icc) + chunk_png(b'IDAT', idat) + chunk_png(b'IEND', b'')
+
+def cabecera_png(modo: str, tamaño: tuple, bits: int = 8, paleta: list = None, icc=None) -> bytes:
+    """
+    Todo lo que va antes del IDAT: firma, IHDR y, según corresponda, iCCP,
+    PLTE y tRNS (paleta: valores RGBA seguidos, como getpalette('RGBA')).
+    """
+    ancho, alto = tamaño
+    partes = [b'\x89PNG\r\n\x1a\n',
+              chunk_png(b'IHDR', struct.pack('>IIBBBBB', ancho, alto, bits, TIPOS_COLOR_PNG[modo], 0, 0, 0))]
+    if icc:
+        partes.append(chunk_png(b'iCCP', b'ICC\x00\x00' + zlib.compress(icc)))
+    if paleta:
+        partes.append(chunk_png(b'PLTE', bytes(v for i, v in enumerate(paleta) if i % 4 != 3)))
+        alfa = bytes(paleta[3::4]).rstrip(b'\xff')
+        if alfa:
+            partes.append(chunk_png(b'tRNS', alfa))
+    return b''.join(partes)
+
+def chunk_png(tipo: bytes, datos: bytes) -> bytes:
+    """
+    Chunk PNG: largo, tipo, datos y CRC.
+    """
+    return struct.pack('>I', len(datos)) + tipo + datos + struct.pack('>I', zlib.crc32(tipo + datos))
+
+def por_tiras(img) -> bool:
+    """
+    True si el PNG (recién abierto, sin cargar) pasa UMBRAL_PNG_TIRAS y se
+    puede procesar por tiras: no entrelazado, 8 bits por muestra en L, LA,
+    RGB o RGBA y sin transparencia por color clave.
+    """
+    if len(img.tile) != 1 or img.mode not in ('L', 'LA', 'RGB', 'RGBA'):
+        return False
+    decodificador, _, _, modo_crudo = img.tile[0]
+    return (decodificador == 'zip' and modo_crudo == img.mode and not img.info.get('interlace')
+            and 'transparency' not in img.info
+            and len(img.getbands()) * img.width * img.height > UMBRAL_PNG_TIRAS)
+
+def png_por_tiras(ruta: str, img, ruta_salida: str, config: dict, icc=None, revisar_cancelacion=None):
+    """
+    Recodifica un PNG enorme sin tenerlo entero en memoria, en dos pasadas
+    por tiras: la primera ve qué reducciones exactas admite (alfa opaco,
+    grises, paleta) y la segunda convierte, filtra y comprime cada tira y
+    la escribe como un IDAT. Una sola codificación (filtro adaptativo
+    propio, primera estrategia y mayor nivel de zlib del nivel): probar
+    varias obligaría a decodificar otra vez; tampoco se cuantiza con
+    pérdida, porque la paleta tiene que salir de la imagen entera.
+    revisar_cancelacion: se llama antes de cada tira de las dos pasadas.
+    """
+    modo, (ancho, alto) = img.mode, img.size
+    filas = max(1, BYTES_TIRA // (ancho * len(img.getbands())))
+    destino, colores = reducciones_tiras(revisando(tiras_png(ruta, modo, ancho, filas), revisar_cancelacion), modo)
+
+    bits, paleta, imagen_paleta = 8, None, None
+    if destino == 'P':
+        bits = next(b for b in (1, 2, 4, 8) if len(colores) <= 1 << b)
+        paleta = [v for color in colores for v in color + (255,)]
+        imagen_paleta = Image.new('P', (1, 1))
+        imagen_paleta.putpalette([v for color in colores for v in color])
+    filtro = 0 if destino == 'P' else FILTRO_ADAPTATIVO
+    estrategia, nivel = config['estrategias'][0], max(config['niveles_zlib'])
+
+    hechas, previa, previos, adler = 0, None, b'', 1
+    with open(ruta_salida, 'wb') as salida:
+        salida.write(cabecera_png(destino, (ancho, alto), bits, paleta, icc))
+        salida.write(chunk_png(b'IDAT', cabecera_zlib(nivel)))
+        for tira in revisando(tiras_png(ruta, modo, ancho, filas), revisar_cancelacion):
+            if destino == 'P':
+                tira = tira.convert('RGB').quantize(palette=imagen_paleta, dither=Image.Dither.NONE)
+            elif tira.mode != destino:
+                tira = tira.convert(destino)
+            datos = filas_tira(tira, previa, filtro, bits)
+            hechas += tira.height
+            cuerpo = deflate_bloques(datos, estrategia, nivel, HILOS_PNG, previos, final=hechas == alto)
+            adler = zlib.adler32(datos, adler)
+            if hechas == alto:
+                cuerpo += struct.pack('>I', adler)
+            salida.write(chunk_png(b'IDAT', cuerpo))
+            previa = tira.crop((0, tira.height - 1, ancho, tira.height))
+            previos = datos[-VENTANA_DEFLATE:]
+        salida.write(chunk_png(b'IEND', b''))
+
+    if hechas != alto:
+        raise ValueError(f"PNG incompleto: {hechas} de {alto} filas")
+    print(f"PNG por tiras de {filas} filas: {modo} -> {destino} ({bits} bits)")
+
+def revisando(tiras, revisar_cancelacion=None):
+    """
+    Las mismas tiras, llamando a revisar_cancelacion antes de leer cada una.
+    """
+    for tira in tiras:
+        if revisar_cancelacion:
+            revisar_cancelacion()
+        yield tira
+
+def reducciones_tiras(tiras, modo: str) -> tuple:
+    """
+    Primera pasada de png_por_tiras: modo de destino y, si es 'P', los
+    colores (RGB) de la paleta. Deja de leer cuando ya no queda ninguna
+    reducción posible.
+    """
+    opaca = modo in ('LA', 'RGBA')
+    gris = modo in ('RGB', 'RGBA')
+    colores = set()
+    for tira in tiras:
+        if opaca and tira.getchannel('A').getextrema() != (255, 255):
+            opaca = False
+        if gris and not sin_color(tira):
+            gris = False
+        if colores is not None:
+            usados = tira.getcolors(256)
+            colores = None if usados is None else colores | {color for _, color in usados}
+            if colores is not None and len(colores) > 256:
+                colores = None
+        if not (opaca or gris or colores is not None):
+            break
+
+    destino = modo
+    if opaca:
+        destino = destino[:-1]
+    if gris:
+        destino = 'LA' if destino == 'RGBA' else 'L'
+    if colores is None or destino not in ('L', 'RGB'):
+        return destino, None
+    # Colores de la imagen original: int en L, (l, a) en LA, (r, g, b[, a])
+    # en RGB y RGBA; los grises solo ganan con paleta si entran en 4 bits
+    rgb = sorted({(c, c, c) if isinstance(c, int) else (c[0],) * 3 if modo == 'LA' else tuple(c[:3])
+                  for c in colores})
+    if destino == 'L' and len(rgb) > 16:
+        return destino, None
+    return 'P', rgb
+
+def filas_tira(tira, previa, filtro: int, bits: int = 8) -> bytes:
+    """
+    Datos de IDAT sin comprimir de una tira. previa: la última fila de la
+    tira anterior (los filtros up y promedio la usan en la primera fila).
+    Las paletas de menos de 8 bits van empaquetadas y sin filtro.
+    """
+    if bits < 8:
+        datos = tira.tobytes('raw', f'P;{bits}')
+        largo_fila = len(datos) // tira.height
+        return b''.join(b'\x00' + datos[i:i + largo_fila] for i in range(0, len(datos), largo_fila))
+    if previa is None:
+        return filas_filtradas(tira, filtro)
+    con_previa = Image.new(tira.mode, (tira.width, tira.height + 1))
+    con_previa.paste(previa, (0, 0))
+    con_previa.paste(tira, (0, 1))
+    datos = filas_filtradas(con_previa, filtro)
+    return datos[len(datos) // (tira.height + 1):]
+
+def tiras_png(ruta: str, modo: str, ancho: int, filas: int):
+    """
+    Generador de las tiras de 'filas' filas (la última, las que queden) de
+    un PNG no entrelazado de 8 bits por muestra. El IDAT se infla de a
+    poco y cada tira la decodifica el decodificador 'zip' de PIL, que es
+    el que deshace los filtros PNG.
+    """
+    largo_fila = ancho * Image.getmodebands(modo) + 1
+    bytes_tira = filas * largo_fila
+    pendiente = bytearray()
+    previa = None
+    with open(ruta, 'rb') as archivo:
+        for datos in inflar_idat(archivo, bytes_tira):
+            pendiente += datos
+            while len(pendiente) >= bytes_tira:
+                tira, previa = decodificar_tira(modo, ancho, pendiente[:bytes_tira], previa)
+                del pendiente[:bytes_tira]
+                yield tira
+    if len(pendiente) >= largo_fila:
+        yield decodificar_tira(modo, ancho, pendiente[:len(pendiente) // largo_fila * largo_fila], previa)[0]
+
+def inflar_idat(archivo, maximo: int):
+    """
+    Generador de los datos inflados del IDAT en pedazos de a lo sumo
+    'maximo' bytes (un IDAT muy comprimible no se infla de golpe).
+    """
+    descompresor = zlib.decompressobj()
+    for comprimido in datos_idat(archivo):
+        while comprimido:
+            datos = descompresor.decompress(comprimido, maximo)
+            comprimido = descompresor.unconsumed_tail
+            yield datos
+    yield descompresor.flush()
+
+def datos_idat(archivo):
+    """
+    Generador del contenido de los chunks IDAT, leído de a BLOQUE_DEFLATE.
+    """
+    archivo.seek(8)
+    while True:
+        cabecera = archivo.read(8)
+        if len(cabecera) < 8:
+            return
+        largo, tipo = struct.unpack('>I4s', cabecera)
+        if tipo == b'IEND':
+            return
+        if tipo != b'IDAT':
+            archivo.seek(largo + 4, os.SEEK_CUR)
+            continue
+        while largo:
+            datos = archivo.read(min(largo, BLOQUE_DEFLATE))
+            if not datos:
+                return
+            largo -= len(datos)
+            yield datos
+        archivo.seek(4, os.SEEK_CUR)
+
+def decodificar_tira(modo: str, ancho: int, datos: bytes, previa: bytes = None) -> tuple:
+    """
+    Deshace los filtros de las filas de una tira. La última fila cruda de
+    la tira anterior va delante con filtro 0 para que los filtros que
+    miran arriba tengan su referencia; se vuelve a comprimir sin
+    compresión (nivel 0) porque el decodificador espera un flujo zlib.
+    Devuelve la tira y su última fila cruda.
+    """
+    largo = len(datos) // (Image.getmodebands(modo) * ancho + 1)
+    if previa is not None:
+        datos = b'\x00' + previa + datos
+    tira = Image.frombytes(modo, (ancho, largo + (previa is not None)), zlib.compress(bytes(datos), 0), 'zip', modo)
+    if previa is not None:
+        tira = tira.crop((0, 1, ancho, largo + 1))
+    return tira, tira.crop((0, largo - 1, ancho, largo)).tobytes()
+
+def comprimir_lote(rutas, nivel: str = 'media', workers: int = None, max_en_vuelo: int = None):
+    """
+    Comprime muchas imágenes (JPEG y PNG, según su contenido) en un pool de
+    procesos. Es un generador: entrega cada resultado apenas termina, en
+    ese orden, como un dict con 'ruta', 'ok', 'mensaje', 'salida',
+    'tamaño_original' y 'tamaño_comprimido'. Cada imagen tiene su propia
+    salida, aunque se repitan nombres de archivo.
+    Cada imagen pasa por dos trabajos del pool: uno la decodifica a
+    memoria compartida (decodificar_trabajo) y otro, quizás en otro
+    proceso, la codifica desde ahí (codificar_trabajo), así los píxeles no
+    se serializan. Nunca hay más de max_en_vuelo imágenes decodificadas o
+    decodificándose (por defecto EN_VUELO_POR_PROCESO por proceso).
+    """
+    workers = max(1, workers or os.cpu_count() or 1)
+    max_en_vuelo = max(1, max_en_vuelo or EN_VUELO_POR_PROCESO * workers)
+    pendientes = iter(rutas)
+    decodificando, codificando = {}, {}
+    # Los bloques de memoria compartida los crea y mantiene abiertos este
+    # proceso hasta que termina la codificación: en Windows un bloque se
+    # destruye al cerrarse su último handle
+    bloques = {}
+    listos = []
+
+    def llenar():
+        while len(decodificando) + len(codificando) < max_en_vuelo:
+            ruta = next(pendientes, None)
+            if ruta is None:
+                return
+            try:
+                trabajo = preparar_trabajo(ruta, nivel, bloques)
+            except Exception as e:
+                listos.append(resultado_lote_error(ruta, e))
+                continue
+            if trabajo['memoria'] is None:
+                codificando[executor.submit(codificar_trabajo, trabajo)] = trabajo
+            else:
+                decodificando[executor.submit(decodificar_trabajo, trabajo)] = trabajo
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        try:
+            llenar()
+            while decodificando or codificando or listos:
+                hechos = set()
+                if decodificando or codificando:
+                    hechos, _ = wait(list(decodificando) + list(codificando), return_when=FIRST_COMPLETED)
+                for futuro in hechos:
+                    if futuro in decodificando:
+                        trabajo = decodificando.pop(futuro)
+                        try:
+                            trabajo = futuro.result()
+                        except Exception as e:
+                            liberar_memoria(bloques, trabajo['memoria'])
+                            listos.append(resultado_lote_error(trabajo['ruta'], e))
+                            continue
+                        codificando[executor.submit(codificar_trabajo, trabajo)] = trabajo
+                    else:
+                        trabajo = codificando.pop(futuro)
+                        liberar_memoria(bloques, trabajo['memoria'])
+                        try:
+                            listos.append(futuro.result())
+                        except Exception as e:
+                            listos.append(resultado_lote_error(trabajo['ruta'], e))
+                # Los huecos se llenan antes de entregar: el pool sigue
+                # trabajando mientras se consumen los resultados
+                llenar()
+                entregar = listos[:]
+                listos.clear()
+                yield from entregar
+        finally:
+            # Si se corta el lote (o falla), la memoria compartida que
+            # quedó en vuelo se libera igual
+            executor.shutdown(wait=True, cancel_futures=True)
+            for nombre in list(bloques):
+                liberar_memoria(bloques, nombre)
+
+def preparar_trabajo(ruta: str, nivel: str, bloques: dict) -> dict:
+    """
+    Arma un trabajo de comprimir_lote (corre en el proceso principal): lee
+    solo la cabecera de la imagen, elige una salida propia y crea el bloque
+    de memoria compartida donde decodificar_trabajo dejará los píxeles,
+    que queda abierto en bloques hasta liberar_memoria. Los PNG que van por
+    tiras no usan bloque ('memoria' None).
+    """
+    with abrir_imagen(ruta) as img:
+        formato = img.format
+        config = configuracion_imagen(formato, nivel)
+        capacidad = None if formato == 'PNG' and por_tiras(img) else bytes_decodificados(img, config)
+    trabajo = {'ruta': ruta, 'nivel': nivel, 'formato': formato, 'memoria': None,
+               'salida': ruta_salida_imagen(ruta, unica=True)}
+    if capacidad:
+        memoria = shared_memory.SharedMemory(create=True, size=capacidad)
+        bloques[memoria.name] = memoria
+        trabajo['memoria'] = memoria.name
+    return trabajo
+
+def bytes_decodificados(img, config: dict) -> int:
+    """
+    Cota de lo que ocupan los píxeles que deja decodificar_trabajo, sin
+    decodificar: los JPEG quedan en L o RGB con el tamaño final (±1 px por
+    el redondeo tras draft); los PNG reducidos nunca pasan de 4 bytes por
+    píxel.
+    """
+    if img.format == 'JPEG':
+        ancho, alto = tamaño_final(img.size, config['max_dimension'])
+        return (ancho + 1) * (alto + 1) * 3
+    return img.width * img.height * 4
+
+def decodificar_trabajo(trabajo: dict) -> dict:
+    """
+    Primera mitad de un trabajo de comprimir_lote (corre en el pool):
+    decodifica la imagen como su motor y deja los píxeles en el bloque de
+    memoria compartida del trabajo. Devuelve el trabajo con lo que necesita
+    codificar_trabajo.
+    """
+    with abrir_imagen(trabajo['ruta']) as img:
+        icc = img.info.get('icc_profile')
+        config = configuracion_imagen(img.format, trabajo['nivel'])
+        if img.format == 'JPEG':
+            img, icc = decodificar_jpeg(img, config)
+        else:
+            cargar_entera(img)
+            img = reducir_png(img, config['colores'])
+        datos = img.tobytes()
+
+    # Solo se abre el bloque del proceso principal: el registro en el
+    # resource tracker (POSIX) es el mismo que el del principal, que lo
+    # borra al liberarlo
+    memoria = shared_memory.SharedMemory(name=trabajo['memoria'])
+    try:
+        if len(datos) > memoria.size:
+            raise ValueError(f"La imagen decodificada ocupa {len(datos)} bytes y el bloque {memoria.size}")
+        memoria.buf[:len(datos)] = datos
+    finally:
+        memoria.close()
+    return dict(trabajo, bytes=len(datos), modo=img.mode, tamaño=img.size, icc=icc,
+                paleta=(img.palette.mode, img.getpalette(img.palette.mode)) if img.mode == 'P' else None)
+
+def codificar_trabajo(trabajo: dict) -> dict:
+    """
+    Segunda mitad de un trabajo de comprimir_lote (corre en el pool): toma
+    los píxeles de la memoria compartida y codifica con el motor del
+    formato, en un solo hilo (el paralelismo lo da el pool).
+    """
+    ruta, nivel, ruta_salida = trabajo['ruta'], trabajo['nivel'], trabajo['salida']
+
+    if trabajo['memoria'] is None:
+        comprimir_png(ruta, nivel, ruta_salida=ruta_salida)
+    else:
+        memoria = shared_memory.SharedMemory(name=trabajo['memoria'])
+        try:
+            # frombytes copia: la imagen no queda atada al bloque
+            with memoria.buf[:trabajo['bytes']] as datos:
+                img = Image.frombytes(trabajo['modo'], trabajo['tamaño'], datos)
+        finally:
+            memoria.close()
+        if trabajo['paleta']:
+            modo_paleta, paleta = trabajo['paleta']
+            img.putpalette(paleta, modo_paleta)
+
+        config = configuracion_imagen(trabajo['formato'], nivel)
+        if trabajo['formato'] == 'JPEG':
+            guardar_jpeg(img, ruta_salida, config, trabajo['icc'])
+        else:
+            datos = codificar_png(img, config, trabajo['icc'], hilos=1)
+            with open(ruta_salida, 'wb') as archivo:
+                archivo.write(datos)
+        no_mayor_que_original(ruta, ruta_salida)
+
+    return {'ruta': ruta, 'ok': True, 'mensaje': f"Imagen comprimida correctamente: {ruta_salida}",
+            'salida': ruta_salida, 'tamaño_original': os.path.getsize(ruta),
+            'tamaño_comprimido': os.path.getsize(ruta_salida)}
+
+def configuracion_imagen(formato: str, nivel: str) -> dict:
+    """
+    Configuración del nivel para el formato ('JPEG' o 'PNG', como
+    Image.format).
+    """
+    if formato == 'JPEG':
+        return CONFIGURACIONES_JPEG.get(nivel, CONFIGURACIONES_JPEG['media'])
+    if formato == 'PNG':
+        return CONFIGURACIONES_PNG.get(nivel, CONFIGURACIONES_PNG['media'])
+    raise ValueError(f"Formato de imagen no soportado: {formato}")
+
+def liberar_memoria(bloques: dict, nombre: str):
+    """
+    Cierra y borra un bloque de memoria compartida de comprimir_lote
+    (None o ya liberado: nada).
+    """
+    memoria = bloques.pop(nombre, None)
+    if memoria is None:
+        return
+    memoria.close()
+    memoria.unlink()
+
+def resultado_lote_error(ruta: str, error: Exception) -> dict:
+    """
+    Resultado de comprimir_lote para una imagen que falló.
+    """
+    return {'ruta': ruta, 'ok': False, 'mensaje': f"Error al comprimir archivo: {str(error)}", 'salida': None,
+            'tamaño_original': os.path.getsize(ruta) if os.path.exists(ruta) else None,
+            'tamaño_comprimido': None}
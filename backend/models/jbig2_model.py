@@ -0,0 +1,488 @@
+import heapq
+import io
+import re
+import struct
+from PIL import Image, ImageChops, ImageDraw, features
+
+# Codificador JBIG2 (ITU T.88) en Python puro para páginas de 1 bit. Las
+# componentes conexas chicas (letras) se agrupan en un diccionario de
+# símbolos y la página se describe como una región de texto que los
+# referencia; lo que no cabe en un símbolo (líneas, dibujos) va en una
+# región genérica. Todo usa las tablas Huffman estándar y MMR (el G4 de
+# libtiff), sin codificador aritmético. El flujo es el que espera
+# /JBIG2Decode en un PDF: sin cabecera de archivo ni fin de página.
+
+MMR = features.check('libtiff')
+
+# Componentes con algún lado mayor que esto no son símbolos
+MAX_LADO_SIMBOLO = 128
+# Páginas con más componentes que esto (tramas, ruido) no se intentan
+MAX_COMPONENTES = 30000
+
+# Dos componentes usan el mismo símbolo si tienen las mismas dimensiones,
+# difieren en a lo sumo FRACCION_DIFERENCIA_SIMBOLO de sus pixeles de tinta
+# y ninguna diferencia forma un bloque de 2x2 (un trazo de más o de menos,
+# lo que distingue una 'c' de una 'e'). Se compara con los últimos
+# MAX_COMPARACIONES_SIMBOLO símbolos del mismo tamaño
+FRACCION_DIFERENCIA_SIMBOLO = 0.06
+MAX_COMPARACIONES_SIMBOLO = 32
+
+# Separación horizontal entre símbolos que se resta antes de codificarla
+# (SBDSOFFSET); con 1, letras pegadas y con un pixel de aire son baratas
+DESPLAZAMIENTO_DS = 1
+
+TIPO_DICCIONARIO = 0
+TIPO_REGION_TEXTO = 6
+TIPO_REGION_GENERICA = 38
+TIPO_INFO_PAGINA = 48
+
+CORRIDA = re.compile(rb'\xff+')
+
+# Tablas Huffman estándar del anexo B: (largo del prefijo, bits del rango,
+# inicio del rango, tipo). El tipo 'inferior' cubre los valores <= inicio,
+# 'superior' los >= inicio y 'oob' es el fuera de banda
+TABLA_B1 = [(1, 4, 0, ''), (2, 8, 16, ''), (3, 16, 272, ''), (0, 32, -1, 'inferior'), (3, 32, 65808, 'superior')]
+TABLA_B2 = [(1, 0, 0, ''), (2, 0, 1, ''), (3, 0, 2, ''), (4, 3, 3, ''), (5, 6, 11, ''),
+            (0, 32, -1, 'inferior'), (6, 32, 75, 'superior'), (6, 0, 0, 'oob')]
+TABLA_B4 = [(1, 0, 1, ''), (2, 0, 2, ''), (3, 0, 3, ''), (4, 3, 4, ''), (5, 6, 12, ''),
+            (0, 32, -1, 'inferior'), (5, 32, 76, 'superior')]
+TABLA_B6 = [(5, 10, -2048, ''), (4, 9, -1024, ''), (4, 8, -512, ''), (4, 7, -256, ''), (5, 6, -128, ''),
+            (5, 5, -64, ''), (4, 5, -32, ''), (2, 7, 0, ''), (3, 7, 128, ''), (3, 8, 256, ''),
+            (4, 9, 512, ''), (4, 10, 1024, ''), (6, 32, -2049, 'inferior'), (6, 32, 2048, 'superior')]
+TABLA_B8 = [(8, 3, -15, ''), (9, 1, -7, ''), (8, 1, -5, ''), (9, 0, -3, ''), (7, 0, -2, ''),
+            (4, 0, -1, ''), (2, 1, 0, ''), (5, 0, 2, ''), (6, 0, 3, ''), (3, 4, 4, ''),
+            (6, 1, 20, ''), (4, 4, 22, ''), (4, 5, 38, ''), (5, 6, 70, ''), (5, 7, 134, ''),
+            (6, 7, 262, ''), (7, 8, 390, ''), (6, 10, 646, ''),
+            (9, 32, -16, 'inferior'), (9, 32, 1670, 'superior'), (2, 0, 0, 'oob')]
+TABLA_B11 = [(1, 0, 1, ''), (2, 1, 2, ''), (4, 0, 4, ''), (4, 1, 5, ''), (5, 1, 7, ''),
+             (5, 2, 9, ''), (6, 2, 13, ''), (7, 2, 17, ''), (7, 3, 21, ''), (7, 4, 29, ''),
+             (7, 5, 45, ''), (7, 6, 77, ''), (0, 32, 0, 'inferior'), (7, 32, 141, 'superior')]
+
+class EscritorBits:
+    """
+    Acumula bits de más significativo a menos significativo.
+    """
+
+    def __init__(self):
+        self.datos = bytearray()
+        self.acumulado = 0
+        self.pendientes = 0
+
+    def escribir(self, valor: int, bits: int):
+        self.acumulado = (self.acumulado << bits) | (valor & ((1 << bits) - 1))
+        self.pendientes += bits
+        while self.pendientes >= 8:
+            self.pendientes -= 8
+            self.datos.append((self.acumulado >> self.pendientes) & 0xFF)
+        self.acumulado &= (1 << self.pendientes) - 1
+
+    def alinear(self):
+        """
+        Completa el byte en curso con ceros.
+        """
+        if self.pendientes:
+            self.escribir(0, 8 - self.pendientes)
+
+    def escribir_bytes(self, datos: bytes):
+        self.alinear()
+        self.datos += datos
+
+    def obtener(self) -> bytes:
+        self.alinear()
+        return bytes(self.datos)
+
+def asignar_codigos(largos: list) -> list:
+    """
+    Códigos canónicos para una lista de largos de prefijo (anexo B.3): por
+    largo creciente y, a igual largo, en el orden de la lista. Largo 0 es
+    una línea sin código (None).
+    """
+    cuentas = [0] * (max(largos, default=0) + 1)
+    for largo in largos:
+        cuentas[largo] += 1
+    cuentas[0] = 0
+    siguiente = [0] * len(cuentas)
+    primero = 0
+    for largo in range(1, len(cuentas)):
+        primero = (primero + cuentas[largo - 1]) << 1
+        siguiente[largo] = primero
+    codigos = []
+    for largo in largos:
+        if largo:
+            codigos.append(siguiente[largo])
+            siguiente[largo] += 1
+        else:
+            codigos.append(None)
+    return codigos
+
+def preparar_tabla(lineas: list) -> list:
+    """
+    Agrega a cada línea de una tabla estándar su código:
+    (código, largo del prefijo, bits del rango, inicio, tipo).
+    """
+    codigos = asignar_codigos([linea[0] for linea in lineas])
+    return [(codigo, *linea) for codigo, linea in zip(codigos, lineas)]
+
+B1, B2, B4, B6, B8, B11 = map(preparar_tabla, (TABLA_B1, TABLA_B2, TABLA_B4, TABLA_B6, TABLA_B8, TABLA_B11))
+
+def escribir_valor(escritor: EscritorBits, tabla: list, valor):
+    """
+    Codifica valor (o el fuera de banda si valor es None) con una tabla
+    preparada.
+    """
+    for codigo, largo, bits, inicio, tipo in tabla:
+        if codigo is None:
+            continue
+        if tipo == 'oob':
+            if valor is None:
+                escritor.escribir(codigo, largo)
+                return
+        elif valor is None:
+            continue
+        elif tipo == 'inferior':
+            if valor <= inicio:
+                escritor.escribir(codigo, largo)
+                escritor.escribir(inicio - valor, bits)
+                return
+        elif tipo == 'superior':
+            if valor >= inicio:
+                escritor.escribir(codigo, largo)
+                escritor.escribir(valor - inicio, bits)
+                return
+        elif inicio <= valor < inicio + (1 << bits):
+            escritor.escribir(codigo, largo)
+            escritor.escribir(valor - inicio, bits)
+            return
+    raise ValueError(f"Valor fuera de la tabla Huffman: {valor}")
+
+def largos_huffman(frecuencias: list, maximo: int) -> list:
+    """
+    Largos de código Huffman para las frecuencias dadas (todas > 0). Si
+    alguno pasa de maximo se usa un código de largo fijo.
+    """
+    if len(frecuencias) == 1:
+        return [1]
+    largos = [0] * len(frecuencias)
+    # Cada nodo es (peso, desempate, hojas debajo)
+    nodos = [(f, i, [i]) for i, f in enumerate(frecuencias)]
+    heapq.heapify(nodos)
+    contador = len(frecuencias)
+    while len(nodos) > 1:
+        peso_a, _, hojas_a = heapq.heappop(nodos)
+        peso_b, _, hojas_b = heapq.heappop(nodos)
+        for hoja in hojas_a + hojas_b:
+            largos[hoja] += 1
+        heapq.heappush(nodos, (peso_a + peso_b, contador, hojas_a + hojas_b))
+        contador += 1
+    if max(largos) > maximo:
+        fijo = max(1, (len(frecuencias) - 1).bit_length())
+        largos = [fijo] * len(frecuencias)
+    return largos
+
+def codificar_mmr(tinta: Image.Image):
+    """
+    Codifica una imagen de modo '1' (tinta = 1) con MMR, que es CCITT G4, a
+    través del escritor TIFF de PIL. Devuelve los datos o None sin libtiff.
+    """
+    if not MMR:
+        return None
+    buffer = io.BytesIO()
+    # Una sola tira: las tiras G4 no se pueden concatenar
+    tinta.save(buffer, format='TIFF', compression='group4', tiffinfo={278: tinta.height})
+    tiff = Image.open(buffer)
+    desplazamientos, longitudes = tiff.tag_v2[273], tiff.tag_v2[279]
+    if len(desplazamientos) != 1:
+        return None
+    # G4 codifica los bits en 0 como blanco; con MinIsWhite PIL los invierte
+    if tiff.tag_v2.get(262) == 0:
+        return codificar_mmr(ImageChops.invert(tinta))
+    return buffer.getvalue()[desplazamientos[0]:desplazamientos[0] + longitudes[0]]
+
+def componentes(tinta: Image.Image) -> list:
+    """
+    Componentes conexas (vecindad de 8) de una imagen de modo '1' con la
+    tinta en 1. Cada fila se parte en corridas con una expresión regular
+    (en C) y las corridas que tocan alguna de la fila anterior se unen.
+    Devuelve [(x0, y0, x1, y1, corridas)] en orden de aparición, con la caja
+    [x0, x1) x [y0, y1) y las corridas como (y, inicio, fin).
+    """
+    ancho, alto = tinta.size
+    datos = tinta.convert('L').tobytes()
+    padre = []
+
+    def raiz(i):
+        while padre[i] != i:
+            padre[i] = padre[padre[i]]
+            i = padre[i]
+        return i
+
+    corridas = []
+    anteriores = []
+    for y in range(alto):
+        base = y * ancho
+        actuales = []
+        k = 0
+        for m in CORRIDA.finditer(datos, base, base + ancho):
+            inicio, fin = m.start() - base, m.end() - base
+            while k < len(anteriores) and anteriores[k][1] < inicio:
+                k += 1
+            etiqueta = None
+            j = k
+            while j < len(anteriores) and anteriores[j][0] <= fin:
+                otra = raiz(anteriores[j][2])
+                if etiqueta is None:
+                    etiqueta = otra
+                elif otra != etiqueta:
+                    padre[otra] = etiqueta
+                j += 1
+            if etiqueta is None:
+                etiqueta = len(padre)
+                padre.append(etiqueta)
+            actuales.append((inicio, fin, etiqueta))
+            corridas.append((y, inicio, fin, etiqueta))
+        anteriores = actuales
+
+    grupos = {}
+    for y, inicio, fin, etiqueta in corridas:
+        etiqueta = raiz(etiqueta)
+        grupo = grupos.get(etiqueta)
+        if grupo is None:
+            grupos[etiqueta] = [inicio, y, fin, y + 1, [(y, inicio, fin)]]
+        else:
+            grupo[0] = min(grupo[0], inicio)
+            grupo[2] = max(grupo[2], fin)
+            grupo[3] = y + 1
+            grupo[4].append((y, inicio, fin))
+    return [tuple(grupo) for grupo in grupos.values()]
+
+def recortar_componente(tinta: Image.Image, componente, pixeles: int) -> Image.Image:
+    """
+    Bitmap de una componente de pixeles de tinta. Si su caja no tiene tinta
+    de otras componentes alcanza con recortar; si no, se dibujan sus
+    corridas.
+    """
+    x0, y0, x1, y1, corridas = componente
+    recorte = tinta.crop((x0, y0, x1, y1))
+    if recorte.histogram()[255] == pixeles:
+        return recorte
+    recorte = Image.new('1', (x1 - x0, y1 - y0), 0)
+    dibujo = ImageDraw.Draw(recorte)
+    for y, inicio, fin in corridas:
+        dibujo.line([(inicio - x0, y - y0), (fin - 1 - x0, y - y0)], fill=255)
+    return recorte
+
+def parecidos(a: Image.Image, b: Image.Image, tinta: int) -> bool:
+    """
+    True si dos bitmaps del mismo tamaño pueden compartir símbolo (ver
+    FRACCION_DIFERENCIA_SIMBOLO); tinta es la del primero.
+    """
+    diferencia = ImageChops.logical_xor(a, b)
+    distintos = diferencia.histogram()[255]
+    if distintos == 0:
+        return True
+    if distintos > tinta * FRACCION_DIFERENCIA_SIMBOLO:
+        return False
+    ancho, alto = diferencia.size
+    if ancho < 2 or alto < 2:
+        return True
+    bloques = ImageChops.logical_and(
+        ImageChops.logical_and(diferencia.crop((0, 0, ancho - 1, alto - 1)), diferencia.crop((1, 0, ancho, alto - 1))),
+        ImageChops.logical_and(diferencia.crop((0, 1, ancho - 1, alto)), diferencia.crop((1, 1, ancho, alto))))
+    return bloques.getbbox() is None
+
+def extraer_simbolos(tinta: Image.Image):
+    """
+    Separa la página en símbolos e instancias. Devuelve (simbolos,
+    instancias, residuo): simbolos es una lista de bitmaps, instancias una
+    lista de (símbolo, x, y inferior) y residuo una imagen con las
+    componentes grandes, o None si no hay. Devuelve None si la página
+    tiene demasiadas componentes.
+    """
+    lista = componentes(tinta)
+    if len(lista) > MAX_COMPONENTES:
+        return None
+
+    simbolos, tintas = [], []
+    exactos, por_tamaño = {}, {}
+    instancias = []
+    residuo = None
+    for componente in lista:
+        x0, y0, x1, y1, corridas = componente
+        pixeles = sum(fin - inicio for _, inicio, fin in corridas)
+        bitmap = recortar_componente(tinta, componente, pixeles)
+        if x1 - x0 > MAX_LADO_SIMBOLO or y1 - y0 > MAX_LADO_SIMBOLO:
+            if residuo is None:
+                residuo = Image.new('1', tinta.size, 0)
+            residuo.paste(255, (x0, y0), mask=bitmap)
+            continue
+
+        clave = (bitmap.size, bitmap.tobytes())
+        indice = exactos.get(clave)
+        if indice is None:
+            candidatos = por_tamaño.setdefault(bitmap.size, [])
+            for candidato in reversed(candidatos[-MAX_COMPARACIONES_SIMBOLO:]):
+                # Cada pixel de tinta de más o de menos es una diferencia
+                tope = tintas[candidato] * FRACCION_DIFERENCIA_SIMBOLO
+                if abs(tintas[candidato] - pixeles) <= tope and parecidos(simbolos[candidato], bitmap, tintas[candidato]):
+                    indice = candidato
+                    break
+            else:
+                indice = len(simbolos)
+                simbolos.append(bitmap)
+                tintas.append(pixeles)
+                candidatos.append(indice)
+            exactos[clave] = indice
+        instancias.append((indice, x0, y1 - 1))
+    return simbolos, instancias, residuo
+
+def segmento(numero: int, tipo: int, datos: bytes, referidos=()) -> bytes:
+    """
+    Segmento con cabecera (7.2), asociado a la página 1.
+    """
+    ancho_referido = 1 if numero <= 256 else 2 if numero <= 65536 else 4
+    cabecera = struct.pack('>IBB', numero, tipo, len(referidos) << 5)
+    for referido in referidos:
+        cabecera += referido.to_bytes(ancho_referido, 'big')
+    return cabecera + struct.pack('>BI', 1, len(datos)) + datos
+
+def info_region(ancho: int, alto: int, x: int = 0, y: int = 0) -> bytes:
+    """
+    Campo de información de región (7.4.1) con combinación OR.
+    """
+    return struct.pack('>IIIIB', ancho, alto, x, y, 0)
+
+def diccionario_simbolos(simbolos: list, orden: list) -> bytes:
+    """
+    Datos de un diccionario de símbolos Huffman (7.4.2) sin refinamiento:
+    los símbolos van en orden (alto, ancho) crecientes y cada clase de
+    altura se guarda como un único bitmap colectivo en MMR, o sin comprimir
+    si así pesa menos. Se exportan todos.
+    """
+    escritor = EscritorBits()
+    alto_anterior = 0
+    i = 0
+    while i < len(orden):
+        alto = simbolos[orden[i]].height
+        j = i
+        while j < len(orden) and simbolos[orden[j]].height == alto:
+            j += 1
+        clase = [simbolos[k] for k in orden[i:j]]
+        escribir_valor(escritor, B4, alto - alto_anterior)
+        alto_anterior = alto
+        ancho_anterior = 0
+        for simbolo in clase:
+            escribir_valor(escritor, B2, simbolo.width - ancho_anterior)
+            ancho_anterior = simbolo.width
+        escribir_valor(escritor, B2, None)
+
+        colectivo = Image.new('1', (sum(s.width for s in clase), alto), 0)
+        x = 0
+        for simbolo in clase:
+            colectivo.paste(simbolo, (x, 0))
+            x += simbolo.width
+        crudo = colectivo.tobytes()
+        mmr = codificar_mmr(colectivo)
+        if mmr and len(mmr) < len(crudo):
+            escribir_valor(escritor, B1, len(mmr))
+            escritor.escribir_bytes(mmr)
+        else:
+            escribir_valor(escritor, B1, 0)
+            escritor.escribir_bytes(crudo)
+        i = j
+
+    # Símbolos exportados: ninguno de entrada, todos los nuevos
+    escribir_valor(escritor, B1, 0)
+    escribir_valor(escritor, B1, len(simbolos))
+    return struct.pack('>HII', 0x0001, len(simbolos), len(simbolos)) + escritor.obtener()
+
+def region_texto(ancho: int, alto: int, simbolos: list, posicion: list, instancias: list,
+                 log_franjas: int) -> bytes:
+    """
+    Datos de una región de texto Huffman (7.4.3) con esquina de referencia
+    abajo a la izquierda. posicion da el lugar de cada símbolo en el
+    diccionario. Las instancias se agrupan en franjas de 2**log_franjas
+    filas según su fila inferior, y dentro de cada franja de izquierda a
+    derecha.
+    """
+    franja = 1 << log_franjas
+    frecuencias = [0] * len(simbolos)
+    franjas = {}
+    for simbolo, x, y in instancias:
+        frecuencias[posicion[simbolo]] += 1
+        franjas.setdefault(y - y % franja, []).append((x, y, simbolo))
+
+    escritor = EscritorBits()
+    # Tabla de códigos de símbolo (7.4.3.1.7): los largos de cada símbolo se
+    # codifican con los RUNCODE 0-31, que a su vez llevan largos de 4 bits
+    largos = largos_huffman(frecuencias, 31)
+    usados = sorted(set(largos))
+    cuenta_usados = [largos.count(largo) for largo in usados]
+    largos_runcode = [0] * 35
+    for largo, largo_runcode in zip(usados, largos_huffman(cuenta_usados, 15)):
+        largos_runcode[largo] = largo_runcode
+    for largo_runcode in largos_runcode:
+        escritor.escribir(largo_runcode, 4)
+    codigos_runcode = asignar_codigos(largos_runcode)
+    for largo in largos:
+        escritor.escribir(codigos_runcode[largo], largos_runcode[largo])
+    escritor.alinear()
+    codigos = asignar_codigos(largos)
+
+    escribir_valor(escritor, B11, 1)
+    franja_t = -franja
+    primera_s = 0
+    for t in sorted(franjas):
+        escribir_valor(escritor, B11, (t - franja_t) // franja)
+        franja_t = t
+        actual_s = None
+        for x, y, simbolo in sorted(franjas[t]):
+            if actual_s is None:
+                escribir_valor(escritor, B6, x - primera_s)
+                primera_s = x
+            else:
+                escribir_valor(escritor, B8, x - actual_s - DESPLAZAMIENTO_DS)
+            if franja > 1:
+                escritor.escribir(y - t, log_franjas)
+            indice = posicion[simbolo]
+            escritor.escribir(codigos[indice], largos[indice])
+            actual_s = x + simbolos[simbolo].width - 1
+        escribir_valor(escritor, B8, None)
+
+    banderas = 0x0001 | (log_franjas << 2) | ((DESPLAZAMIENTO_DS & 0x1F) << 10)
+    return (info_region(ancho, alto) + struct.pack('>HHI', banderas, 0, len(instancias))
+            + escritor.obtener())
+
+def codificar_jbig2(tinta: Image.Image):
+    """
+    Codifica una página de modo '1' con la tinta en 1 como flujo JBIG2
+    embebible en un PDF (/JBIG2Decode, sin /JBIG2Globals). Devuelve None si
+    la página no se presta (demasiadas componentes) o si hay componentes
+    grandes y no hay libtiff para la región genérica MMR.
+    """
+    ancho, alto = tinta.size
+    extraido = extraer_simbolos(tinta)
+    if extraido is None:
+        return None
+    simbolos, instancias, residuo = extraido
+    if residuo is not None and not MMR:
+        return None
+
+    segmentos = [segmento(0, TIPO_INFO_PAGINA, struct.pack('>IIIIBH', ancho, alto, 0, 0, 0, 0))]
+    numero = 1
+    if simbolos:
+        orden = sorted(range(len(simbolos)), key=lambda i: (simbolos[i].height, simbolos[i].width))
+        posicion = [0] * len(simbolos)
+        for lugar, indice in enumerate(orden):
+            posicion[indice] = lugar
+        segmentos.append(segmento(numero, TIPO_DICCIONARIO, diccionario_simbolos(simbolos, orden)))
+        texto = min((region_texto(ancho, alto, simbolos, posicion, instancias, log_franjas)
+                     for log_franjas in range(4)), key=len)
+        segmentos.append(segmento(numero + 1, TIPO_REGION_TEXTO, texto, referidos=(numero,)))
+        numero += 2
+
+    if residuo is not None:
+        x0, y0, x1, y1 = residuo.getbbox()
+        recorte = residuo.crop((x0, y0, x1, y1))
+        datos = info_region(x1 - x0, y1 - y0, x0, y0) + b'\x01' + codificar_mmr(recorte)
+        segmentos.append(segmento(numero, TIPO_REGION_GENERICA, datos))
+    return b''.join(segmentos)
@@ -2,10 +2,131 @@ import fitz  # PyMuPDF
 import os
 import subprocess
 import io
-from PIL import Image
+from PIL import Image, ImageChops, ImageFilter, ImageMath, features
 import tempfile
+import shutil
+import time
+import hashlib
+import math
+import re
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from backend.models import analisis_model, jbig2_model
 
-def comprimir_pdf(ruta: str, nivel: str = 'media') -> str:
+# Subir cuando un cambio del motor altere los PDF que produce: forma parte
+# de la clave de la caché de resultados
+VERSION_MOTOR = 12
+
+# Imágenes más pequeñas que esto no se recomprimen
+UMBRAL_BYTES_IMAGEN = 20 * 1024
+
+# Las imágenes se reducen solo si en su colocación más grande quedan a más
+# de FACTOR_UMBRAL_PPI veces el dpi del nivel, y entonces se llevan a ese dpi
+FACTOR_UMBRAL_PPI = 1.5
+
+# Operadores de construcción de trazados en un content stream
+OPERADORES_TRAZADO = re.compile(rb"(?<![A-Za-z])(?:m|l|c|v|y|re|h)(?![A-Za-z*])")
+
+# Pasos (dpi, calidad JPEG) del modo por tamaño objetivo, de mejor a peor.
+# Las páginas bilevel van a 1 bit con FACTOR_DPI_BILEVEL_OBJETIVO veces el dpi
+ESCALA_OBJETIVO = [(200, 85), (150, 75), (150, 60), (120, 50), (100, 40), (85, 35), (72, 30), (60, 25)]
+FACTOR_DPI_BILEVEL_OBJETIVO = 4 / 3
+DPI_COMPLEJIDAD = 36
+SOBRECARGA_PDF = 4 * 1024
+SOBRECARGA_PAGINA = 600
+MAX_REINTENTOS_OBJETIVO = 3
+
+# Páginas bilevel (texto en blanco y negro): sonda de baja resolución,
+# umbrales sobre sus histogramas y costo del 1 bit resultante
+DPI_SONDA = 72
+MAX_DIMENSION_SONDA = 800
+COBERTURA_ESCANEO = 0.5
+UMBRAL_CROMA = 48
+MARGEN_PAPEL = 24
+FRACCION_COLOR_BILEVEL = 0.01
+FRACCION_FONDO_BILEVEL = 0.5
+CONTRASTE_SUAVE = 64
+FRACCION_GRIS_SUAVE_BILEVEL = 0.0005
+MAX_DIMENSION_BILEVEL = 3300
+BYTES_PIXEL_BILEVEL = 0.015
+
+# Mixed raster content (MRC) para escaneos con texto: la tinta es la que
+# queda DIFERENCIA_TINTA por debajo de la media local y tiene un borde de al
+# menos CONTRASTE_BORDE_TINTA; la página debe tener entre FRACCION_TEXTO_MRC
+# de tinta. El color del texto va en celdas de REDUCCION_FRENTE pixeles. Las
+# capas se usan solo si no pesan más de MARGEN_MRC veces el JPEG de la página
+DIFERENCIA_TINTA = 48
+CONTRASTE_BORDE_TINTA = 96
+FRACCION_TEXTO_MRC = (0.002, 0.3)
+REDUCCION_FRENTE = 8
+MARGEN_MRC = 1.2
+
+# Páginas e imágenes sin color (se renderizan y codifican en un canal):
+# croma tolerada por ruido de escáner y fracción máxima de pixeles con color
+UMBRAL_CROMA_GRIS = 24
+FRACCION_COLOR_GRIS = 0.001
+TIFF_G4 = features.check('libtiff')
+# Con libjpeg-turbo PIL codifica JPEG ~10 veces más rápido que MuPDF
+JPEG_TURBO = features.check_feature('libjpeg_turbo')
+
+# Páginas por ventana en modo de memoria acotada, y a partir de cuántas
+# páginas se usa automáticamente
+TAM_VENTANA = 50
+PAGINAS_MODO_VENTANAS = 500
+
+# Proyección del tamaño de salida: desde la página PAGINAS_PROYECCION, si el
+# promedio por página proyecta más que el original se abandona la compresión
+PAGINAS_PROYECCION = 5
+
+# Estimación previa: páginas de muestra (una por estrato de peso) y factor
+# de las cotas (z de una normal para ~90% de confianza)
+MUESTRAS_ESTIMACION = 5
+Z_ESTIMACION = 1.645
+
+# En documentos cortos, a lo sumo una muestra cada PAGINAS_POR_MUESTRA
+# páginas (mínimo 2)
+PAGINAS_POR_MUESTRA = 6
+
+# Hilos que codifican páginas raster (PIL suelta el GIL al codificar)
+# mientras el hilo principal renderiza la siguiente con MuPDF
+HILOS_CODIFICACION = 2
+
+# selector_paginas: elegir por página entre vector, solo imágenes o raster
+# bilevel: las páginas raster en blanco y negro van a 1 bit a dpi_bilevel
+# jbig2: las imágenes de 1 bit prueban también JBIG2 (más chico, más lento)
+# mrc: los escaneos con texto se separan en máscara de texto (dpi_bilevel),
+# fondo (dpi_fondo) y color del texto
+# rapido: prioriza la latencia; JPEG sin optimize ni progresivo (de MuPDF,
+# directo desde el Pixmap, si PIL no tiene libjpeg-turbo) y las imágenes se
+# reducen con BILINEAR
+CONFIGURACIONES = {
+    'baja': {'dpi': 200, 'calidad_jpeg': 85, 'max_dimension': 1500, 'metodo': 'conservador'},
+    'media': {'dpi': 150, 'calidad_jpeg': 70, 'max_dimension': 1200, 'metodo': 'hibrido', 'selector_paginas': True,
+              'bilevel': True, 'dpi_bilevel': 200},
+    'alta': {'dpi': 120, 'calidad_jpeg': 55, 'max_dimension': 900, 'metodo': 'agresivo', 'selector_paginas': True,
+             'bilevel': True, 'dpi_bilevel': 150, 'jbig2': True, 'mrc': True, 'dpi_fondo': 60},
+    'maxima': {'dpi': 100, 'calidad_jpeg': 40, 'max_dimension': 700, 'metodo': 'extremo', 'selector_paginas': True,
+               'bilevel': True, 'dpi_bilevel': 150, 'jbig2': True},
+    'velocidad': {'dpi': 120, 'calidad_jpeg': 60, 'max_dimension': 1000, 'metodo': 'hibrido', 'selector_paginas': True,
+                  'rapido': True}
+}
+
+class CompresionCancelada(BaseException):
+    """
+    Se lanza desde la función progreso para detener una compresión en curso.
+    Hereda de BaseException para que los fallbacks (except Exception) no la
+    traten como un error de página.
+    """
+
+class CompresionNoRentable(Exception):
+    """
+    Se lanza desde procesar_rango cuando la proyección indica que la salida
+    pesaría más que el original (PDFs ya optimizados).
+    """
+
+def comprimir_pdf(ruta: str, nivel: str = 'media', workers: int = 1, ventana: int = None,
+                  progreso=None, ruta_salida: str = None) -> str:
     """
     Comprime un PDF con diferentes niveles de calidad y compresión.
     
@@ -14,41 +135,78 @@ def comprimir_pdf(ruta: str, nivel: str = 'media') -> str:
     - 'media': Compresión moderada, buena calidad 
     - 'alta': Compresión agresiva, calidad aceptable
     - 'maxima': Compresión extrema, baja calidad (muy pequeño)
+    - 'velocidad': Compresión moderada lo más rápido posible (uso interactivo)
+
+    Con workers > 1 las páginas se reparten entre varios procesos.
+    Con ventana (o documentos de PAGINAS_MODO_VENTANAS páginas o más) se
+    procesa por ventanas de páginas con memoria acotada.
+    progreso: función opcional que recibe un dict por cada avance (ver notificar_pagina).
+    El resultado nunca pesa más que el original (ver no_mayor_que_original).
+    ruta_salida: dónde dejarlo (por defecto, ruta_salida_pdf).
     """
-    nombre_original = os.path.basename(ruta)
-    carpeta = tempfile.gettempdir()
-    nombre_salida = nombre_original.replace('.pdf', '_comprimido.pdf')
-    ruta_salida = os.path.join(carpeta, nombre_salida)
+    ruta_salida = ruta_salida or ruta_salida_pdf(ruta)
 
-    configuraciones = {
-        'baja': {'dpi': 200, 'calidad_jpeg': 85, 'max_dimension': 1500, 'metodo': 'conservador'},
-        'media': {'dpi': 150, 'calidad_jpeg': 70, 'max_dimension': 1200, 'metodo': 'hibrido'},
-        'alta': {'dpi': 120, 'calidad_jpeg': 55, 'max_dimension': 900, 'metodo': 'agresivo'},
-        'maxima': {'dpi': 100, 'calidad_jpeg': 40, 'max_dimension': 700, 'metodo': 'extremo'}
-    }
-    
-    config = configuraciones.get(nivel, configuraciones['media'])
+    config = CONFIGURACIONES.get(nivel, CONFIGURACIONES['media'])
     
     try:
         if config['metodo'] == 'conservador':
-            resultado = comprimir_pdf_conservador(ruta, ruta_salida, config)
+            # Trabaja por imagen (xref), no por página: no se reparte en procesos
+            resultado = comprimir_pdf_conservador(ruta, ruta_salida, config, progreso)
+        elif workers > 1:
+            resultado = comprimir_pdf_paralelo(ruta, ruta_salida, config, workers, progreso)
+        elif ventana or contar_paginas(ruta) >= PAGINAS_MODO_VENTANAS:
+            resultado = comprimir_pdf_por_ventanas(ruta, ruta_salida, config, ventana, progreso)
         elif config['metodo'] == 'hibrido':
-            resultado = comprimir_pdf_hibrido(ruta, ruta_salida, config)
+            resultado = comprimir_pdf_hibrido(ruta, ruta_salida, config, progreso)
         else:
-            resultado = comprimir_pdf_agresivo_config(ruta, ruta_salida, config)
+            resultado = comprimir_pdf_agresivo_config(ruta, ruta_salida, config, progreso)
             
         if os.path.exists(resultado):
             tamaño = os.path.getsize(resultado)
             print(f"Archivo comprimido creado en {resultado} con tamaño: {tamaño} bytes")
         else:
             print(f"Error: El archivo {resultado} no se creó")
-        return resultado
-            
+    
+    except CompresionNoRentable as e:
+        print(f"Compresión abandonada: {e}")
+        resultado = comprimir_pdf_basico_seguro(ruta, ruta_salida)
     except Exception as e:
         print(f"Error con método principal: {e}")
-        return comprimir_pdf_simple_mejorado(ruta, ruta_salida)
+        resultado = comprimir_pdf_simple_mejorado(ruta, ruta_salida)
+    
+    return no_mayor_que_original(ruta, resultado)
+
+def no_mayor_que_original(ruta_entrada: str, ruta_salida: str) -> str:
+    """
+    Garantía final: la salida nunca pesa más que el original. Si pesa más
+    se guarda el original limpio (comprimir_pdf_basico_seguro) y, si eso
+    tampoco gana, se entrega una copia exacta del original.
+    """
+    tamaño_original = os.path.getsize(ruta_entrada)
+    if os.path.exists(ruta_salida) and os.path.getsize(ruta_salida) <= tamaño_original:
+        return ruta_salida
+    
+    print(f"La salida pesa más que el original ({tamaño_original} bytes): se conserva el original")
+    comprimir_pdf_basico_seguro(ruta_entrada, ruta_salida)
+    if os.path.getsize(ruta_salida) > tamaño_original:
+        shutil.copyfile(ruta_entrada, ruta_salida)
+    return ruta_salida
+
+def ruta_salida_pdf(ruta: str, unica: bool = False) -> str:
+    """
+    Ruta donde se deja el PDF comprimido: <nombre>_comprimido.pdf en la
+    carpeta temporal. Con unica=True se crea un archivo con nombre propio
+    (mkstemp), para trabajos que corren a la vez y pueden repetir nombre.
+    """
+    if unica:
+        nombre = os.path.splitext(os.path.basename(ruta))[0]
+        descriptor, ruta_salida = tempfile.mkstemp(prefix=f"{nombre}_comprimido_", suffix='.pdf')
+        os.close(descriptor)
+        return ruta_salida
+    nombre_salida = os.path.basename(ruta).replace('.pdf', '_comprimido.pdf')
+    return os.path.join(tempfile.gettempdir(), nombre_salida)
 
-def comprimir_pdf_hibrido(ruta_entrada: str, ruta_salida: str, config: dict) -> str:
+def comprimir_pdf_hibrido(ruta_entrada: str, ruta_salida: str, config: dict, progreso=None) -> str:
     """
     Compresión balanceada: buena calidad y reducción decente.
     El mejor equilibrio para uso general.
@@ -59,35 +217,8 @@ def comprimir_pdf_hibrido(ruta_entrada: str, ruta_salida: str, config: dict) ->
     print(f"Aplicando compresión EQUILIBRADA...")
     
     try:
-        for num_pagina in range(doc_original.page_count):
-            if num_pagina % 10 == 0:
-                print(f"Procesando página {num_pagina + 1}/{doc_original.page_count}")
-                
-            pagina_original = doc_original[num_pagina]
-            pagina_nueva = doc_nuevo.new_page(
-                width=pagina_original.rect.width,
-                height=pagina_original.rect.height
-            )
-            
-            try:
-                success = procesar_pagina_equilibrada(pagina_original, pagina_nueva, config)
-                
-                if not success:
-                    matriz = fitz.Matrix(0.8, 0.8)
-                    pix = pagina_original.get_pixmap(matrix=matriz, alpha=False)
-                    img_data = pix.tobytes("jpeg", jpg_quality=config['calidad_jpeg'])
-                    pagina_nueva.insert_image(pagina_nueva.rect, stream=img_data)
-                    pix = None
-                    
-            except Exception as e:
-                print(f"Error en página {num_pagina}: {e}")
-                try:
-                    pagina_nueva.show_pdf_page(pagina_nueva.rect, doc_original, num_pagina)
-                except Exception as e2:
-                    print(f"Fallback falló en página {num_pagina}: {e2}")
-                    pass
-        
-        doc_nuevo.save(ruta_salida, garbage=3, deflate=True, clean=True)
+        procesar_rango(doc_original, doc_nuevo, config, 0, doc_original.page_count, progreso)
+        doc_nuevo.save(ruta_salida, garbage=4, deflate=True, clean=True)
     finally:
         doc_original.close()
         doc_nuevo.close()
@@ -95,357 +226,1599 @@ def comprimir_pdf_hibrido(ruta_entrada: str, ruta_salida: str, config: dict) ->
     
     return ruta_salida
 
-def comprimir_pdf_conservador(ruta_entrada: str, ruta_salida: str, config: dict) -> str:
+def comprimir_pdf_conservador(ruta_entrada: str, ruta_salida: str, config: dict, progreso=None) -> str:
     """
     Compresión suave que mantiene muy buena calidad visual.
     Ideal para documentos importantes o presentaciones.
+    Solo recomprime las imágenes; texto, vectores y fuentes quedan intactos.
     """
-    doc_original = fitz.open(ruta_entrada)
-    doc_nuevo = fitz.open()
+    doc = fitz.open(ruta_entrada)
     
     print(f"Aplicando compresión SUAVE (alta calidad)...")
     
-    for num_pagina in range(doc_original.page_count):
-        if num_pagina % 10 == 0:
-            print(f"Procesando página {num_pagina + 1}/{doc_original.page_count}")
-            
-        pagina_original = doc_original[num_pagina]
-        pagina_nueva = doc_nuevo.new_page(
-            width=pagina_original.rect.width,
-            height=pagina_original.rect.height
-        )
-        
-        try:
-            # Intentar preservar texto y solo comprimir imágenes
-            success = procesar_pagina_conservadora(pagina_original, pagina_nueva, doc_original, config)
-            
-            if not success:
-                # Fallback: renderizado de alta calidad
-                matriz = fitz.Matrix(config['dpi']/72, config['dpi']/72)
-                pix = pagina_original.get_pixmap(matrix=matriz, alpha=False)
-                img_data = pix.tobytes("jpeg", jpg_quality=config['calidad_jpeg'])
-                pagina_nueva.insert_image(pagina_nueva.rect, stream=img_data)
-                pix = None
-                
-        except Exception:
-            # Último recurso: copiar página original
-            try:
-                pagina_nueva.show_pdf_page(pagina_nueva.rect, doc_original, num_pagina)
-            except:
-                pass
-    
-    doc_nuevo.save(ruta_salida, garbage=2, deflate=True, clean=True)  # Limpieza suave
-    doc_original.close()
-    doc_nuevo.close()
+    try:
+        cache = CacheImagenes()
+        reemplazadas = recomprimir_imagenes(doc, config, cache, progreso=progreso)
+        estadisticas = cache.estadisticas()
+        print(f"Imágenes recomprimidas: {reemplazadas} "
+              f"(caché: {estadisticas['aciertos']} aciertos, {estadisticas['fallos']} fallos)")
+        doc.save(ruta_salida, garbage=2, deflate=True, clean=True)  # Limpieza suave
+    finally:
+        doc.close()
     
     return ruta_salida
 
-def comprimir_pdf_hibrido(ruta_entrada: str, ruta_salida: str, config: dict) -> str:
+def comprimir_pdf_agresivo_config(ruta_entrada: str, ruta_salida: str, config: dict, progreso=None) -> str:
     """
-    Compresión balanceada: buena calidad y reducción decente.
-    El mejor equilibrio para uso general.
+    Compresión agresiva o extrema según configuración.
     """
     doc_original = fitz.open(ruta_entrada)
     doc_nuevo = fitz.open()
     
-    print(f"Aplicando compresión EQUILIBRADA...")
+    nivel_texto = "AGRESIVA" if config['metodo'] == 'agresivo' else "EXTREMA"
+    print(f"Aplicando compresión {nivel_texto}...")
     
-    for num_pagina in range(doc_original.page_count):
-        if num_pagina % 10 == 0:
-            print(f"Procesando página {num_pagina + 1}/{doc_original.page_count}")
-            
-        pagina_original = doc_original[num_pagina]
-        pagina_nueva = doc_nuevo.new_page(
-            width=pagina_original.rect.width,
-            height=pagina_original.rect.height
-        )
-        
-        try:
-            success = procesar_pagina_equilibrada(pagina_original, pagina_nueva, config)
-            
-            if not success:
-                matriz = fitz.Matrix(0.8, 0.8)  # 80% del tamaño
-                pix = pagina_original.get_pixmap(matrix=matriz, alpha=False)
-                img_data = pix.tobytes("jpeg", jpg_quality=config['calidad_jpeg'])
-                pagina_nueva.insert_image(pagina_nueva.rect, stream=img_data)
-                pix = None
-                
-        except Exception:
+    try:
+        procesar_rango(doc_original, doc_nuevo, config, 0, doc_original.page_count, progreso)
+        doc_nuevo.save(ruta_salida, garbage=4, deflate=True, clean=True)
+    finally:
+        doc_original.close()
+        doc_nuevo.close()
+    
+    return ruta_salida
+
+def comprimir_pdf_paralelo(ruta_entrada: str, ruta_salida: str, config: dict, workers: int,
+                           progreso=None) -> str:
+    """
+    Reparte las páginas en bloques contiguos entre varios procesos.
+    Cada proceso genera un PDF parcial y luego se unen en orden.
+    """
+    with fitz.open(ruta_entrada) as doc:
+        total_paginas = doc.page_count
+        # Una sola pasada por el documento, no una por bloque
+        usos = usos_imagenes(doc)
+
+    workers = max(1, min(workers, os.cpu_count() or 1, total_paginas))
+    bloques = dividir_paginas(total_paginas, workers * 2)
+    carpeta_parciales = tempfile.mkdtemp(prefix="compresor_")
+
+    print(f"Aplicando compresión en paralelo con {workers} procesos ({len(bloques)} bloques)...")
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futuros = {
+                executor.submit(comprimir_bloque, ruta_entrada,
+                                os.path.join(carpeta_parciales, f"parcial_{i:04d}.pdf"),
+                                config, inicio, fin, None, usos): fin - inicio
+                for i, (inicio, fin) in enumerate(bloques)
+            }
+            paginas_hechas = 0
             try:
-                pagina_nueva.show_pdf_page(pagina_nueva.rect, doc_original, num_pagina)
-            except:
-                pass
+                for futuro in as_completed(futuros):
+                    paginas_hechas += futuros[futuro]
+                    notificar_pagina(progreso, paginas_hechas, total_paginas, os.path.getsize(futuro.result()))
+            except (CompresionCancelada, CompresionNoRentable):
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+            # El orden de inserción de los futuros es el orden de las páginas
+            rutas_parciales = [futuro.result() for futuro in futuros]
+
+        # garbage=4 fusiona los streams (imágenes, perfiles ICC) que quedaron
+        # duplicados entre parciales; en serie se comparten desde el inicio.
+        if total_paginas >= PAGINAS_MODO_VENTANAS:
+            unir_parciales_en_disco(rutas_parciales, ruta_salida, garbage=4)
+        else:
+            unir_parciales(rutas_parciales, ruta_salida, garbage=4)
+    finally:
+        shutil.rmtree(carpeta_parciales, ignore_errors=True)
+
+    return ruta_salida
+
+def comprimir_pdf_por_ventanas(ruta_entrada: str, ruta_salida: str, config: dict, tam_ventana: int = None,
+                               progreso=None) -> str:
+    """
+    Compresión con memoria acotada para PDFs muy grandes.
+    Procesa las páginas en ventanas, guarda cada ventana terminada en disco
+    y libera todo antes de seguir; al final une las ventanas en disco.
+    """
+    tam_ventana = tam_ventana or TAM_VENTANA
+    with fitz.open(ruta_entrada) as doc:
+        total_paginas = doc.page_count
+        # Una sola pasada por el documento, no una por ventana
+        usos = usos_imagenes(doc)
     
-    doc_nuevo.save(ruta_salida, garbage=3, deflate=True, clean=True)
-    doc_original.close()
-    doc_nuevo.close()
+    carpeta_parciales = tempfile.mkdtemp(prefix="compresor_")
+    
+    print(f"Aplicando compresión por ventanas de {tam_ventana} páginas...")
+    
+    try:
+        rutas_parciales = []
+        for i, inicio in enumerate(range(0, total_paginas, tam_ventana)):
+            fin = min(inicio + tam_ventana, total_paginas)
+            ruta_parcial = os.path.join(carpeta_parciales, f"ventana_{i:04d}.pdf")
+            rutas_parciales.append(comprimir_bloque(ruta_entrada, ruta_parcial, config, inicio, fin, progreso, usos))
+            # Vaciar la caché de recursos de MuPDF (fuentes, imágenes decodificadas)
+            fitz.TOOLS.store_shrink(100)
+        
+        unir_parciales_en_disco(rutas_parciales, ruta_salida, garbage=4)
+    finally:
+        shutil.rmtree(carpeta_parciales, ignore_errors=True)
     
     return ruta_salida
 
-def comprimir_pdf_agresivo_config(ruta_entrada: str, ruta_salida: str, config: dict) -> str:
+def contar_paginas(ruta: str) -> int:
     """
-    Compresión agresiva o extrema según configuración.
+    Cantidad de páginas del PDF sin procesarlo.
+    """
+    with fitz.open(ruta) as doc:
+        return doc.page_count
+
+def dividir_paginas(total_paginas: int, num_bloques: int) -> list:
+    """
+    Divide el rango de páginas en bloques contiguos de tamaño similar.
+    """
+    num_bloques = max(1, min(num_bloques, total_paginas))
+    tamaño, resto = divmod(total_paginas, num_bloques)
+    bloques = []
+    inicio = 0
+    for i in range(num_bloques):
+        fin = inicio + tamaño + (1 if i < resto else 0)
+        bloques.append((inicio, fin))
+        inicio = fin
+    return bloques
+
+def comprimir_bloque(ruta_entrada: str, ruta_parcial: str, config: dict, inicio: int, fin: int,
+                     progreso=None, usos: dict = None) -> str:
+    """
+    Procesa las páginas [inicio, fin) en un documento parcial.
+    Se ejecuta dentro de un proceso del pool.
+    usos: usos_imagenes del documento entero, calculado una vez por quien
+    reparte los bloques.
     """
     doc_original = fitz.open(ruta_entrada)
     doc_nuevo = fitz.open()
+
+    try:
+        procesar_rango(doc_original, doc_nuevo, config, inicio, fin, progreso, usos=usos)
+        doc_nuevo.save(ruta_parcial, garbage=1, deflate=True)
+    finally:
+        doc_original.close()
+        doc_nuevo.close()
+
+    return ruta_parcial
+
+def unir_parciales(rutas_parciales: list, ruta_salida: str, garbage: int) -> str:
+    """
+    Une los documentos parciales en orden y guarda el resultado final.
+    """
+    doc_final = fitz.open()
+    try:
+        for ruta_parcial in rutas_parciales:
+            with fitz.open(ruta_parcial) as parcial:
+                doc_final.insert_pdf(parcial)
+        doc_final.save(ruta_salida, garbage=garbage, deflate=True, clean=True)
+    finally:
+        doc_final.close()
+    return ruta_salida
+
+def comprimir_pdf_objetivo(ruta: str, objetivo_bytes: int, progreso=None, ruta_salida: str = None) -> str:
+    """
+    Comprime un PDF para que pese como máximo objetivo_bytes.
     
-    nivel_texto = "AGRESIVA" if config['metodo'] == 'agresivo' else "EXTREMA"
-    print(f"Aplicando compresión {nivel_texto}...")
+    Las páginas nativas que convienen en vector o con sus imágenes
+    recomprimidas se conservan (texto y trazados intactos); las demás y los
+    escaneos se rasterizan en 1 bit, JPEG en grises o JPEG en color según
+    su contenido (clasificar_objetivo).
+    El presupuesto se reparte entre unidades, cada una con su paso de
+    ESCALA_OBJETIVO: ('pagina', n) es una página raster e ('imagen', xref)
+    una imagen de las páginas conservadas, recomprimida en el sitio. Unas
+    pocas unidades de muestra de cada clase se miden en cada paso y el
+    resto se proyecta por su complejidad. Si el archivo se pasa, las
+    unidades más pesadas bajan un paso y se vuelve a armar. Si ni el último
+    paso alcanza, se entrega lo más chico que se logró: quien llama compara
+    el tamaño con el objetivo.
+    ruta_salida: dónde dejarlo (por defecto, ruta_salida_pdf).
+    """
+    ruta_salida = ruta_salida or ruta_salida_pdf(ruta)
     
-    for num_pagina in range(doc_original.page_count):
-        if num_pagina % 5 == 0:
-            print(f"Procesando página {num_pagina + 1}/{doc_original.page_count}")
-            
-        pagina_original = doc_original[num_pagina]
-        pagina_nueva = doc_nuevo.new_page(
-            width=pagina_original.rect.width,
-            height=pagina_original.rect.height
+    doc_original = fitz.open(ruta)
+    
+    print(f"Aplicando compresión con objetivo de {objetivo_bytes} bytes...")
+    
+    try:
+        total_paginas = doc_original.page_count
+        
+        config_superior = config_objetivo(0)
+        usos = usos_imagenes(doc_original)
+        conservadas = []
+        for num_pagina in range(total_paginas):
+            pagina = doc_original[num_pagina]
+            perfil = perfilar_pagina(pagina, usos)
+            # Los escaneos van siempre a raster, donde pueden bajar a 1 bit
+            if (perfil["cobertura_imagenes"] < COBERTURA_ESCANEO
+                    and elegir_representacion(perfil, pagina, config_superior) in ('vector', 'imagenes')):
+                conservadas.append(num_pagina)
+        raster = sorted(set(range(total_paginas)) - set(conservadas))
+        
+        complejidad, clases = {}, {}
+        for num_pagina in raster:
+            complejidad[('pagina', num_pagina)] = medir_complejidad(doc_original[num_pagina])
+            clases[('pagina', num_pagina)] = clasificar_objetivo(doc_original[num_pagina])
+        codificaciones = CodificacionesObjetivo(doc_original, conservadas, clases)
+        for xref, bytes_xref in codificaciones.imagenes.items():
+            complejidad[('imagen', xref)] = bytes_xref
+            clases[('imagen', xref)] = 'imagen'
+        ratios = ajustar_curva_objetivo(complejidad, clases, codificaciones.peso)
+        
+        presupuesto = (objetivo_bytes - SOBRECARGA_PDF - SOBRECARGA_PAGINA * len(raster)
+                       - bytes_fijos_conservadas(ruta, conservadas, codificaciones))
+        pasos = repartir_presupuesto(complejidad, ratios, presupuesto)
+        tamaño = armar_objetivo(ruta, ruta_salida, pasos, codificaciones, progreso)
+        
+        # Si la estimación falló, bajar un paso solo a las unidades más pesadas
+        for _ in range(MAX_REINTENTOS_OBJETIVO):
+            if tamaño <= objetivo_bytes:
+                break
+            exceso = tamaño - objetivo_bytes
+            ahorro = 0
+            for unidad in sorted(pasos, key=lambda u: codificaciones.peso(u, pasos[u]), reverse=True):
+                if ahorro >= exceso:
+                    break
+                if pasos[unidad] + 1 >= len(ESCALA_OBJETIVO):
+                    continue
+                anterior = codificaciones.peso(unidad, pasos[unidad])
+                pasos[unidad] += 1
+                ahorro += anterior - codificaciones.peso(unidad, pasos[unidad])
+            if ahorro <= 0:
+                print("No se puede reducir más: todas las unidades están en el paso mínimo")
+                break
+            print(f"Objetivo superado por {exceso} bytes, recodificando lo más pesado...")
+            tamaño = armar_objetivo(ruta, ruta_salida, pasos, codificaciones)
+    finally:
+        doc_original.close()
+    
+    print(f"Archivo comprimido creado en {ruta_salida} con tamaño: {tamaño} bytes")
+    return no_mayor_que_original(ruta, ruta_salida)
+
+class CodificacionesObjetivo:
+    """
+    Codificaciones del modo por tamaño objetivo, calculadas una sola vez por
+    unidad y paso (las muestras de la curva se reutilizan al armar).
+    ('pagina', n): codificar_paso con la clase de la página.
+    ('imagen', xref): recomprimir_imagen a la calidad y resolución del paso;
+    si no conviene queda la original.
+    """
+    
+    def __init__(self, doc, conservadas: list, clases: dict):
+        self.doc = doc
+        self.clases = clases
+        self.colocaciones = medidas_colocacion(doc, conservadas)
+        # Imágenes recomprimibles de las páginas conservadas: {xref: bytes}
+        # y una página que las usa, para reemplazarlas
+        self.imagenes = {}
+        self.pagina_de = {}
+        for num_pagina in conservadas:
+            for img_info in doc[num_pagina].get_images(full=True):
+                xref, smask = img_info[0], img_info[1]
+                if xref == 0 or smask or xref in self.imagenes:
+                    continue
+                bytes_xref = len(doc.xref_stream_raw(xref) or b"")
+                if bytes_xref >= UMBRAL_BYTES_IMAGEN:
+                    self.imagenes[xref] = bytes_xref
+                    self.pagina_de[xref] = num_pagina
+        self.resultados = {}
+    
+    def obtener(self, unidad: tuple, paso: int) -> tuple:
+        """
+        (bytes, codificación) de la unidad en el paso: para páginas, la
+        función insertar de codificar_paso; para imágenes, el stream nuevo
+        o None si se deja la original.
+        """
+        clave = (unidad, paso)
+        if clave not in self.resultados:
+            tipo, numero = unidad
+            if tipo == 'pagina':
+                self.resultados[clave] = codificar_paso(self.doc[numero], paso, self.clases[unidad])
+            else:
+                datos = recomprimir_imagen(self.doc, numero, config_objetivo(paso), self.colocaciones.get(numero))
+                self.resultados[clave] = (len(datos) if datos else self.imagenes[numero], datos)
+        return self.resultados[clave]
+    
+    def peso(self, unidad: tuple, paso: int) -> int:
+        return self.obtener(unidad, paso)[0]
+
+def bytes_fijos_conservadas(ruta: str, conservadas: list, codificaciones) -> int:
+    """
+    Lo que pesan las páginas conservadas sin las imágenes que entran en el
+    presupuesto: contenido, fuentes y recursos compartidos. Se mide
+    guardando esas páginas con las imágenes cambiadas por un píxel.
+    """
+    if not conservadas:
+        return 0
+    with fitz.open(ruta) as fuente, fitz.open() as copia:
+        pixel = fitz.Pixmap(fitz.csGRAY, fitz.IRect(0, 0, 1, 1), False)
+        for xref in codificaciones.imagenes:
+            fuente[codificaciones.pagina_de[xref]].replace_image(xref, pixmap=pixel)
+        for num_pagina in conservadas:
+            copia.insert_pdf(fuente, from_page=num_pagina, to_page=num_pagina, final=False)
+        tamaño = len(copia.tobytes(garbage=4, deflate=True, clean=True))
+    return max(tamaño - SOBRECARGA_PDF, 0)
+
+def armar_objetivo(ruta: str, ruta_salida: str, pasos: dict, codificaciones, progreso=None) -> int:
+    """
+    Arma y guarda el PDF con el paso de cada unidad. Las imágenes se
+    reemplazan en una copia del original, de la que se copian las páginas
+    conservadas; las páginas raster se crean con su codificación.
+    Devuelve el tamaño del archivo.
+    """
+    fuente = fitz.open(ruta)
+    doc_nuevo = fitz.open()
+    try:
+        for (tipo, xref), paso in pasos.items():
+            datos = codificaciones.obtener((tipo, xref), paso)[1] if tipo == 'imagen' else None
+            if datos:
+                fuente[codificaciones.pagina_de[xref]].replace_image(xref, stream=datos)
+        
+        total_paginas = fuente.page_count
+        for num_pagina in range(total_paginas):
+            if num_pagina % 10 == 0:
+                print(f"Procesando página {num_pagina + 1}/{total_paginas}")
+            unidad = ('pagina', num_pagina)
+            if unidad in pasos:
+                insertar = codificaciones.obtener(unidad, pasos[unidad])[1]
+                insertar_pagina_objetivo(doc_nuevo, fuente[num_pagina], num_pagina, insertar)
+            else:
+                doc_nuevo.insert_pdf(fuente, from_page=num_pagina, to_page=num_pagina, final=False)
+            if progreso:
+                notificar_pagina(progreso, num_pagina + 1, total_paginas, bytes_pagina(doc_nuevo, num_pagina))
+        
+        doc_nuevo.save(ruta_salida, garbage=4, deflate=True, clean=True)
+    finally:
+        fuente.close()
+        doc_nuevo.close()
+    return os.path.getsize(ruta_salida)
+
+def config_objetivo(paso: int) -> dict:
+    """
+    Configuración de raster para un paso de ESCALA_OBJETIVO.
+    """
+    dpi, calidad = ESCALA_OBJETIVO[paso]
+    return {'dpi': dpi, 'calidad_jpeg': calidad, 'max_dimension': 10000, 'metodo': 'objetivo',
+            'dpi_bilevel': round(dpi * FACTOR_DPI_BILEVEL_OBJETIVO)}
+
+def clasificar_objetivo(pagina) -> str:
+    """
+    Codificador de una página raster del modo por tamaño objetivo:
+    'bilevel' (1 bit), 'gris' (JPEG de un canal) o 'color' (JPEG RGB).
+    """
+    sonda = sondear_pagina(pagina)
+    if es_bilevel(sonda):
+        return 'bilevel'
+    return 'gris' if es_gris(miniatura(sonda)) else 'color'
+
+def codificar_paso(pagina, paso: int, clase: str = 'color') -> tuple:
+    """
+    Renderiza la página y la codifica con el paso indicado y el codificador
+    de su clase (ver clasificar_objetivo).
+    Devuelve (bytes, insertar), donde insertar(pagina_nueva) coloca la imagen.
+    """
+    config = config_objetivo(paso)
+    if clase == 'bilevel':
+        bits = binarizar(renderizar_pagina(pagina, config_bilevel(config), gris=True))
+        codificada = codificar_1bit(bits)
+        return len(codificada[2]), lambda pagina_nueva: insertar_imagen_bilevel(pagina_nueva, bits, codificada)
+    buffer = io.BytesIO()
+    renderizar_pagina(pagina, config, gris=clase == 'gris').save(
+        buffer, format='JPEG', quality=config['calidad_jpeg'], optimize=True)
+    datos = buffer.getvalue()
+    return len(datos), lambda pagina_nueva: pagina_nueva.insert_image(pagina_nueva.rect, stream=datos)
+
+def insertar_pagina_objetivo(doc_nuevo, pagina_original, num_pagina: int, insertar):
+    """
+    Crea la página num_pagina de doc_nuevo con las medidas de la original y
+    le coloca la imagen con insertar (ver codificar_paso).
+    """
+    pagina_nueva = doc_nuevo.new_page(pno=num_pagina, width=pagina_original.rect.width,
+                                      height=pagina_original.rect.height)
+    insertar(pagina_nueva)
+
+def medir_complejidad(pagina) -> int:
+    """
+    Bytes de un JPEG de muestra a baja resolución: proporcional a lo que
+    costará la página a cualquier resolución.
+    """
+    pix = pagina.get_pixmap(matrix=fitz.Matrix(DPI_COMPLEJIDAD / 72, DPI_COMPLEJIDAD / 72), alpha=False)
+    return max(len(pix.tobytes("jpeg", jpg_quality=50)), 1)
+
+def ajustar_curva_objetivo(complejidad: dict, clases: dict, peso, muestras: int = 5) -> dict:
+    """
+    Mide unas pocas unidades representativas de cada clase en cada paso
+    (peso(unidad, paso), en bytes) y devuelve, por unidad, la curva de su
+    clase: por paso, la razón entre bytes reales y complejidad de la muestra.
+    """
+    curvas = {}
+    for clase in set(clases.values()):
+        unidades = {u: c for u, c in complejidad.items() if clases[u] == clase}
+        # Muestra estratificada: unidades repartidas entre las menos y más complejas
+        ordenadas = sorted(unidades, key=unidades.get)
+        k = min(muestras, len(ordenadas))
+        seleccion = sorted({ordenadas[round(i * (len(ordenadas) - 1) / max(k - 1, 1))] for i in range(k)})
+        
+        curva = []
+        for paso in range(len(ESCALA_OBJETIVO)):
+            bytes_reales = sum(peso(u, paso) for u in seleccion)
+            curva.append(bytes_reales / sum(unidades[u] for u in seleccion))
+        curvas[clase] = curva
+    return {u: curvas[clases[u]] for u in complejidad}
+
+def repartir_presupuesto(complejidad: dict, ratios: dict, presupuesto: float) -> dict:
+    """
+    Reparte el presupuesto entre las unidades en proporción a lo que pesan
+    en el mejor paso (todas bajan en la misma medida) y usa el sobrante
+    para subir de paso a las unidades en las que mejorar cuesta menos.
+    ratios: curva de cada unidad (ver ajustar_curva_objetivo).
+    """
+    ultimo = len(ESCALA_OBJETIVO) - 1
+    total_superior = sum(c * ratios[u][0] for u, c in complejidad.items()) or 1
+    pasos = {}
+    
+    for unidad, c in complejidad.items():
+        presupuesto_unidad = presupuesto * c * ratios[unidad][0] / total_superior
+        pasos[unidad] = next(
+            (paso for paso in range(len(ratios[unidad])) if c * ratios[unidad][paso] <= presupuesto_unidad),
+            ultimo
         )
+    
+    sobrante = presupuesto - sum(complejidad[u] * ratios[u][pasos[u]] for u in pasos)
+    while sobrante > 0:
+        candidatas = [
+            (complejidad[u] * (ratios[u][pasos[u] - 1] - ratios[u][pasos[u]]), u)
+            for u in pasos if pasos[u] > 0
+        ]
+        if not candidatas:
+            break
+        costo, unidad = min(candidatas)
+        if costo > sobrante:
+            break
+        pasos[unidad] -= 1
+        sobrante -= costo
+    
+    return pasos
+
+def estimar_pdf(ruta: str, niveles=None, muestras: int = MUESTRAS_ESTIMACION) -> dict:
+    """
+    Estima tamaño de salida y tiempo de cada nivel sin comprimir el
+    documento entero. Las páginas se ordenan por peso y se dividen en
+    estratos; la página mediana de cada estrato se comprime con la
+    configuración real del nivel y vale por todo su estrato. Lo que las
+    páginas comparten (fuentes, estructura) se mide en la muestra ya
+    comprimida. Las cotas salen de la dispersión entre las páginas de
+    muestra.
+    Devuelve {nivel: {'bytes', 'bytes_min', 'bytes_max', 'ratio',
+    'segundos', 'segundos_min', 'segundos_max'}}, con cotas de ~90%.
+    """
+    niveles = niveles or list(CONFIGURACIONES)
+    tamaño_original = os.path.getsize(ruta)
+    doc = fitz.open(ruta)
+    
+    try:
+        total_paginas = doc.page_count
+        usos = usos_imagenes(doc)
+        seleccion = estratos(pesos_paginas(doc, usos), min(muestras, max(2, math.ceil(total_paginas / PAGINAS_POR_MUESTRA))))
+        paginas = [n for n, _ in seleccion]
+        # Fuentes y perfiles ICC: en el documento y en la muestra sin comprimir
+        recursos = bytes_streams(doc) - bytes_streams(doc, streams_paginas(doc))
+        recursos_muestra = comprimir_muestra(doc, paginas, None, usos)['recursos']
         
-        try:
-            success = procesar_pagina_como_imagen_config(pagina_original, pagina_nueva, config)
+        estimaciones = {}
+        for nivel in niveles:
+            muestra = comprimir_muestra(doc, paginas, CONFIGURACIONES[nivel], usos)
+            tamaños = [tamaño_estrato for _, tamaño_estrato in seleccion]
+            bytes_estimados, margen_bytes = extrapolar(list(zip(tamaños, muestra['bytes'])))
+            segundos, margen_segundos = extrapolar(list(zip(tamaños, muestra['segundos'])))
             
-            if not success:
-                # Fallback más agresivo
-                factor = 0.6 if config['metodo'] == 'agresivo' else 0.4
-                matriz = fitz.Matrix(factor, factor)
-                pix = pagina_original.get_pixmap(matrix=matriz, alpha=False)
-                img_data = pix.tobytes("jpeg", jpg_quality=config['calidad_jpeg'])
-                pagina_nueva.insert_image(pagina_nueva.rect, stream=img_data)
-                pix = None
-                
-        except Exception:
-            try:
-                pagina_nueva.show_pdf_page(pagina_nueva.rect, doc_original, num_pagina)
-            except:
-                pass
+            # Diccionarios y tabla xref: una parte fija y otra por página
+            estructura_sola, estructura = muestra['estructura']
+            por_pagina = (estructura - estructura_sola) / max(len(paginas) - 1, 1)
+            bytes_estimados += estructura_sola + por_pagina * (total_paginas - 1)
+            # Las fuentes se reducen como en la muestra (las páginas
+            # rasterizadas ya no las llevan)
+            if recursos_muestra:
+                bytes_estimados += recursos * muestra['recursos'] / recursos_muestra
+            # La salida nunca supera al original (no_mayor_que_original)
+            cota = lambda v: round(min(max(v, 0), tamaño_original))
+            estimaciones[nivel] = {
+                'bytes': cota(bytes_estimados),
+                'bytes_min': cota(bytes_estimados - margen_bytes),
+                'bytes_max': cota(bytes_estimados + margen_bytes),
+                'ratio': round(cota(bytes_estimados) / tamaño_original, 4) if tamaño_original else None,
+                'segundos': round(segundos, 2),
+                'segundos_min': round(max(segundos - margen_segundos, 0), 2),
+                'segundos_max': round(segundos + margen_segundos, 2)
+            }
+    finally:
+        doc.close()
     
-    doc_nuevo.save(ruta_salida, garbage=4, deflate=True, clean=True)
-    doc_original.close()
-    doc_nuevo.close()
+    return estimaciones
+
+def pesos_paginas(doc, usos: dict = None) -> dict:
+    """
+    Bytes de cada página como bytes_pagina, pero cada imagen cuenta
+    repartida entre las páginas que la usan: la suma no pasa del archivo.
+    """
+    usos = usos if usos is not None else usos_imagenes(doc)
+    return {num_pagina: peso_pagina(doc, num_pagina, usos) for num_pagina in range(doc.page_count)}
+
+def peso_pagina(doc, num_pagina: int, usos: dict) -> float:
+    """
+    Bytes de una página con cada imagen repartida según usos
+    (usos_imagenes).
+    """
+    pagina = doc[num_pagina]
+    total = sum(len(doc.xref_stream_raw(xref) or b"") for xref in pagina.get_contents())
+    for xref in xrefs_imagenes(pagina):
+        total += len(doc.xref_stream_raw(xref) or b"") / usos.get(xref, 1)
+    return total
+
+def usos_imagenes(doc) -> dict:
+    """
+    En cuántas páginas aparece cada imagen (y máscara): {xref: páginas}.
+    """
+    usos = {}
+    for num_pagina in range(doc.page_count):
+        for xref in xrefs_imagenes(doc[num_pagina]):
+            usos[xref] = usos.get(xref, 0) + 1
+    return usos
+
+def estratos(pesos: dict, muestras: int) -> list:
+    """
+    Ordena las páginas por peso y las divide en estratos contiguos de
+    tamaño similar. Devuelve [(página mediana, páginas del estrato)].
+    """
+    ordenadas = sorted(pesos, key=pesos.get)
+    if not ordenadas:
+        return []
+    return [(ordenadas[(inicio + fin - 1) // 2], fin - inicio)
+            for inicio, fin in dividir_paginas(len(ordenadas), muestras)]
+
+def comprimir_muestra(doc, paginas: list, config: dict, usos: dict = None) -> dict:
+    """
+    Comprime juntas las páginas de muestra como lo haría el nivel (con
+    config None solo las copia) y mide el documento guardado:
+    {'bytes': [bytes de cada página], 'segundos': [segundos de cada página],
+     'estructura': (bytes fuera de streams con la primera página sola, con
+     todas), 'recursos': bytes de los streams que no son de las páginas
+     (fuentes, perfiles ICC)}.
+    En las páginas que se conservan, cada imagen cuenta repartida según
+    usos, como en peso_pagina. Los segundos incluyen su parte del guardado.
+    """
+    doc_nuevo = fitz.open()
+    cache = CacheImagenes()
+    segundos, representaciones = [], []
+    try:
+        for num_pagina in paginas:
+            inicio = time.perf_counter()
+            if config is None or config['metodo'] == 'conservador':
+                doc_nuevo.insert_pdf(doc, from_page=num_pagina, to_page=num_pagina, final=False)
+                if config is not None:
+                    recomprimir_imagenes(doc_nuevo, config, cache, paginas=[doc_nuevo.page_count - 1])
+                representacion = 'imagenes'
+            else:
+                representacion = next(iter(procesar_rango(doc, doc_nuevo, config, num_pagina, num_pagina + 1,
+                                                          hilos=0, usos=usos, cache=cache)), 'raster')
+            segundos.append(time.perf_counter() - inicio)
+            representaciones.append(representacion)
+        
+        # Sin deflate ni limpieza la copia es comparable con el original
+        opciones = {}
+        if config is not None:
+            opciones = dict(garbage=2 if config['metodo'] == 'conservador' else 4, deflate=True, clean=True)
+        inicio = time.perf_counter()
+        datos = doc_nuevo.tobytes(**opciones)
+        guardado = (time.perf_counter() - inicio) / max(len(paginas), 1)
+    finally:
+        doc_nuevo.close()
     
+    with fitz.open(stream=datos, filetype="pdf") as muestra:
+        bytes_paginas = []
+        for pagina, num_pagina, representacion in zip(muestra, paginas, representaciones):
+            # Las imágenes de una página conservada se reparten según las
+            # páginas del original que usan la misma imagen
+            equivalentes = {}
+            if representacion in ('vector', 'imagenes'):
+                equivalentes = imagenes_equivalentes(pagina, doc[num_pagina])
+            total = sum(len(muestra.xref_stream_raw(xref) or b"") for xref in pagina.get_contents())
+            for xref in xrefs_imagenes(pagina):
+                total += len(muestra.xref_stream_raw(xref) or b"") / (usos or {}).get(equivalentes.get(xref), 1)
+            bytes_paginas.append(total)
+        recursos = bytes_streams(muestra) - bytes_streams(muestra, streams_paginas(muestra))
+        estructura = len(datos) - bytes_streams(muestra)
+        muestra.select([0])
+        primera = muestra.tobytes(**opciones)
+    with fitz.open(stream=primera, filetype="pdf") as sola:
+        estructura_sola = len(primera) - bytes_streams(sola)
+    return {'bytes': bytes_paginas, 'segundos': [s + guardado for s in segundos],
+            'estructura': (estructura_sola, estructura), 'recursos': recursos}
+
+def streams_paginas(doc) -> set:
+    """
+    xrefs de los streams de contenido y de las imágenes de todas las páginas.
+    """
+    xrefs = set()
+    for pagina in doc:
+        xrefs.update(pagina.get_contents())
+        xrefs.update(xrefs_imagenes(pagina))
+    return xrefs
+
+def bytes_streams(doc, xrefs=None) -> int:
+    """
+    Bytes sin decodificar de los streams indicados (por defecto, de todos).
+    """
+    if xrefs is None:
+        xrefs = [xref for xref in range(1, doc.xref_length()) if doc.xref_is_stream(xref)]
+    return sum(len(doc.xref_stream_raw(xref) or b"") for xref in xrefs)
+
+def imagenes_equivalentes(pagina, pagina_original) -> dict:
+    """
+    {xref en pagina: xref de la misma imagen en pagina_original} para una
+    página copiada del original, emparejando las imágenes (y sus máscaras)
+    por orden de dibujo.
+    """
+    mascaras = lambda p: {img_info[0]: img_info[1] for img_info in p.get_images(full=True)}
+    mascaras_nuevas, mascaras_originales = mascaras(pagina), mascaras(pagina_original)
+    equivalentes = {}
+    for nueva, original in zip(pagina.get_image_info(xrefs=True), pagina_original.get_image_info(xrefs=True)):
+        equivalentes[nueva["xref"]] = original["xref"]
+        if mascaras_nuevas.get(nueva["xref"]) and mascaras_originales.get(original["xref"]):
+            equivalentes[mascaras_nuevas[nueva["xref"]]] = mascaras_originales[original["xref"]]
+    return equivalentes
+
+def extrapolar(medidas: list) -> tuple:
+    """
+    Total estratificado a partir de [(páginas del estrato, valor de su
+    muestra)] y margen de confianza. Con una muestra por estrato se usa la
+    varianza de todas las muestras (cota conservadora), con corrección por
+    población finita: los estratos de una página no aportan error.
+    """
+    total = sum(tamaño * valor for tamaño, valor in medidas)
+    if len(medidas) < 2:
+        return total, 0.0
+    valores = [valor for _, valor in medidas]
+    media = sum(valores) / len(valores)
+    varianza = sum((v - media) ** 2 for v in valores) / (len(valores) - 1)
+    margen = Z_ESTIMACION * math.sqrt(sum(tamaño * (tamaño - 1) for tamaño, _ in medidas) * varianza)
+    return total, margen
+
+def unir_parciales_en_disco(rutas_parciales: list, ruta_salida: str, garbage: int) -> str:
+    """
+    Une los documentos parciales sin tener el resultado completo en memoria:
+    cada parcial se agrega al acumulado con guardado incremental y el
+    guardado final copia los streams desde el disco.
+    """
+    ruta_acumulada = rutas_parciales[0]
+    for ruta_parcial in rutas_parciales[1:]:
+        with fitz.open(ruta_acumulada) as acumulado, fitz.open(ruta_parcial) as parcial:
+            acumulado.insert_pdf(parcial)
+            acumulado.saveIncr()
+        fitz.TOOLS.store_shrink(100)
+    
+    with fitz.open(ruta_acumulada) as acumulado:
+        acumulado.save(ruta_salida, garbage=garbage, deflate=True, clean=True)
     return ruta_salida
 
-def procesar_pagina_hibrida(pagina_original, pagina_nueva, doc_original, dpi, calidad):
+def notificar_pagina(progreso, paginas_hechas: int, total_paginas: int, bytes_nuevos: int):
+    """
+    Envía un evento de avance a la función progreso, si hay una:
+    {'evento': 'pagina', 'pagina': páginas terminadas, 'total': total,
+     'bytes_nuevos': bytes que agregaron las páginas terminadas}
+    """
+    if progreso:
+        progreso({
+            'evento': 'pagina',
+            'pagina': paginas_hechas,
+            'total': total_paginas,
+            'bytes_nuevos': bytes_nuevos
+        })
+
+def bytes_pagina(doc, num_pagina: int) -> int:
     """
-    Intenta preservar texto mientras comprime imágenes agresivamente.
+    Bytes aproximados de una página: contenido más imágenes que usa.
+    """
+    pagina = doc[num_pagina]
+    total = sum(len(doc.xref_stream_raw(xref) or b"") for xref in pagina.get_contents())
+    for xref in xrefs_imagenes(pagina):
+        total += len(doc.xref_stream_raw(xref) or b"")
+    return total
+
+def xrefs_imagenes(pagina) -> set:
     """
+    xrefs de las imágenes de la página, incluidas sus máscaras (/SMask y
+    /Mask explícita, como la de las capas MRC).
+    """
+    doc = pagina.parent
+    xrefs = set()
+    for img_info in pagina.get_images(full=True):
+        if img_info[0] > 0:
+            xrefs.add(img_info[0])
+            if img_info[1] > 0:
+                xrefs.add(img_info[1])
+            tipo, valor = doc.xref_get_key(img_info[0], "Mask")
+            if tipo == "xref":
+                xrefs.add(int(valor.split()[0]))
+    return xrefs
+
+def procesar_rango(doc_original, doc_nuevo, config: dict, inicio: int, fin: int, progreso=None,
+                   hilos: int = None, usos: dict = None, cache=None):
+    """
+    Procesa las páginas [inicio, fin) del original y las agrega a doc_nuevo.
+    Las páginas raster se hacen en tubería: el hilo principal renderiza la
+    página siguiente mientras hilos de codificación (PIL) terminan las
+    anteriores. MuPDF solo se usa desde el hilo principal y a lo sumo
+    hilos + 1 renders esperan a la vez. Con hilos=0 todo corre en serie.
+    Lanza CompresionNoRentable si, pasadas PAGINAS_PROYECCION páginas, las
+    páginas nuevas pesan en promedio más que las del original. En la
+    proyección las páginas copiadas cuentan solo su parte de las imágenes
+    que comparten con otras (peso_pagina), que se guardan una vez.
+    usos: usos_imagenes(doc_original), si ya se calculó.
+    cache: CacheImagenes de doc_nuevo, para compartirla entre llamadas.
+    Devuelve cuántas páginas fueron en cada representación.
+    """
+    if hilos is None:
+        hilos = HILOS_CODIFICACION if (os.cpu_count() or 1) > 1 else 0
+    cada = 5 if config['metodo'] in ('agresivo', 'extremo') else 10
+    cache = cache if cache is not None else CacheImagenes()
+    if usos is None:
+        usos = usos_imagenes(doc_original)
+    representaciones = {}
+    pendientes = deque()
+    bytes_por_pagina_original = tamaño_archivo(doc_original) / max(doc_original.page_count, 1)
+    hechas = [0, 0]  # páginas terminadas y sus bytes
+    
+    def terminar(trabajo):
+        representacion = completar_pagina(doc_original, doc_nuevo, trabajo, config)
+        representaciones[representacion] = representaciones.get(representacion, 0) + 1
+        bytes_nuevos = bytes_pagina(doc_nuevo, trabajo.indice)
+        if progreso:
+            notificar_pagina(progreso, trabajo.num_pagina + 1, doc_original.page_count, bytes_nuevos)
+        if representacion in ('vector', 'imagenes'):
+            # Las copias comparten las imágenes como en el original
+            bytes_nuevos *= (peso_pagina(doc_original, trabajo.num_pagina, usos)
+                             / max(bytes_pagina(doc_original, trabajo.num_pagina), 1))
+        hechas[0] += 1
+        hechas[1] += bytes_nuevos
+        if (hechas[0] >= PAGINAS_PROYECCION and bytes_por_pagina_original
+                and hechas[1] / hechas[0] > bytes_por_pagina_original):
+            raise CompresionNoRentable(
+                f"proyección de {round(hechas[1] / hechas[0] * doc_original.page_count)} bytes "
+                f"tras {hechas[0]} páginas, el original pesa {round(bytes_por_pagina_original * doc_original.page_count)}")
+    
+    executor = ThreadPoolExecutor(max_workers=hilos) if hilos > 0 else None
     try:
-        # Extraer y comprimir imágenes
-        imagenes = pagina_original.get_images(full=True)
-        imagenes_procesadas = 0
-        
-        for img_info in imagenes:
+        for num_pagina in range(inicio, fin):
+            if num_pagina % cada == 0:
+                print(f"Procesando página {num_pagina + 1}/{doc_original.page_count}")
+            trabajo = preparar_pagina(doc_original, doc_nuevo, num_pagina, config, cache, usos)
+            if trabajo.codificar and executor:
+                trabajo.futuro = executor.submit(trabajo.codificar)
+            pendientes.append(trabajo)
+            while len(pendientes) > hilos:
+                terminar(pendientes.popleft())
+        while pendientes:
+            terminar(pendientes.popleft())
+    finally:
+        if executor:
+            executor.shutdown(wait=True)
+    
+    if config.get('selector_paginas'):
+        print(f"Representación por página: {representaciones}")
+    return representaciones
+
+def tamaño_archivo(doc) -> int:
+    """
+    Bytes en disco del documento abierto, o 0 si no viene de un archivo.
+    """
+    try:
+        return os.path.getsize(doc.name) if doc.name else 0
+    except OSError:
+        return 0
+
+class TrabajoPagina:
+    """
+    Página en curso dentro de procesar_rango. Ya ocupa su lugar en
+    doc_nuevo (indice); si es raster, codificar no usa MuPDF y devuelve
+    (representación, función que inserta el resultado en la página nueva)
+    o None si falló.
+    """
+    
+    def __init__(self, num_pagina: int, indice: int, representacion: str):
+        self.num_pagina = num_pagina
+        self.indice = indice
+        self.representacion = representacion
+        self.codificar = None
+        self.futuro = None
+        self.gris = False
+        self.factor = 0.6
+
+def preparar_pagina(doc_original, doc_nuevo, num_pagina: int, config: dict, cache=None,
+                    usos: dict = None) -> TrabajoPagina:
+    """
+    Parte de procesar una página que usa MuPDF (hilo principal): elige la
+    representación, copia las páginas vector/imagenes y, para las raster,
+    crea la página nueva y renderiza lo que hay que codificar.
+    """
+    pagina_original = doc_original[num_pagina]
+    representacion = 'raster'
+    perfil = {}
+    
+    if config.get('selector_paginas'):
+        perfil = perfilar_pagina(pagina_original, usos)
+        representacion = elegir_representacion(perfil, pagina_original, config)
+        if representacion in ('vector', 'imagenes'):
             try:
-                xref = img_info[0]
-                if xref == 0:  # Saltar referencias inválidas
-                    continue
-                    
-                # Extraer imagen
-                img_dict = doc_original.extract_image(xref)
-                img_data = img_dict["image"]
-                img_ext = img_dict["ext"]
-                
-                # Comprimir imagen con PIL
-                img_comprimida = comprimir_imagen_pil(img_data, calidad)
-                
-                if img_comprimida:
-                    # Obtener posición de la imagen en la página
-                    try:
-                        img_rects = pagina_original.get_image_rects(img_info)
-                        if img_rects:
-                            rect = img_rects[0]  # Usar el primer rectángulo
-                            pagina_nueva.insert_image(rect, stream=img_comprimida)
-                            imagenes_procesadas += 1
-                    except:
-                        # Si no se puede obtener la posición, saltar
-                        continue
-                        
+                # final=False conserva el mapa de objetos ya copiados del
+                # original: las fuentes e imágenes que comparten las páginas
+                # se copian una sola vez
+                doc_nuevo.insert_pdf(doc_original, from_page=num_pagina, to_page=num_pagina, final=False)
+                if representacion == 'imagenes':
+                    recomprimir_imagenes(doc_nuevo, config, cache, paginas=[doc_nuevo.page_count - 1])
+                return TrabajoPagina(num_pagina, doc_nuevo.page_count - 1, representacion)
             except Exception as e:
-                continue
-        
-        # Copiar texto y elementos vectoriales
-        texto_dict = pagina_original.get_text("dict")
-        for bloque in texto_dict.get("blocks", []):
-            if "lines" in bloque:  # Es un bloque de texto
-                for linea in bloque["lines"]:
-                    for span in linea["spans"]:
-                        texto = span["text"]
-                        if texto.strip():
-                            punto = fitz.Point(span["bbox"][0], span["bbox"][1])
-                            pagina_nueva.insert_text(punto, texto, 
-                                                   fontsize=span["size"],
-                                                   color=span.get("color", 0))
-        
-        return imagenes_procesadas > 0
-        
+                print(f"Error copiando página {num_pagina}: {e}")
+                representacion = 'raster'
+    
+    doc_nuevo.new_page(
+        width=pagina_original.rect.width,
+        height=pagina_original.rect.height
+    )
+    trabajo = TrabajoPagina(num_pagina, doc_nuevo.page_count - 1, representacion)
+    metodo = config['metodo']
+    
+    try:
+        if representacion == 'bilevel':
+            trabajo.codificar = preparar_bilevel(pagina_original, config)
+        else:
+            # Sin color: render y JPEG de un solo canal. Si no hay sonda se
+            # decide sobre el render final (gris=None)
+            sonda = perfil.get('sonda')
+            trabajo.gris = es_gris(sonda) if sonda is not None else None
+            trabajo.factor = {'hibrido': 0.8, 'agresivo': 0.6}.get(metodo, 0.4)
+            # Escaneos con texto: capas separadas si se encuentra texto
+            if config.get('mrc') and perfil.get('cobertura_imagenes', 0) >= COBERTURA_ESCANEO:
+                trabajo.codificar = preparar_mrc(pagina_original, config, trabajo.gris)
+            elif config.get('rapido'):
+                trabajo.codificar = preparar_jpeg_directo(pagina_original, config, trabajo.gris)
+            else:
+                trabajo.codificar = preparar_jpeg(pagina_original, config, trabajo.gris)
     except Exception as e:
-        return False
+        print(f"Error renderizando página {num_pagina}: {e}")
+    
+    return trabajo
 
-def procesar_pagina_conservadora(pagina_original, pagina_nueva, doc_original, config):
+def completar_pagina(doc_original, doc_nuevo, trabajo: TrabajoPagina, config: dict) -> str:
     """
-    Procesamiento conservador: intenta preservar texto y comprimir solo imágenes.
+    Parte final de una página (hilo principal, en orden): espera la
+    codificación e inserta el resultado, con sus respectivos fallbacks.
+    Devuelve la representación usada: 'vector', 'imagenes', 'bilevel', 'mrc' o 'raster'.
     """
+    if trabajo.representacion in ('vector', 'imagenes'):
+        return trabajo.representacion
+    
+    num_pagina = trabajo.num_pagina
+    pagina_original = doc_original[num_pagina]
+    pagina_nueva = doc_nuevo[trabajo.indice]
+    
     try:
-        # Copiar todo el contenido de la página primero
-        pagina_nueva.show_pdf_page(pagina_nueva.rect, doc_original, pagina_original.number)
+        resultado = None
+        if trabajo.futuro:
+            resultado = trabajo.futuro.result()
+        elif trabajo.codificar:
+            resultado = trabajo.codificar()
+    except Exception:
+        resultado = None
+    
+    try:
+        if resultado:
+            trabajo.representacion, insertar = resultado
+            insertar(pagina_nueva)
+        else:
+            factor = trabajo.factor
+            matriz = fitz.Matrix(factor, factor)
+            pix = pagina_original.get_pixmap(matrix=matriz, colorspace=fitz.csGRAY if trabajo.gris else fitz.csRGB, alpha=False)
+            img_data = pix.tobytes("jpeg", jpg_quality=config['calidad_jpeg'])
+            pagina_nueva.insert_image(pagina_nueva.rect, stream=img_data)
+            pix = None
+            
+    except Exception as e:
+        print(f"Error en página {num_pagina}: {e}")
+        # Último recurso: copiar página original
+        try:
+            pagina_nueva.show_pdf_page(pagina_nueva.rect, doc_original, num_pagina)
+        except Exception as e2:
+            print(f"Fallback falló en página {num_pagina}: {e2}")
+    
+    return trabajo.representacion
+
+def perfilar_pagina(pagina, usos: dict = None) -> dict:
+    """
+    Perfil rápido de la página para decidir cómo representarla:
+    texto, superficie cubierta por imágenes, operadores de trazado y
+    bytes del contenido. Con usos (usos_imagenes), cada imagen cuenta
+    repartida entre las páginas que la usan: un logo compartido se guarda
+    una sola vez y no debe empujar a rasterizar cada página.
+    """
+    area_pagina = abs(pagina.rect) or 1
+    contenido = pagina.read_contents()
+    
+    area_imagenes = 0
+    for info in pagina.get_image_info():
+        area_imagenes += abs(fitz.Rect(info["bbox"]) & pagina.rect)
+    
+    usos = usos or {}
+    bytes_imagenes = bytes_imagenes_enteras = 0
+    for img_info in pagina.get_images(full=True):
+        xref = img_info[0]
+        if xref > 0:
+            bytes_xref = len(pagina.parent.xref_stream_raw(xref) or b"")
+            bytes_imagenes += bytes_xref / usos.get(xref, 1)
+            bytes_imagenes_enteras += bytes_xref
+    
+    return {
+        "caracteres_texto": len(pagina.get_text("text").strip()),
+        "cobertura_imagenes": min(area_imagenes / area_pagina, 1.0),
+        "operadores_trazado": len(OPERADORES_TRAZADO.findall(contenido)),
+        "bytes_contenido": len(contenido),
+        "bytes_imagenes": bytes_imagenes,
+        "bytes_imagenes_enteras": bytes_imagenes_enteras
+    }
+
+def estimar_bytes_raster(pagina, config: dict, bilevel: bool = False) -> float:
+    """
+    Tamaño aproximado del JPEG de la página completa a la calidad del nivel
+    (o de la imagen de 1 bit si la página es bilevel).
+    """
+    if bilevel:
+        matriz = calcular_matriz(pagina, config_bilevel(config))
+        return abs(pagina.rect) * matriz.a * matriz.d * BYTES_PIXEL_BILEVEL
+    matriz = calcular_matriz(pagina, config)
+    pixeles = abs(pagina.rect) * matriz.a * matriz.d
+    # Bytes por pixel observados en páginas de documentos según la calidad JPEG
+    bytes_por_pixel = 0.04 + 0.0025 * max(config['calidad_jpeg'] - 30, 0)
+    return pixeles * bytes_por_pixel
+
+def elegir_representacion(perfil: dict, pagina, config: dict) -> str:
+    """
+    Modelo de costo: estima el tamaño de cada representación y elige la
+    más barata. Conservar el vector o recomprimir solo las imágenes nunca
+    pierde calidad, así que en empate se prefieren.
+    """
+    # Los streams de contenido se comprimen con deflate a ~1/3
+    bytes_vector = perfil["bytes_contenido"] * 0.35 + perfil["bytes_imagenes"]
+    bytes_imagenes = perfil["bytes_contenido"] * 0.35 + perfil["bytes_imagenes"] * 0.3
+    bytes_raster = estimar_bytes_raster(pagina, config)
+    
+    # Rasterizar texto nativo le quita nitidez y búsqueda: debe ganar con margen.
+    # Las páginas escaneadas (casi todo imagen) no tienen esa penalización.
+    if perfil["caracteres_texto"] > 0 and perfil["cobertura_imagenes"] < 0.5:
+        bytes_raster *= 1.5
+    
+    costos = {'vector': bytes_vector, 'raster': bytes_raster}
+    # Si vale la pena recomprimir depende del tamaño de las imágenes, no de
+    # la parte que le toca a la página
+    if perfil["bytes_imagenes_enteras"] >= UMBRAL_BYTES_IMAGEN:
+        costos['imagenes'] = bytes_imagenes
+    # Las páginas escaneadas en blanco y negro pueden ir a 1 bit. La sonda
+    # solo se renderiza si el 1 bit puede ganarle al resto
+    if config.get('bilevel') and perfil["cobertura_imagenes"] >= COBERTURA_ESCANEO:
+        bytes_bilevel = estimar_bytes_raster(pagina, config, bilevel=True)
+        if bytes_bilevel < min(costos.values()):
+            # La sonda queda en el perfil para reutilizarla si la página se rasteriza
+            perfil['sonda'] = sondear_pagina(pagina)
+            if es_bilevel(perfil['sonda']):
+                costos['bilevel'] = bytes_bilevel
+    
+    mejor = min(costos.values())
+    for representacion in ('vector', 'imagenes', 'bilevel', 'raster'):
+        if costos.get(representacion) == mejor:
+            return representacion
+
+class CacheImagenes:
+    """
+    Caché por documento de imágenes ya procesadas.
+    Busca primero por xref y después por hash del contenido, para reutilizar
+    el resultado de imágenes idénticas guardadas con distinto xref.
+    """
+    
+    def __init__(self):
+        self.por_xref = {}
+        self.por_hash = {}
+        self.aciertos = 0
+        self.fallos = 0
+    
+    def obtener(self, doc, xref: int, procesar):
+        """
+        Devuelve el resultado de procesar(doc, xref), calculándolo solo la
+        primera vez que aparece la imagen.
+        """
+        if xref in self.por_xref:
+            self.aciertos += 1
+            return self.por_xref[xref]
+        
+        clave = self.clave_contenido(doc, xref)
+        if clave in self.por_hash:
+            self.aciertos += 1
+            resultado = self.por_hash[clave]
+        else:
+            self.fallos += 1
+            resultado = procesar(doc, xref)
+            self.por_hash[clave] = resultado
         
-        # Luego intentar optimizar imágenes sin destruir la estructura
-        imagenes = pagina_original.get_images(full=True)
+        self.por_xref[xref] = resultado
+        return resultado
+    
+    @staticmethod
+    def clave_contenido(doc, xref: int) -> str:
+        """
+        Hash del stream sin decodificar más las claves que definen la imagen.
+        """
+        h = hashlib.sha1(doc.xref_stream_raw(xref) or b"")
+        for clave in ("Width", "Height", "BitsPerComponent", "ColorSpace", "Filter", "DecodeParms", "Decode"):
+            h.update(doc.xref_get_key(xref, clave)[1].encode())
+        return h.hexdigest()
+    
+    def estadisticas(self) -> dict:
+        return {
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "imagenes_unicas": len(self.por_hash)
+        }
+
+def recomprimir_imagenes(doc, config: dict, cache: CacheImagenes = None, paginas=None, progreso=None) -> int:
+    """
+    Recomprime en el sitio las imágenes del documento (o de las páginas
+    indicadas), una vez por xref. El stream nuevo reemplaza al original en
+    todas las páginas que lo usan.
+    Devuelve la cantidad de imágenes reemplazadas.
+    """
+    cache = cache if cache is not None else CacheImagenes()
+    reemplazadas = 0
+    colocaciones = medidas_colocacion(doc, paginas)
+    
+    for num_pagina in (range(doc.page_count) if paginas is None else paginas):
+        pagina = doc[num_pagina]
+        for img_info in pagina.get_images(full=True):
+            xref, smask = img_info[0], img_info[1]
+            # Las imágenes con transparencia se dejan como están
+            if xref == 0 or smask:
+                continue
+            
+            try:
+                # Si el xref ya pasó por la caché, ya fue reemplazado (o descartado)
+                ya_procesada = xref in cache.por_xref
+                img_comprimida = cache.obtener(
+                    doc, xref, lambda d, x: recomprimir_imagen(d, x, config, colocaciones.get(x)))
+                if img_comprimida and not ya_procesada:
+                    pagina.replace_image(xref, stream=img_comprimida)
+                    reemplazadas += 1
+            except Exception as e:
+                print(f"No se pudo recomprimir la imagen {xref}: {e}")
         
-        for img_info in imagenes:
+        if progreso:
+            notificar_pagina(progreso, num_pagina + 1, doc.page_count, bytes_pagina(doc, num_pagina))
+    
+    return reemplazadas
+
+def medidas_colocacion(doc, paginas=None) -> dict:
+    """
+    Ancho y alto en puntos de la colocación más grande de cada imagen en las
+    páginas indicadas, medidos sobre su matriz (una imagen rotada no se
+    confunde con su caja). {xref: (ancho, alto)}
+    """
+    medidas = {}
+    for num_pagina in (range(doc.page_count) if paginas is None else paginas):
+        pagina = doc[num_pagina]
+        for xref, matriz in colocaciones_imagenes(pagina):
+            ancho, alto = medidas.get(xref, (0, 0))
+            medidas[xref] = (max(ancho, math.hypot(matriz.a, matriz.b)),
+                             max(alto, math.hypot(matriz.c, matriz.d)))
+    return medidas
+
+def colocaciones_imagenes(pagina) -> list:
+    """
+    [(xref, matriz)] de cada vez que la página dibuja una imagen.
+    get_image_rects decodifica la imagen para reconocerla por hash; si el
+    tamaño en pixeles ya la identifica en la página alcanza con
+    get_image_info, y get_image_rects queda para los tamaños repetidos.
+    """
+    por_tamaño = {}
+    for img_info in pagina.get_images(full=True):
+        por_tamaño.setdefault((img_info[2], img_info[3]), set()).add(img_info[0])
+    
+    colocaciones = []
+    for info in pagina.get_image_info():
+        xrefs = por_tamaño.get((info["width"], info["height"]), set())
+        if len(xrefs) == 1:
+            colocaciones.append((next(iter(xrefs)), fitz.Matrix(info["transform"])))
+    for xrefs in por_tamaño.values():
+        if len(xrefs) < 2:
+            continue
+        for xref in xrefs:
             try:
-                xref = img_info[0]
-                if xref == 0:
-                    continue
-                    
-                # Solo comprimir imágenes muy grandes
-                img_dict = doc_original.extract_image(xref)
-                img_data = img_dict["image"]
-                
-                # Si la imagen es grande (>500KB), comprimirla suavemente
-                if len(img_data) > 500000:  # 500KB
-                    pil_img = Image.open(io.BytesIO(img_data))
-                    
-                    if pil_img.mode != 'RGB':
-                        pil_img = pil_img.convert('RGB')
-                    
-                    # Redimensionar solo si es MUY grande
-                    ancho, alto = pil_img.size
-                    if ancho > config['max_dimension'] or alto > config['max_dimension']:
-                        factor = min(config['max_dimension']/ancho, config['max_dimension']/alto)
-                        nuevo_ancho = int(ancho * factor)
-                        nuevo_alto = int(alto * factor)
-                        pil_img = pil_img.resize((nuevo_ancho, nuevo_alto), Image.Resampling.LANCZOS)
-                    
-                    # Comprimir con alta calidad
-                    buffer = io.BytesIO()
-                    pil_img.save(buffer, format='JPEG', quality=config['calidad_jpeg'], optimize=True)
-                    # Nota: No reemplazamos la imagen en el PDF conservador, solo la optimizamos
-                    
+                colocaciones.extend((xref, matriz) for _, matriz in pagina.get_image_rects(xref, transform=True))
             except Exception:
                 continue
-                
-        return True
-        
-    except Exception:
-        return False
+    return colocaciones
 
-def procesar_pagina_equilibrada(pagina_original, pagina_nueva, config):
+def tamaño_reducido(ancho: int, alto: int, colocacion, config: dict):
     """
-    Procesamiento equilibrado: renderiza la página con buena calidad.
+    Tamaño en pixeles al que hay que reducir una imagen, o None si no hace
+    falta. Con colocación conocida se mira su resolución efectiva (ver
+    FACTOR_UMBRAL_PPI); si no, el lado máximo del nivel.
     """
-    try:
-        matriz = fitz.Matrix(config['dpi']/72, config['dpi']/72)
-        pix = pagina_original.get_pixmap(matrix=matriz, alpha=False)
-        
-        # Usar PIL para mejor control de compresión
-        img_data = pix.tobytes("png")
-        pil_img = Image.open(io.BytesIO(img_data))
-        
-        if pil_img.mode != 'RGB':
-            pil_img = pil_img.convert('RGB')
-        
-        # Redimensionar moderadamente si es necesario
-        ancho, alto = pil_img.size
-        if ancho > config['max_dimension'] or alto > config['max_dimension']:
-            factor = min(config['max_dimension']/ancho, config['max_dimension']/alto)
-            nuevo_ancho = int(ancho * factor)
-            nuevo_alto = int(alto * factor)
-            pil_img = pil_img.resize((nuevo_ancho, nuevo_alto), Image.Resampling.LANCZOS)
-        
-        # Comprimir con calidad equilibrada
-        buffer = io.BytesIO()
-        pil_img.save(buffer, format='JPEG', quality=config['calidad_jpeg'], optimize=True)
-        img_comprimida = buffer.getvalue()
-        
-        pagina_nueva.insert_image(pagina_nueva.rect, stream=img_comprimida)
-        
-        pix = None
-        pil_img = None
-        
-        return True
+    factor = None
+    if colocacion and colocacion[0] > 0 and colocacion[1] > 0:
+        # La dirección con menos pixeles por pulgada manda
+        ppi = min(ancho * 72 / colocacion[0], alto * 72 / colocacion[1])
+        if ppi > config['dpi'] * FACTOR_UMBRAL_PPI:
+            factor = config['dpi'] / ppi
+    elif ancho > config['max_dimension'] or alto > config['max_dimension']:
+        factor = min(config['max_dimension'] / ancho, config['max_dimension'] / alto)
+    if factor is None:
+        return None
+    return max(1, int(ancho * factor)), max(1, int(alto * factor))
+
+def recomprimir_imagen(doc, xref: int, config: dict, colocacion=None) -> bytes:
+    """
+    Reduce y recodifica como JPEG la imagen xref. colocacion es el tamaño
+    en puntos con que se dibuja (ver medidas_colocacion).
+    Devuelve None si no conviene reemplazarla.
+    """
+    tamaño_original = len(doc.xref_stream_raw(xref) or b"")
+    if tamaño_original < UMBRAL_BYTES_IMAGEN:
+        return None
+    
+    # Máscaras, imágenes de 1 bit y con color key: JPEG no les sirve
+    if doc.xref_get_key(xref, "ImageMask")[1] == "true":
+        return None
+    if doc.xref_get_key(xref, "BitsPerComponent")[1] == "1":
+        return None
+    if doc.xref_get_key(xref, "Mask")[0] != "null":
+        return None
+    
+    # Pixmap resuelve espacios de color (CMYK, Indexed, ICC) y arrays Decode
+    pix = fitz.Pixmap(doc, xref)
+    if pix.alpha:
+        pix = fitz.Pixmap(pix, 0)
+    if pix.colorspace is None or pix.colorspace.n not in (1, 3):
+        pix = fitz.Pixmap(fitz.csRGB, pix)
+    
+    modo = "L" if pix.n == 1 else "RGB"
+    pil_img = Image.frombuffer(modo, (pix.width, pix.height), pix.samples, "raw", modo, pix.stride, 1)
+    pix = None
+    tamaño = tamaño_reducido(pil_img.width, pil_img.height, colocacion, config)
+    
+    # Escaneos en color de documentos grises: JPEG de un solo canal
+    if pil_img.mode == "RGB" and es_gris(miniatura(pil_img)):
+        pil_img = pil_img.convert("L")
+    
+    rapido = config.get('rapido', False)
+    if tamaño:
+        # reducing_gap: primero una reducción entera rápida y LANCZOS al final
+        # (BILINEAR en modo rapido)
+        filtro = Image.Resampling.BILINEAR if rapido else Image.Resampling.LANCZOS
+        pil_img = pil_img.resize(tamaño, filtro, reducing_gap=3.0)
+    
+    buffer = io.BytesIO()
+    pil_img.save(buffer, format='JPEG', quality=config['calidad_jpeg'], optimize=not rapido)
+    img_comprimida = buffer.getvalue()
+    
+    # Solo vale la pena si ahorra al menos un 10%
+    if len(img_comprimida) > tamaño_original * 0.9:
+        return None
+    return img_comprimida
+
+def preparar_jpeg(pagina_original, config: dict, gris=None):
+    """
+    Render de la página con la configuración del nivel (hilo principal).
+    Devuelve la función que la codifica como JPEG fuera de MuPDF.
+    """
+    pil_img = renderizar_pagina_detectando_gris(pagina_original, config, gris)
+    calidad, progresivo = parametros_jpeg(pagina_original, config)
+    
+    def codificar():
+        img_comprimida = codificar_jpeg(pil_img, calidad, progresivo)
+        return 'raster', lambda pagina: pagina.insert_image(pagina.rect, stream=img_comprimida)
+    return codificar
+
+def preparar_jpeg_directo(pagina_original, config: dict, gris=None):
+    """
+    Modo rapido: JPEG sin pasada de optimización. Con libjpeg-turbo lo
+    codifica PIL en un hilo; si no, MuPDF directo desde el Pixmap en el
+    hilo principal y la función devuelta solo inserta el resultado.
+    """
+    if JPEG_TURBO:
+        pil_img = renderizar_pagina_detectando_gris(pagina_original, config, gris)
         
-    except Exception:
+        def codificar():
+            img_comprimida = codificar_jpeg(pil_img, config['calidad_jpeg'], optimizar=False)
+            return 'raster', lambda pagina: pagina.insert_image(pagina.rect, stream=img_comprimida)
+        return codificar
+    
+    espacio = fitz.csGRAY if gris else fitz.csRGB
+    pix = pagina_original.get_pixmap(matrix=calcular_matriz(pagina_original, config), colorspace=espacio, alpha=False)
+    img_comprimida = pix.tobytes("jpeg", jpg_quality=config['calidad_jpeg'])
+    pix = None
+    return lambda: ('raster', lambda pagina: pagina.insert_image(pagina.rect, stream=img_comprimida))
+
+def parametros_jpeg(pagina, config: dict) -> tuple:
+    """
+    Calidad y modo progresivo del JPEG de la página según el nivel.
+    """
+    # Aplicar compresión adicional en modo extremo (según el tamaño a config['dpi'])
+    calidad = config['calidad_jpeg']
+    ancho = pagina.rect.width * config['dpi'] / 72
+    alto = pagina.rect.height * config['dpi'] / 72
+    if config['metodo'] == 'extremo' and ancho * alto > 300000:
+        calidad = max(calidad - 15, 25)  # Reducir calidad aún más
+    return calidad, config['metodo'] == 'extremo'
+
+def codificar_jpeg(pil_img: Image.Image, calidad: int, progresivo: bool = False, optimizar: bool = True) -> bytes:
+    """
+    JPEG de la página renderizada. Solo usa PIL (no toca MuPDF).
+    """
+    buffer = io.BytesIO()
+    pil_img.save(buffer, 
+                format='JPEG', 
+                quality=calidad, 
+                optimize=optimizar,
+                progressive=progresivo)
+    return buffer.getvalue()
+
+def calcular_matriz(pagina, config: dict) -> fitz.Matrix:
+    """
+    Calcula la matriz de renderizado que da directamente el tamaño final:
+    config['dpi'], limitado para que el lado mayor no pase de max_dimension.
+    """
+    zoom = config['dpi'] / 72
+    lado_mayor = max(pagina.rect.width, pagina.rect.height) * zoom
+    if lado_mayor > config['max_dimension']:
+        zoom *= config['max_dimension'] / lado_mayor
+    return fitz.Matrix(zoom, zoom)
+
+def renderizar_pagina(pagina, config: dict, gris: bool = False) -> Image.Image:
+    """
+    Renderiza la página al tamaño final en una sola pasada (en RGB o, con
+    gris=True, en escala de grises).
+    Envuelve las muestras del Pixmap sin codificar/decodificar PNG.
+    """
+    espacio, modo = (fitz.csGRAY, "L") if gris else (fitz.csRGB, "RGB")
+    pix = pagina.get_pixmap(matrix=calcular_matriz(pagina, config), colorspace=espacio, alpha=False)
+    pil_img = Image.frombuffer(modo, (pix.width, pix.height), pix.samples, "raw", modo, pix.stride, 1)
+    pix = None
+    return pil_img
+
+def renderizar_pagina_detectando_gris(pagina, config: dict, gris=None) -> Image.Image:
+    """
+    Renderiza directo en grises si ya se sabe que la página no tiene color
+    (gris=True). Si no se sabe (None), renderiza en RGB y pasa a un canal
+    cuando el render no tiene color: evita renderizar una sonda aparte.
+    """
+    if gris:
+        return renderizar_pagina(pagina, config, gris=True)
+    pil_img = renderizar_pagina(pagina, config)
+    if gris is None and es_gris(miniatura(pil_img)):
+        pil_img = pil_img.convert("L")
+    return pil_img
+
+def miniatura(img: Image.Image) -> Image.Image:
+    """
+    Copia reducida (lado menor ~256 px) para clasificar sin recorrer la
+    imagen completa.
+    """
+    return img.reduce(max(1, min(img.size) // 256))
+
+def sondear_pagina(pagina) -> Image.Image:
+    """
+    Render RGB de baja resolución para clasificar la página.
+    """
+    return renderizar_pagina(pagina, {'dpi': DPI_SONDA, 'max_dimension': MAX_DIMENSION_SONDA})
+
+def es_bilevel(img: Image.Image) -> bool:
+    """
+    True si la imagen es texto o líneas en blanco y negro: sin color, con el
+    papel como fondo dominante y sin zonas de gris suave (fotos, degradados).
+    Los grises en los bordes del texto (antialiasing, escaneo) se toleran
+    porque tienen mucho contraste local.
+    """
+    total = img.width * img.height
+    if fraccion_color(img, UMBRAL_CROMA) > FRACCION_COLOR_BILEVEL:
         return False
+    
+    gris = img.convert('L')
+    histograma = gris.histogram()
+    papel = max(range(128, 256), key=histograma.__getitem__)
+    if sum(histograma[papel - MARGEN_PAPEL:]) < total * FRACCION_FONDO_BILEVEL:
+        return False
+    
+    # Contraste en 5x5: dos pasadas de 3x3
+    maximo = extremo_local(extremo_local(gris, ImageChops.lighter), ImageChops.lighter)
+    minimo = extremo_local(extremo_local(gris, ImageChops.darker), ImageChops.darker)
+    suave = ImageChops.subtract(maximo, minimo).point(lambda v: 255 if v < CONTRASTE_SUAVE else 0)
+    medio = gris.point(lambda v: 255 if 64 <= v < papel - MARGEN_PAPEL else 0)
+    gris_suave = ImageChops.multiply(suave, medio).histogram()[255]
+    return gris_suave < total * FRACCION_GRIS_SUAVE_BILEVEL
+
+def es_gris(img: Image.Image) -> bool:
+    """
+    True si la imagen RGB no tiene color (salvo el ruido de un escáner).
+    """
+    return fraccion_color(img, UMBRAL_CROMA_GRIS) <= FRACCION_COLOR_GRIS
+
+def fraccion_color(img: Image.Image, umbral_croma: int) -> float:
+    """
+    Fracción de pixeles de una imagen RGB cuya croma (máxima diferencia
+    entre canales) llega a umbral_croma. Se calcula en C con ImageChops,
+    sin recorrer pixeles en Python.
+    """
+    r, g, b = img.split()
+    croma = ImageChops.lighter(ImageChops.difference(r, g),
+                               ImageChops.lighter(ImageChops.difference(g, b), ImageChops.difference(r, b)))
+    return sum(croma.histogram()[umbral_croma:]) / (img.width * img.height)
+
+def extremo_local(img: Image.Image, operacion) -> Image.Image:
+    """
+    Máximo (ImageChops.lighter) o mínimo (ImageChops.darker) de cada pixel
+    en su vecindad de 3x3, por filas y luego por columnas. Los vecinos se
+    obtienen con crop desplazado (mucho más rápido que ImageChops.offset);
+    fuera del borde valen 0.
+    """
+    ancho, alto = img.size
+    filas = operacion(operacion(img, img.crop((1, 0, ancho + 1, alto))), img.crop((-1, 0, ancho - 1, alto)))
+    return operacion(operacion(filas, filas.crop((0, 1, ancho, alto + 1))), filas.crop((0, -1, ancho, alto - 1)))
+
+def umbral_otsu(histograma: list) -> int:
+    """
+    Umbral que maximiza la varianza entre clases (método de Otsu).
+    """
+    total = sum(histograma)
+    suma_total = sum(i * h for i, h in enumerate(histograma))
+    suma_fondo = peso_fondo = 0
+    mejor_varianza, umbral = -1, 127
+    for i, h in enumerate(histograma):
+        peso_fondo += h
+        peso_frente = total - peso_fondo
+        if peso_fondo == 0:
+            continue
+        if peso_frente == 0:
+            break
+        suma_fondo += i * h
+        diferencia = suma_fondo / peso_fondo - (suma_total - suma_fondo) / peso_frente
+        varianza = peso_fondo * peso_frente * diferencia * diferencia
+        if varianza > mejor_varianza:
+            mejor_varianza, umbral = varianza, i
+    return umbral
+
+def config_bilevel(config: dict) -> dict:
+    """
+    Configuración de render para páginas bilevel: el 1 bit necesita más
+    resolución que el JPEG para que el texto se lea bien.
+    """
+    return dict(config, dpi=config['dpi_bilevel'], max_dimension=MAX_DIMENSION_BILEVEL)
 
-def procesar_pagina_como_imagen_config(pagina_original, pagina_nueva, config):
+def preparar_bilevel(pagina_original, config: dict):
     """
-    Procesamiento con configuración específica (agresivo o extremo).
+    Página de texto en blanco y negro: render en grises (hilo principal).
+    Devuelve la función que aplica el umbral de Otsu y codifica la imagen
+    de 1 bit.
+    """
+    gris = renderizar_pagina(pagina_original, config_bilevel(config), gris=True)
+    jbig2 = config.get('jbig2', False)
+    
+    def codificar():
+        bits = binarizar(gris)
+        codificada = codificar_1bit(bits, jbig2)
+        return 'bilevel', lambda pagina: insertar_imagen_bilevel(pagina, bits, codificada)
+    return codificar
+
+def binarizar(gris: Image.Image) -> Image.Image:
+    """
+    Imagen de modo '1' a partir de un render en grises, con el umbral de Otsu.
+    """
+    umbral = umbral_otsu(gris.histogram())
+    return gris.point(lambda v: 255 if v > umbral else 0, '1')
+
+def insertar_imagen_bilevel(pagina, bits: Image.Image, codificada=None) -> int:
+    """
+    Inserta una imagen de modo '1' ocupando toda la página. Devuelve el
+    xref de la imagen.
+    """
+    xref = crear_imagen_1bit(pagina.parent, bits, codificada=codificada)
+    pagina.insert_image(pagina.rect, xref=xref)
+    return xref
+
+def crear_imagen_1bit(doc, bits: Image.Image, mascara: bool = False, codificada=None) -> int:
+    """
+    Crea un XObject de 1 bit a partir de una imagen de modo '1', codificado
+    con CCITT G4 o Flate (el que pese menos). Con mascara=True es una
+    máscara /ImageMask: se pinta donde la imagen es negra. codificada es el
+    resultado de codificar_1bit si ya se calculó.
+    """
+    ancho, alto = bits.size
+    filtro, parametros, datos = codificada or codificar_1bit(bits)
+    
+    color = "/ImageMask true" if mascara else "/ColorSpace/DeviceGray"
+    xref = doc.get_new_xref()
+    doc.update_object(xref, f"<</Type/XObject/Subtype/Image/Width {ancho}/Height {alto}"
+                            f"{color}/BitsPerComponent 1>>")
+    # update_stream sin comprimir descarta /Filter: se fija después
+    doc.update_stream(xref, datos, compress=False)
+    doc.xref_set_key(xref, "Filter", filtro)
+    if parametros:
+        doc.xref_set_key(xref, "DecodeParms", parametros)
+    return xref
+
+def codificar_1bit(bits: Image.Image, jbig2: bool = False) -> tuple:
+    """
+    Codifica una imagen de modo '1' con Flate, G4 y, con jbig2=True, JBIG2
+    (diccionario de símbolos, mucho más lento) y devuelve la más chica como
+    (filtro, DecodeParms o None, datos).
+    """
+    ancho, alto = bits.size
+    candidatos = [('/FlateDecode', None, zlib.compress(bits.tobytes()))]
+    g4 = codificar_g4(bits)
+    if g4:
+        datos, negro_es_1 = g4
+        parametros = f"<</K -1/Columns {ancho}/Rows {alto}/BlackIs1 {'true' if negro_es_1 else 'false'}>>"
+        candidatos.append(('/CCITTFaxDecode', parametros, datos))
+    if jbig2:
+        # En JBIG2 la tinta es 1; en bits el negro es 0
+        datos = jbig2_model.codificar_jbig2(ImageChops.invert(bits))
+        if datos:
+            candidatos.append(('/JBIG2Decode', None, datos))
+    return min(candidatos, key=lambda c: len(c[2]))
+
+def preparar_mrc(pagina_original, config: dict, gris=None):
+    """
+    Mixed raster content: separa la página en tres capas.
+    - máscara de texto de 1 bit a dpi_bilevel (G4, Flate o JBIG2),
+    - fondo JPEG a dpi_fondo, limpiado bajo el texto,
+    - color del texto en un JPEG chico, pintado solo donde marca la máscara.
+    En el hilo principal se renderizan la página a dpi_bilevel y el render
+    normal. La función devuelta usa el JPEG normal si la página no tiene
+    texto separable (fotos, páginas vacías) o si las capas pesan más de
+    MARGEN_MRC veces ese JPEG.
     """
     try:
-        matriz = fitz.Matrix(config['dpi']/72, config['dpi']/72)
-        pix = pagina_original.get_pixmap(matrix=matriz, alpha=False)
-        
-        img_data = pix.tobytes("png")
-        pil_img = Image.open(io.BytesIO(img_data))
-        
-        if pil_img.mode != 'RGB':
-            pil_img = pil_img.convert('RGB')
-        
-        # Redimensionar según configuración
-        ancho, alto = pil_img.size
-        if ancho > config['max_dimension'] or alto > config['max_dimension']:
-            factor = min(config['max_dimension']/ancho, config['max_dimension']/alto)
-            nuevo_ancho = int(ancho * factor)
-            nuevo_alto = int(alto * factor)
-            pil_img = pil_img.resize((nuevo_ancho, nuevo_alto), Image.Resampling.LANCZOS)
-        
-        # Aplicar compresión adicional en modo extremo
-        calidad = config['calidad_jpeg']
-        if config['metodo'] == 'extremo' and ancho * alto > 300000:
-            calidad = max(calidad - 15, 25)  # Reducir calidad aún más
-        
-        buffer = io.BytesIO()
-        pil_img.save(buffer, 
-                    format='JPEG', 
-                    quality=calidad, 
-                    optimize=True,
-                    progressive=True if config['metodo'] == 'extremo' else False)
-        
-        img_comprimida = buffer.getvalue()
-        pagina_nueva.insert_image(pagina_nueva.rect, stream=img_comprimida)
-        
-        pix = None
-        pil_img = None
-        
-        return True
-        
+        rgb = renderizar_pagina(pagina_original, config_bilevel(config))
     except Exception:
-        return False
+        return preparar_jpeg(pagina_original, config, gris)
+    # El JPEG de referencia sale del render normal, no de reducir este:
+    # reducido pesa más que el que produce MuPDF al tamaño final
+    normal = renderizar_pagina_detectando_gris(pagina_original, config, gris)
+    calidad, progresivo = parametros_jpeg(pagina_original, config)
+    jbig2 = config.get('jbig2', False)
+    
+    def codificar():
+        img_normal = codificar_jpeg(normal, calidad, progresivo)
+        resultado_normal = ('raster', lambda pagina: pagina.insert_image(pagina.rect, stream=img_normal))
+        try:
+            capas = capas_mrc(rgb, config, jbig2)
+        except Exception:
+            return resultado_normal
+        if capas is None or capas['peso'] > len(img_normal) * MARGEN_MRC:
+            return resultado_normal
+        return 'mrc', lambda pagina: insertar_capas_mrc(pagina, capas)
+    return codificar
 
-def comprimir_imagen_pil(img_data: bytes, calidad: int = 60) -> bytes:
+def capas_mrc(rgb: Image.Image, config: dict, jbig2: bool = False):
     """
-    Comprime una imagen usando PIL con configuración agresiva.
+    Separa y codifica las capas MRC de la página renderizada (solo PIL).
+    Devuelve None si la fracción de tinta queda fuera de FRACCION_TEXTO_MRC.
     """
-    try:
-        # Abrir imagen con PIL
-        pil_img = Image.open(io.BytesIO(img_data))
-        
-        # Convertir a RGB si es necesario
-        if pil_img.mode in ('RGBA', 'LA', 'P'):
-            rgb_img = Image.new('RGB', pil_img.size, (255, 255, 255))
-            if pil_img.mode == 'P':
-                pil_img = pil_img.convert('RGBA')
-            rgb_img.paste(pil_img, mask=pil_img.split()[-1] if pil_img.mode in ('RGBA', 'LA') else None)
-            pil_img = rgb_img
-        
-        # Reducir resolución si es muy grande
-        ancho, alto = pil_img.size
-        if ancho > 1000 or alto > 1000:
-            factor = min(1000/ancho, 1000/alto)
-            nuevo_ancho = int(ancho * factor)
-            nuevo_alto = int(alto * factor)
-            pil_img = pil_img.resize((nuevo_ancho, nuevo_alto), Image.Resampling.LANCZOS)
-        
-        # Comprimir como JPEG
-        buffer = io.BytesIO()
-        pil_img.save(buffer, format='JPEG', quality=calidad, optimize=True)
-        
-        return buffer.getvalue()
-        
-    except Exception as e:
+    mascara = mascara_texto(rgb.convert("L"))
+    fraccion = mascara.histogram()[255] / (rgb.width * rgb.height)
+    if not FRACCION_TEXTO_MRC[0] <= fraccion <= FRACCION_TEXTO_MRC[1]:
+        return None
+    
+    escala = config['dpi_fondo'] / config['dpi_bilevel']
+    fondo = fondo_mrc(rgb, mascara, escala)
+    frente = frente_mrc(rgb, mascara)
+    if es_gris(miniatura(fondo)) and es_gris(frente):
+        fondo, frente = fondo.convert("L"), frente.convert("L")
+    
+    datos_fondo, datos_frente = io.BytesIO(), io.BytesIO()
+    fondo.save(datos_fondo, format='JPEG', quality=config['calidad_jpeg'], optimize=True)
+    frente.save(datos_frente, format='JPEG', quality=config['calidad_jpeg'], optimize=True)
+    # En la máscara el texto es negro (0): es lo que se pinta
+    bits = mascara.point(lambda v: 0 if v else 255, '1')
+    codificada = codificar_1bit(bits, jbig2)
+    
+    return {
+        'fondo': datos_fondo.getvalue(),
+        'frente': datos_frente.getvalue(),
+        'tamaño_frente': frente.size,
+        'espacio_frente': "DeviceGray" if frente.mode == "L" else "DeviceRGB",
+        'bits': bits,
+        'mascara': codificada,
+        'peso': len(datos_fondo.getvalue()) + len(datos_frente.getvalue()) + len(codificada[2])
+    }
+
+def insertar_capas_mrc(pagina, capas: dict):
+    """
+    Inserta en la página las capas que devolvió capas_mrc: el fondo y,
+    encima, el color del texto recortado por la máscara.
+    """
+    doc = pagina.parent
+    xref_mascara = crear_imagen_1bit(doc, capas['bits'], mascara=True, codificada=capas['mascara'])
+    # El frente se crea a mano: insert_image reutiliza imágenes con los
+    # mismos bytes y cada página necesita su propia /Mask
+    ancho, alto = capas['tamaño_frente']
+    xref_frente = doc.get_new_xref()
+    doc.update_object(xref_frente, f"<</Type/XObject/Subtype/Image/Width {ancho}/Height {alto}"
+                                   f"/ColorSpace/{capas['espacio_frente']}/BitsPerComponent 8/Mask {xref_mascara} 0 R>>")
+    doc.update_stream(xref_frente, capas['frente'], compress=False)
+    doc.xref_set_key(xref_frente, "Filter", "/DCTDecode")
+    
+    pagina.insert_image(pagina.rect, stream=capas['fondo'])
+    pagina.insert_image(pagina.rect, xref=xref_frente)
+
+def mascara_texto(gris: Image.Image) -> Image.Image:
+    """
+    Máscara (modo 'L', 255 = texto) de la tinta de una página en grises:
+    pixeles bastante más oscuros que la media de su entorno y pegados a un
+    borde fuerte. Las zonas oscuras pero suaves de las fotos quedan en el
+    fondo.
+    """
+    radio = max(2, gris.width // 200)
+    media = gris.filter(ImageFilter.BoxBlur(radio))
+    oscuro = ImageChops.subtract(media, gris).point(lambda v: 255 if v > DIFERENCIA_TINTA else 0)
+    maximo = extremo_local(extremo_local(gris, ImageChops.lighter), ImageChops.lighter)
+    borde = ImageChops.subtract(maximo, gris).point(lambda v: 255 if v > CONTRASTE_BORDE_TINTA else 0)
+    return ImageChops.multiply(oscuro, borde)
+
+def fondo_mrc(rgb: Image.Image, mascara: Image.Image, escala: float) -> Image.Image:
+    """
+    Fondo a baja resolución sin el texto: las celdas con tinta toman el
+    color más claro de su entorno (el papel), así el JPEG no gasta bytes en
+    bordes de letras que ya están en la máscara.
+    """
+    tamaño = (max(1, round(rgb.width * escala)), max(1, round(rgb.height * escala)))
+    fondo = rgb.resize(tamaño, Image.Resampling.BOX)
+    con_tinta = mascara.resize(tamaño, Image.Resampling.BOX).point(lambda v: 255 if v else 0)
+    papel = extremo_local(extremo_local(fondo, ImageChops.lighter), ImageChops.lighter)
+    return Image.composite(papel, fondo, con_tinta)
+
+def frente_mrc(rgb: Image.Image, mascara: Image.Image) -> Image.Image:
+    """
+    Color del texto: promedio de los pixeles de tinta en cada celda de
+    REDUCCION_FRENTE x REDUCCION_FRENTE. Las celdas sin tinta quedan en
+    negro (no se pintan).
+    """
+    suma = ImageChops.multiply(rgb, Image.merge("RGB", (mascara,) * 3)).reduce(REDUCCION_FRENTE)
+    cuenta = mascara.reduce(REDUCCION_FRENTE)
+    canales = [
+        ImageMath.lambda_eval(lambda a: a['convert'](a['s'] * 255 / (a['c'] + (a['c'] == 0)), 'L'),
+                              s=canal, c=cuenta)
+        for canal in suma.split()
+    ]
+    return Image.merge("RGB", canales)
+
+def codificar_g4(bits: Image.Image):
+    """
+    Codifica una imagen de modo '1' con CCITT Group 4 a través del escritor
+    TIFF de PIL (requiere libtiff). Devuelve (datos, negro_es_1) o None.
+    """
+    if not TIFF_G4:
         return None
+    buffer = io.BytesIO()
+    # Una sola tira: las tiras G4 no se pueden concatenar
+    bits.save(buffer, format='TIFF', compression='group4', tiffinfo={278: bits.height})
+    tiff = Image.open(buffer)
+    desplazamientos, longitudes = tiff.tag_v2[273], tiff.tag_v2[279]
+    if len(desplazamientos) != 1:
+        return None
+    datos = buffer.getvalue()[desplazamientos[0]:desplazamientos[0] + longitudes[0]]
+    # PIL escribe modo '1' como MinIsBlack (262 = 1), que en PDF es BlackIs1
+    return datos, tiff.tag_v2.get(262) == 1
 
 def comprimir_pdf_simple_mejorado(ruta_entrada: str, ruta_salida: str) -> str:
     """
@@ -500,7 +1873,6 @@ def comprimir_pdf_basico_seguro(ruta_entrada: str, ruta_salida: str) -> str:
         
     except Exception:
         # Si incluso esto falla, hacer copia simple
-        import shutil
         shutil.copy2(ruta_entrada, ruta_salida)
         return ruta_salida
 
@@ -600,40 +1972,28 @@ def obtener_info_compresion(ruta_original: str, ruta_comprimida: str) -> dict:
 # Función de prueba y diagnóstico
 def diagnosticar_pdf(ruta_pdf: str):
     """
-    Analiza un PDF para entender por qué es tan grande.
+    Analiza un PDF para entender por qué es tan grande (ver
+    analisis_model.analizar_pdf) y devuelve el análisis.
     """
     try:
-        doc = fitz.open(ruta_pdf)
-        
-        total_imagenes = 0
-        tamaño_imagenes = 0
-        
-        for pagina in doc:
-            imagenes = pagina.get_images(full=True)
-            total_imagenes += len(imagenes)
-            
-            for img_info in imagenes:
-                try:
-                    xref = img_info[0]
-                    if xref > 0:
-                        img_dict = doc.extract_image(xref)
-                        tamaño_imagenes += len(img_dict["image"])
-                except:
-                    continue
-        
-        doc.close()
-        
-        tamaño_archivo = os.path.getsize(ruta_pdf)
+        analisis = analisis_model.analizar_pdf(ruta_pdf)
+        tamaño_archivo = analisis['tamaño']
         
         print(f"\n📊 DIAGNÓSTICO DEL PDF:")
-        print(f"📄 Páginas: {doc.page_count}")
-        print(f"🖼️  Imágenes encontradas: {total_imagenes}")
+        print(f"📄 Páginas: {analisis['paginas']}")
         print(f"📏 Tamaño total: {tamaño_archivo / (1024*1024):.2f} MB")
-        print(f"🎨 Tamaño de imágenes: {tamaño_imagenes / (1024*1024):.2f} MB")
-        print(f"📝 Porcentaje de imágenes: {(tamaño_imagenes/tamaño_archivo)*100:.1f}%")
+        for categoria, bytes_categoria in analisis['categorias'].items():
+            if bytes_categoria:
+                print(f"  {categoria}: {bytes_categoria / (1024*1024):.2f} MB "
+                      f"({analisis['fracciones'][categoria] * 100:.1f}%)")
+        for filtro, datos in analisis['imagenes_por_filtro'].items():
+            print(f"🖼️  {filtro}: {datos['cantidad']} imágenes, {datos['bytes'] / (1024*1024):.2f} MB")
+        print(f"⏱️  Análisis en {analisis['segundos']} s")
+        return analisis
         
     except Exception as e:
         print(f"Error en diagnóstico: {e}")
+        return None
 
 def test_compresion(ruta_pdf: str):
     """
@@ -659,4 +2019,92 @@ def test_compresion(ruta_pdf: str):
         
     except Exception as e:
         print(f"❌ Error: {e}")
-        return None
\ No newline at end of file
+        return None
+
+def benchmark_workers(ruta_pdf: str, nivel: str = 'media', lista_workers=(1, 2, 4, 8)) -> dict:
+    """
+    Mide el tiempo de compresión con distinta cantidad de procesos.
+    """
+    resultados = {}
+    base = None
+    
+    for workers in lista_workers:
+        inicio = time.perf_counter()
+        ruta_comprimida = comprimir_pdf(ruta_pdf, nivel, workers=workers)
+        segundos = time.perf_counter() - inicio
+        base = base or segundos
+        resultados[workers] = {
+            "segundos": round(segundos, 2),
+            "aceleracion": round(base / segundos, 2) if segundos > 0 else 0,
+            "tamaño_bytes": os.path.getsize(ruta_comprimida)
+        }
+    
+    print(f"\n⏱️  BENCHMARK ({nivel}):")
+    for workers, datos in resultados.items():
+        print(f"  {workers} procesos: {datos['segundos']} s  x{datos['aceleracion']}  {datos['tamaño_bytes']} bytes")
+    
+    return resultados
+
+def benchmark_jbig2(ruta_pdf: str, nivel: str = 'alta') -> dict:
+    """
+    Compara G4 y JBIG2 sobre todas las páginas renderizadas en 1 bit como
+    en el modo bilevel: páginas por segundo y bytes por página. Las páginas
+    que JBIG2 rechaza cuentan lo que el modo bilevel usaría en su lugar
+    (G4 o Flate) y se informan en 'rechazadas'.
+    """
+    config = CONFIGURACIONES[nivel]
+    doc = fitz.open(ruta_pdf)
+    resultados = {'g4': {'segundos': 0.0, 'bytes': 0}, 'jbig2': {'segundos': 0.0, 'bytes': 0, 'rechazadas': 0}}
+    
+    for pagina in doc:
+        bits = binarizar(renderizar_pagina(pagina, config_bilevel(config), gris=True))
+        
+        inicio = time.perf_counter()
+        g4 = codificar_g4(bits)
+        resultados['g4']['segundos'] += time.perf_counter() - inicio
+        flate = len(zlib.compress(bits.tobytes()))
+        resultados['g4']['bytes'] += len(g4[0]) if g4 else flate
+        
+        inicio = time.perf_counter()
+        datos = jbig2_model.codificar_jbig2(ImageChops.invert(bits))
+        resultados['jbig2']['segundos'] += time.perf_counter() - inicio
+        if datos:
+            resultados['jbig2']['bytes'] += len(datos)
+        else:
+            # Lo que elige codificar_1bit sin JBIG2
+            resultados['jbig2']['bytes'] += min(len(g4[0]), flate) if g4 else flate
+            resultados['jbig2']['rechazadas'] += 1
+    
+    paginas = doc.page_count
+    doc.close()
+    
+    print(f"\n⏱️  BENCHMARK 1 BIT ({nivel}, {paginas} páginas):")
+    for codificador, datos in resultados.items():
+        datos['paginas_por_segundo'] = round(paginas / datos['segundos'], 2) if datos['segundos'] > 0 else 0
+        datos['bytes_por_pagina'] = round(datos['bytes'] / paginas) if paginas else 0
+        print(f"  {codificador}: {datos['paginas_por_segundo']} pág/s  {datos['bytes_por_pagina']} bytes/pág")
+    if resultados['jbig2']['rechazadas']:
+        print(f"  jbig2 rechazó {resultados['jbig2']['rechazadas']} páginas (cuentan con G4/Flate)")
+    
+    return resultados
+
+def benchmark_niveles(ruta_pdf: str, niveles=('media', 'velocidad', 'alta', 'maxima')) -> dict:
+    """
+    Compara tiempo y tamaño de salida de varios niveles sobre el mismo PDF.
+    """
+    resultados = {}
+    
+    for nivel in niveles:
+        inicio = time.perf_counter()
+        ruta_comprimida = comprimir_pdf(ruta_pdf, nivel)
+        segundos = time.perf_counter() - inicio
+        resultados[nivel] = {
+            "segundos": round(segundos, 2),
+            "tamaño_bytes": os.path.getsize(ruta_comprimida)
+        }
+    
+    print(f"\n⏱️  BENCHMARK NIVELES ({os.path.basename(ruta_pdf)}):")
+    for nivel, datos in resultados.items():
+        print(f"  {nivel}: {datos['segundos']} s  {datos['tamaño_bytes']} bytes")
+    
+    return resultados
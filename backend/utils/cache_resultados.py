@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+# Caché en disco de resultados de compresión, direccionada por contenido:
+# la clave es el hash del archivo de entrada más los parámetros que
+# determinan la salida (tipo, nivel, versión del motor...).
+DIRECTORIO_CACHE = os.path.join(tempfile.gettempdir(), 'compresser_cache')
+TAMAÑO_MAXIMO_CACHE = 1024 * 1024 * 1024
+TAM_BLOQUE_HASH = 1024 * 1024
+
+def hash_archivo(ruta: str) -> str:
+    """
+    SHA-256 del archivo leído por bloques (no lo carga entero en memoria).
+    """
+    h = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(TAM_BLOQUE_HASH), b''):
+            h.update(bloque)
+    return h.hexdigest()
+
+def calcular_clave(ruta: str, parametros: dict) -> str:
+    """
+    Clave de caché: hash del contenido de ruta más los parámetros, que
+    deben incluir todo lo que cambia el resultado.
+    """
+    h = hashlib.sha256(hash_archivo(ruta).encode())
+    h.update(json.dumps(parametros, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+def ruta_entrada(clave: str, directorio: str = None) -> str:
+    return os.path.join(directorio or DIRECTORIO_CACHE, clave)
+
+def buscar(clave: str, directorio: str = None):
+    """
+    Devuelve la ruta del resultado guardado para clave, o None. Un acierto
+    actualiza la fecha de modificación, que es el orden LRU de podar.
+    """
+    ruta = ruta_entrada(clave, directorio)
+    try:
+        os.utime(ruta)
+    except OSError:
+        return None
+    return ruta
+
+def recuperar(clave: str, ruta_destino: str, directorio: str = None) -> bool:
+    """
+    Copia el resultado guardado para clave a ruta_destino. Devuelve False
+    si no hay entrada o si otro proceso la borró (podar) entre buscar y
+    copiar: quien llama comprime como si no estuviera en caché.
+    """
+    guardado = buscar(clave, directorio)
+    if not guardado:
+        return False
+    try:
+        shutil.copyfile(guardado, ruta_destino)
+    except OSError as e:
+        print(f"No se pudo leer de la caché: {e}")
+        return False
+    print(f"Resultado tomado de la caché: {guardado}")
+    return True
+
+def guardar(clave: str, ruta_resultado: str, directorio: str = None,
+            tamaño_maximo: int = TAMAÑO_MAXIMO_CACHE):
+    """
+    Copia ruta_resultado a la caché. La escritura es atómica: se copia a un
+    temporal en el mismo directorio y se renombra, así un lector nunca ve
+    una entrada a medio escribir. Devuelve la ruta de la entrada o None si
+    no se pudo guardar (la caché nunca hace fallar una compresión).
+    """
+    directorio = directorio or DIRECTORIO_CACHE
+    if os.path.getsize(ruta_resultado) > tamaño_maximo:
+        return None
+
+    try:
+        os.makedirs(directorio, exist_ok=True)
+        descriptor, ruta_temporal = tempfile.mkstemp(dir=directorio, suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'wb') as destino, open(ruta_resultado, 'rb') as origen:
+                shutil.copyfileobj(origen, destino)
+            os.replace(ruta_temporal, ruta_entrada(clave, directorio))
+        except BaseException:
+            os.remove(ruta_temporal)
+            raise
+    except OSError as e:
+        print(f"No se pudo guardar en caché: {e}")
+        return None
+
+    podar(directorio, tamaño_maximo)
+    return ruta_entrada(clave, directorio)
+
+def podar(directorio: str = None, tamaño_maximo: int = TAMAÑO_MAXIMO_CACHE) -> int:
+    """
+    Borra las entradas usadas hace más tiempo hasta que el total quede por
+    debajo de tamaño_maximo. Devuelve cuántas entradas borró.
+    """
+    directorio = directorio or DIRECTORIO_CACHE
+    entradas = []
+    try:
+        with os.scandir(directorio) as it:
+            for entrada in it:
+                # Los .tmp son escrituras en curso de otro proceso
+                if entrada.is_file() and not entrada.name.endswith('.tmp'):
+                    estado = entrada.stat()
+                    entradas.append((estado.st_mtime, estado.st_size, entrada.path))
+    except OSError:
+        return 0
+
+    total = sum(tamaño for _, tamaño, _ in entradas)
+    borradas = 0
+    for _, tamaño, ruta in sorted(entradas):
+        if total <= tamaño_maximo:
+            break
+        try:
+            os.remove(ruta)
+        except OSError:
+            continue
+        total -= tamaño
+        borradas += 1
+    return borradas
@@ -1,24 +1,193 @@
+import time
+INICIO_PROCESO = time.perf_counter()
+
 import argparse
+import json
+import os
 import sys
 import fitz
 from backend.controllers import compress_controller
-print("[debug] Python ejecutado:", sys.executable)
-print("[debug] Versión PyMuPDF:", fitz.__doc__)
+from backend.models import pdf_model
+FIN_IMPORTACION = time.perf_counter()
+
+class ProgresoJSON:
+    """
+    Emite el avance como un objeto JSON por línea (JSON lines) en la salida
+    indicada, agregando bytes acumulados, tiempo transcurrido y ETA.
+    """
+
+    def __init__(self, salida):
+        self.salida = salida
+        self.inicio = time.perf_counter()
+        self.primera_pagina = None
+        self.ultima_pagina = None
+        self.bytes = 0
+
+    def emitir(self, evento: dict):
+        self.salida.write(json.dumps(evento) + "\n")
+        self.salida.flush()
+
+    def __call__(self, evento: dict):
+        ahora = time.perf_counter()
+        if evento.get('evento') == 'pagina':
+            self.primera_pagina = self.primera_pagina or ahora
+            self.ultima_pagina = ahora
+            self.bytes += evento.pop('bytes_nuevos', 0)
+            transcurrido = ahora - self.inicio
+            hechas, total = evento['pagina'], evento['total']
+            evento['bytes'] = self.bytes
+            evento['transcurrido'] = round(transcurrido, 3)
+            evento['eta'] = round(transcurrido / hechas * (total - hechas), 3) if hechas else None
+        self.emitir(evento)
+
+    def etapas(self, fin: float) -> dict:
+        """
+        Tiempos por etapa: importación, análisis previo a la primera página,
+        procesamiento de páginas y guardado final.
+        """
+        primera = self.primera_pagina or fin
+        ultima = self.ultima_pagina or fin
+        return {
+            'importacion': round(FIN_IMPORTACION - INICIO_PROCESO, 3),
+            'analisis': round(primera - self.inicio, 3),
+            'paginas': round(ultima - primera, 3),
+            'guardado': round(fin - ultima, 3),
+            'total': round(fin - INICIO_PROCESO, 3)
+        }
+
 def main():
     parser = argparse.ArgumentParser(description="Compresor de archivos")
-    parser.add_argument('--tipo', required=True, help='Tipo de archivo: pdf, jpeg, png, docx, pptx')
-    parser.add_argument('--ruta', required=True, help='Ruta del archivo a comprimir')
+    parser.add_argument('--tipo', required=False, help='Tipo de archivo: pdf, jpeg, png, docx, pptx')
+    parser.add_argument('--ruta', required=False, help='Ruta del archivo a comprimir')
     parser.add_argument('--nivel', required=False, default='seguro', help='Nivel de compresión (seguro o maximo)')
+    parser.add_argument('--workers', required=False, type=int, default=1, help='Procesos en paralelo para PDF (1 = en serie)')
+    parser.add_argument('--ventana', required=False, type=int, default=None, help='Páginas por ventana en modo de memoria acotada')
+    parser.add_argument('--objetivo-bytes', required=False, type=int, default=None, help='Tamaño máximo deseado en bytes (ignora --nivel)')
+    parser.add_argument('--sin-cache', action='store_true', help='No usar ni guardar resultados en la caché')
+    parser.add_argument('--json', action='store_true', help='Emitir avance y resultado como JSON lines en stdout')
+    parser.add_argument('--servidor', action='store_true', help='Atender solicitudes JSON por stdin sin terminar el proceso')
+    parser.add_argument('--estimar', action='store_true', help='Solo estimar tamaño y tiempo de cada nivel (JSON en stdout)')
+    parser.add_argument('--analizar', action='store_true', help='Solo analizar a qué se van los bytes del archivo (JSON en stdout)')
+    parser.add_argument('--max-trabajos', required=False, type=int, default=2, help='Trabajos simultáneos en modo servidor')
 
     args = parser.parse_args()
 
+    if args.servidor:
+        return main_servidor(args)
+    if not args.tipo or not args.ruta:
+        parser.error("--tipo y --ruta son obligatorios (salvo con --servidor)")
+    if args.estimar:
+        return main_estimar(args)
+    if args.analizar:
+        return main_analizar(args)
+    if args.json:
+        return main_json(args)
+
+    print("[debug] Python ejecutado:", sys.executable)
+    print("[debug] Versión PyMuPDF:", fitz.__doc__)
+
     resultado = compress_controller.comprimir(
         tipo=args.tipo,
         ruta=args.ruta,
-        nivel=args.nivel
+        nivel=args.nivel,
+        workers=args.workers,
+        objetivo_bytes=args.objetivo_bytes,
+        ventana=args.ventana,
+        usar_cache=not args.sin_cache
     )
 
     print(resultado)
 
+def reservar_stdout():
+    """
+    Deja stdout solo para el protocolo JSON: devuelve un archivo sobre el
+    stdout original y desvía el texto libre (incluido el de los procesos
+    hijos) a stderr.
+    """
+    sys.stdout.flush()
+    salida = os.fdopen(os.dup(sys.stdout.fileno()), 'w', encoding='utf-8')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    return salida
+
+def main_servidor(args):
+    """
+    Modo --servidor: proceso de larga vida que atiende solicitudes JSON
+    por stdin (ver servidor_controller.servir).
+    """
+    from backend.controllers import servidor_controller
+
+    salida = reservar_stdout()
+    servidor_controller.servir(sys.stdin, salida, max_trabajos=args.max_trabajos)
+    salida.close()
+    return 0
+
+def main_estimar(args):
+    """
+    Modo --estimar: imprime en stdout un objeto JSON con la estimación de
+    cada nivel, sin comprimir el archivo.
+    """
+    salida = reservar_stdout()
+    resultado = compress_controller.estimar(args.ruta, args.tipo)
+    resultado['segundos'] = round(time.perf_counter() - INICIO_PROCESO, 3)
+    salida.write(json.dumps(resultado, ensure_ascii=False) + "\n")
+    salida.close()
+    return 0 if resultado['ok'] else 1
+
+def main_analizar(args):
+    """
+    Modo --analizar: imprime en stdout un objeto JSON con la anatomía del
+    archivo, sin comprimirlo.
+    """
+    salida = reservar_stdout()
+    resultado = compress_controller.analizar(args.ruta, args.tipo)
+    salida.write(json.dumps(resultado, ensure_ascii=False) + "\n")
+    salida.close()
+    return 0 if resultado['ok'] else 1
+
+def main_json(args):
+    """
+    Modo --json: stdout solo lleva eventos JSON.
+    """
+    salida = reservar_stdout()
+
+    progreso = ProgresoJSON(salida)
+    progreso.emitir({'evento': 'inicio', 'ruta': args.ruta, 'tipo': args.tipo, 'nivel': args.nivel})
+
+    resultado = compress_controller.comprimir_detallado(
+        tipo=args.tipo,
+        ruta=args.ruta,
+        nivel=args.nivel,
+        workers=args.workers,
+        objetivo_bytes=args.objetivo_bytes,
+        ventana=args.ventana,
+        progreso=progreso,
+        usar_cache=not args.sin_cache
+    )
+    fin = time.perf_counter()
+
+    evento = {
+        'evento': 'resultado',
+        'ok': resultado['ok'],
+        'mensaje': resultado['mensaje'],
+        'salida': resultado['salida'],
+        'cache': resultado.get('cache', False),
+        'etapas': progreso.etapas(fin)
+    }
+    if 'objetivo_cumplido' in resultado:
+        evento['objetivo_cumplido'] = resultado['objetivo_cumplido']
+    # Sin objetivo cumplido igual hay salida: se informa cuánto se logró
+    if resultado['salida']:
+        tamaño_original = os.path.getsize(args.ruta)
+        tamaño_comprimido = os.path.getsize(resultado['salida'])
+        evento.update({
+            'tamaño_original': tamaño_original,
+            'tamaño_comprimido': tamaño_comprimido,
+            'ratio': round(tamaño_comprimido / tamaño_original, 4) if tamaño_original else None,
+            'info': pdf_model.obtener_info_compresion(args.ruta, resultado['salida'])
+        })
+    progreso.emitir(evento)
+    salida.close()
+    return 0 if resultado['ok'] else 1
+
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -241,6 +241,92 @@ ipcMain.handle('debug-paths', async () => {
   };
 });
 
+// ===== SERVIDOR PYTHON PERSISTENTE =====
+// Un solo proceso 'compress.py --servidor' atiende todas las compresiones,
+// así no se paga el arranque de Python e importaciones por archivo.
+let servidorPython = null;
+let contadorTrabajos = 0;
+
+function obtenerServidorPython(pythonInfo) {
+  if (servidorPython && servidorPython.proceso.exitCode === null && !servidorPython.proceso.killed) {
+    return servidorPython;
+  }
+  const { spawn } = require('child_process');
+
+  const proceso = spawn(pythonInfo.pythonExe, [pythonInfo.script, '--servidor'], {
+    cwd: pythonInfo.basePath,
+    stdio: ['pipe', 'pipe', 'pipe'],
+    windowsHide: true
+  });
+  const servidor = { proceso, trabajos: new Map(), pendiente: '' };
+  console.log('✅ Servidor Python iniciado con PID:', proceso.pid);
+
+  proceso.stdout.on('data', (data) => {
+    servidor.pendiente += data.toString();
+    const lineas = servidor.pendiente.split('\n');
+    servidor.pendiente = lineas.pop();
+    lineas.forEach((linea) => {
+      if (!linea.trim().startsWith('{')) return;
+      let evento;
+      try {
+        evento = JSON.parse(linea);
+      } catch (parseError) {
+        console.log('⚠️ Línea JSON inválida:', linea);
+        return;
+      }
+      const trabajo = servidor.trabajos.get(evento.id);
+      if (!trabajo) return;
+      if (evento.evento === 'pagina') {
+        trabajo.onProgreso(evento);
+      } else if (evento.evento === 'resultado' || evento.evento === 'cancelado') {
+        servidor.trabajos.delete(evento.id);
+        trabajo.resolve(evento);
+      } else if (evento.evento === 'error') {
+        servidor.trabajos.delete(evento.id);
+        trabajo.reject(new Error(evento.mensaje));
+      }
+    });
+  });
+
+  proceso.stderr.on('data', (data) => {
+    console.log('🐍 Servidor stderr:', data.toString().trim());
+  });
+
+  const alTerminar = (motivo) => {
+    servidor.trabajos.forEach((trabajo) => trabajo.reject(new Error(motivo)));
+    servidor.trabajos.clear();
+    if (servidorPython === servidor) servidorPython = null;
+  };
+  proceso.stdin.on('error', (error) => alTerminar(`Error escribiendo al servidor Python: ${error.message}`));
+  proceso.on('exit', (code) => alTerminar(`Servidor Python terminó con código ${code}`));
+  proceso.on('error', (error) => alTerminar(`Error en servidor Python: ${error.message}`));
+
+  servidorPython = servidor;
+  return servidor;
+}
+
+function comprimirConServidor(pythonInfo, solicitud, onProgreso, timeoutMs) {
+  const servidor = obtenerServidorPython(pythonInfo);
+  const id = `t${++contadorTrabajos}`;
+
+  return new Promise((resolve, reject) => {
+    const timer = setTimeout(() => {
+      servidor.trabajos.delete(id);
+      servidor.proceso.stdin.write(JSON.stringify({ id: `cancelar-${id}`, accion: 'cancelar', trabajo: id }) + '\n');
+      const error = new Error('Timeout: El proceso tardó demasiado');
+      error.timeout = true;
+      reject(error);
+    }, timeoutMs);
+
+    servidor.trabajos.set(id, {
+      onProgreso,
+      resolve: (evento) => { clearTimeout(timer); resolve(evento); },
+      reject: (error) => { clearTimeout(timer); reject(error); }
+    });
+    servidor.proceso.stdin.write(JSON.stringify({ id, accion: 'comprimir', ...solicitud }) + '\n');
+  });
+}
+
 // ===== HANDLER PARA COMPRESIÓN PDF =====
 ipcMain.handle('compress-pdf', async (event, options) => {
   const { spawn } = require('child_process');
@@ -287,11 +373,37 @@ ipcMain.handle('compress-pdf', async (event, options) => {
     console.log('  - Python:', pythonInfo.pythonExe);
     console.log('  - Script:', pythonInfo.script);
 
+    // Primero el servidor persistente; si no está disponible, un proceso por archivo
+    try {
+      const evento = await comprimirConServidor(
+        pythonInfo,
+        { tipo, ruta: inputPath, nivel },
+        (progreso) => event.sender.send('compress-progress', progreso),
+        60000
+      );
+      if (evento.evento === 'cancelado') {
+        return { success: false, error: 'Compresión cancelada' };
+      }
+      if (!evento.ok) {
+        return { success: false, error: evento.mensaje };
+      }
+      if (evento.salida && fs.existsSync(evento.salida)) {
+        return { success: true, outputPath: evento.salida, resultado: evento };
+      }
+      return { success: false, error: 'No pude extraer la ruta de salida del script' };
+    } catch (errorServidor) {
+      if (errorServidor.timeout) {
+        return { success: false, error: errorServidor.message };
+      }
+      console.log('⚠️ Servidor Python no disponible, se usa un proceso por archivo:', errorServidor.message);
+    }
+
     const args = [
       pythonInfo.script,
       '--tipo', tipo,
       '--ruta', inputPath,
-      '--nivel', nivel
+      '--nivel', nivel,
+      '--json'
     ];
 
 
@@ -319,6 +431,23 @@ ipcMain.handle('compress-pdf', async (event, options) => {
       let stdout = '';
       let stderr = '';
       let hasResolved = false;
+      // Modo --json: cada línea de stdout es un evento JSON
+      let pendiente = '';
+      let resultadoJSON = null;
+
+      const procesarLinea = (linea) => {
+        if (!linea.trim().startsWith('{')) return;
+        try {
+          const evento = JSON.parse(linea);
+          if (evento.evento === 'resultado') {
+            resultadoJSON = evento;
+          } else if (evento.evento === 'pagina') {
+            event.sender.send('compress-progress', evento);
+          }
+        } catch (parseError) {
+          console.log('⚠️ Línea JSON inválida:', linea);
+        }
+      };
       
       const resolveOnce = (result) => {
         if (!hasResolved) {
@@ -331,6 +460,11 @@ ipcMain.handle('compress-pdf', async (event, options) => {
         const output = data.toString();
         stdout += output;
         console.log('🐍 Python stdout:', output.trim());
+
+        pendiente += output;
+        const lineas = pendiente.split('\n');
+        pendiente = lineas.pop();
+        lineas.forEach(procesarLinea);
       });
       
       pythonProcess.stderr.on('data', (data) => {
@@ -342,14 +476,23 @@ ipcMain.handle('compress-pdf', async (event, options) => {
             pythonProcess.on('close', (code) => {
         console.log(`🐍 Python proceso terminado con código: ${code}`);
         
-        if (code === 0) {
-          // extrae la ruta de salida del stdout
+        procesarLinea(pendiente);
+
+        if (resultadoJSON && !resultadoJSON.ok) {
+          resolveOnce({
+            success: false,
+            error:   resultadoJSON.mensaje,
+            stdout, stderr
+          });
+        } else if (code === 0) {
+          // ruta de salida del evento 'resultado' (o, si no hubo, del texto)
           const match = stdout.trim().match(/:\s*(.+\.pdf)$/i);
-          const generated = match && match[1];
+          const generated = resultadoJSON ? resultadoJSON.salida : (match && match[1]);
           if (generated && fs.existsSync(generated)) {
             resolveOnce({
               success:   true,
               outputPath: generated,
+              resultado: resultadoJSON,
               stdout, stderr
             });
           } else {
@@ -479,6 +622,12 @@ app.whenReady().then(() => {
   });
 });
 
+app.on('will-quit', () => {
+  if (servidorPython) {
+    servidorPython.proceso.stdin.end(JSON.stringify({ id: 'salir', accion: 'salir' }) + '\n');
+  }
+});
+
 app.on('window-all-closed', () => {
   if (process.platform !== 'darwin') {
     app.quit();
@@ -0,0 +1,74 @@
+"""
+Estimación previa (estimar_pdf): en un PDF nativo el tamaño real de cada
+nivel debe caer dentro de las cotas estimadas.
+"""
+import contextlib
+import io
+import random
+
+import fitz
+import pytest
+from PIL import Image
+
+from backend.models import pdf_model
+
+PAGINAS = 12
+
+
+def crear_pdf(ruta):
+    """
+    PDF nativo: un logo compartido y, en cada página, cantidad de texto
+    variable y una foto propia con distinto ruido.
+    """
+    rng = random.Random(2)
+    logo = io.BytesIO()
+    Image.merge('RGB', [Image.effect_noise((400, 200), 60),
+                        Image.linear_gradient('L').resize((400, 200)),
+                        Image.effect_noise((400, 200), 30)]).save(logo, 'PNG')
+
+    doc = fitz.open()
+    xref_logo = 0
+    for i in range(PAGINAS):
+        pagina = doc.new_page()
+        rect_logo = fitz.Rect(40, 30, 160, 90)
+        if xref_logo:
+            pagina.insert_image(rect_logo, xref=xref_logo)
+        else:
+            xref_logo = pagina.insert_image(rect_logo, stream=logo.getvalue())
+        foto = io.BytesIO()
+        Image.merge('RGB', [Image.effect_noise((600, 400), 20 + i),
+                            Image.linear_gradient('L').rotate(i * 30).resize((600, 400)),
+                            Image.effect_noise((600, 400), 10)]).save(foto, 'JPEG', quality=95)
+        pagina.insert_image(fitz.Rect(50, 420, 50 + 8 * i + 200, 760), stream=foto.getvalue())
+        texto = "\n".join(
+            " ".join("".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(2, 9)))
+                     for _ in range(12))
+            for _ in range(rng.randint(5, 25)))
+        pagina.insert_textbox(fitz.Rect(50, 110, 560, 410), texto, fontsize=9)
+    doc.save(ruta)
+    doc.close()
+
+
+@pytest.fixture(scope='module')
+def original(tmp_path_factory):
+    ruta = tmp_path_factory.mktemp('estimacion') / 'nativo.pdf'
+    crear_pdf(ruta)
+    return ruta
+
+
+@pytest.fixture(scope='module')
+def estimaciones(original):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return pdf_model.estimar_pdf(str(original))
+
+
+@pytest.mark.parametrize('nivel', list(pdf_model.CONFIGURACIONES))
+def test_tamaño_real_dentro_de_las_cotas(original, estimaciones, nivel, tmp_path):
+    with contextlib.redirect_stdout(io.StringIO()):
+        salida = pdf_model.comprimir_pdf(str(original), nivel, ruta_salida=str(tmp_path / f'{nivel}.pdf'))
+    real = (tmp_path / f'{nivel}.pdf').stat().st_size
+
+    estimacion = estimaciones[nivel]
+    assert salida and estimacion['bytes_min'] <= real <= estimacion['bytes_max'], (
+        f"{nivel}: real {real}, estimado {estimacion['bytes']} "
+        f"[{estimacion['bytes_min']}, {estimacion['bytes_max']}]")
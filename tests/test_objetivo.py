@@ -0,0 +1,58 @@
+"""
+Modo por tamaño objetivo (comprimir_pdf_objetivo): un PDF nativo debe
+alcanzar lo que alcanza un nivel fijo sin perder el texto.
+"""
+import contextlib
+import io
+import random
+
+import fitz
+from PIL import Image
+
+from backend.models import pdf_model
+
+PAGINAS = 8
+
+
+def crear_pdf(ruta):
+    """
+    PDF nativo: texto en cada página y un logo (PNG con ruido) compartido.
+    """
+    rng = random.Random(1)
+    logo = Image.merge('RGB', [Image.effect_noise((500, 300), 60),
+                               Image.linear_gradient('L').resize((500, 300)),
+                               Image.effect_noise((500, 300), 30)])
+    buffer = io.BytesIO()
+    logo.save(buffer, 'PNG')
+
+    doc = fitz.open()
+    xref = 0
+    for _ in range(PAGINAS):
+        pagina = doc.new_page()
+        rect_logo = fitz.Rect(40, 30, 190, 120)
+        if xref:
+            pagina.insert_image(rect_logo, xref=xref)
+        else:
+            xref = pagina.insert_image(rect_logo, stream=buffer.getvalue())
+        texto = "\n".join(
+            " ".join("".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(2, 9)))
+                     for _ in range(12))
+            for _ in range(45))
+        pagina.insert_textbox(fitz.Rect(50, 140, 560, 780), texto, fontsize=9)
+    doc.save(ruta)
+    doc.close()
+
+
+def test_alcanza_el_tamaño_de_media_y_conserva_el_texto(tmp_path):
+    original = tmp_path / 'nativo.pdf'
+    crear_pdf(original)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        pdf_model.comprimir_pdf(str(original), 'media', ruta_salida=str(tmp_path / 'media.pdf'))
+        objetivo = (tmp_path / 'media.pdf').stat().st_size
+        salida = pdf_model.comprimir_pdf_objetivo(str(original), objetivo,
+                                                  ruta_salida=str(tmp_path / 'objetivo.pdf'))
+
+    assert (tmp_path / 'objetivo.pdf').stat().st_size <= objetivo
+    with fitz.open(salida) as doc:
+        assert all(pagina.get_text().strip() for pagina in doc)
@@ -0,0 +1,71 @@
+"""
+Modo por ventanas (comprimir_pdf_por_ventanas): la memoria pico no debe
+crecer con la cantidad de páginas.
+"""
+import io
+import subprocess
+import sys
+from pathlib import Path
+
+import fitz
+import pytest
+from PIL import Image
+
+resource = pytest.importorskip("resource")  # ru_maxrss: solo POSIX
+
+RAIZ = Path(__file__).resolve().parents[1]
+PAGINAS = 10
+TAM_VENTANA = 5
+# Margen para el ruido de MuPDF y del asignador; sin ventanas, 4x las
+# páginas duplica el pico
+TOLERANCIA = 1.15
+
+# Cada medición corre en un proceso nuevo: ru_maxrss es el pico de toda la
+# vida del proceso
+MEDIR = """
+import contextlib, io, resource, sys
+from backend.models import pdf_model
+config = dict(pdf_model.CONFIGURACIONES['maxima'])
+with contextlib.redirect_stdout(io.StringIO()):
+    pdf_model.comprimir_pdf_por_ventanas(sys.argv[1], sys.argv[2], config, tam_ventana=int(sys.argv[3]))
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def crear_pdf(ruta: Path, paginas: int):
+    """
+    PDF de páginas escaneadas, cada una con su propia imagen (no comparten
+    recursos, así cada página suma lo suyo).
+    """
+    doc = fitz.open()
+    for i in range(paginas):
+        pagina = doc.new_page()
+        img = Image.merge('RGB', [Image.effect_noise((900, 1200), 20 + i % 20),
+                                  Image.linear_gradient('L').resize((900, 1200)),
+                                  Image.effect_noise((900, 1200), 10)])
+        buffer = io.BytesIO()
+        img.save(buffer, 'JPEG', quality=97)
+        pagina.insert_image(pagina.rect, stream=buffer.getvalue())
+    doc.save(ruta)
+    doc.close()
+
+
+def pico_memoria(ruta: Path) -> int:
+    """
+    Memoria pico (KB) de comprimir el PDF por ventanas en un proceso aparte.
+    """
+    resultado = subprocess.run(
+        [sys.executable, '-c', MEDIR, str(ruta), str(ruta.with_suffix('.out.pdf')), str(TAM_VENTANA)],
+        cwd=RAIZ, capture_output=True, text=True, check=True)
+    return int(resultado.stdout.split()[-1])
+
+
+def test_pico_de_memoria_constante(tmp_path):
+    chico, grande = tmp_path / 'chico.pdf', tmp_path / 'grande.pdf'
+    crear_pdf(chico, PAGINAS)
+    crear_pdf(grande, 4 * PAGINAS)
+
+    pico_chico, pico_grande = pico_memoria(chico), pico_memoria(grande)
+
+    assert pico_grande <= pico_chico * TOLERANCIA, (
+        f"{4 * PAGINAS} páginas: {pico_grande} KB, {PAGINAS} páginas: {pico_chico} KB")